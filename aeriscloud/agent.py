@@ -0,0 +1,281 @@
+"""
+Client of the command agent running in boxes (see vagrant/agent.py), it
+runs commands over a persistent TCP connection on the host-only network
+instead of starting a new ssh process for each of them.
+
+The agent is optional, callers are expected to fall back to ssh when
+AgentUnavailable is raised.
+"""
+
+import atexit
+import binascii
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+
+from .config import config, data_dir
+from .log import get_logger
+
+logger = get_logger('agent')
+
+HEADER = struct.Struct('!cI')
+DEFAULT_PORT = 7900
+
+
+class AgentUnavailable(Exception):
+    """
+    Thrown when the agent of a box cannot be reached or refused the client,
+    the command was not started
+    """
+    pass
+
+
+class AgentError(Exception):
+    """
+    Thrown when the connection to the agent was lost while running a
+    command
+    """
+    pass
+
+
+def agent_enabled():
+    """
+    Whether the agent is installed in boxes and used to run commands
+
+    :return: bool
+    """
+    return config.get('agent', 'enabled', default='false') == 'true'
+
+
+def agent_port():
+    return int(config.get('agent', 'port', default=DEFAULT_PORT))
+
+
+def agent_token():
+    """
+    Return the token authenticating aeris to the agents, it is generated on
+    first use and given to the shell provisioner
+
+    :return: str
+    """
+    token_file = os.path.join(data_dir(), 'agent.token')
+    if not os.path.exists(token_file):
+        if not os.path.isdir(data_dir()):
+            os.makedirs(data_dir())
+        with os.fdopen(os.open(token_file,
+                               os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                               0600), 'w') as fd:
+            fd.write(binascii.hexlify(os.urandom(32)))
+    with open(token_file) as fd:
+        return fd.read().strip()
+
+
+def _recv_exactly(sock, size):
+    data = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError()
+        data.append(chunk)
+        size -= len(chunk)
+    return ''.join(data)
+
+
+class AgentConnection(object):
+    """
+    Authenticated connection to the agent of a box, runs one command at a
+    time
+    """
+
+    def __init__(self, host, port, token, timeout=1):
+        self.host = host
+        self._lock = threading.Lock()
+        try:
+            self._sock = socket.create_connection((host, port), timeout)
+            self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._send('A', token)
+            kind, payload = self._recv()
+        except (socket.error, EOFError) as e:
+            raise AgentUnavailable('could not connect to %s:%d: %s' %
+                                   (host, port, e))
+        if kind != 'A':
+            self._sock.close()
+            raise AgentUnavailable('agent of %s refused the connection: %s'
+                                   % (host, payload))
+        # commands can run for a long time without any output
+        self._sock.settimeout(None)
+
+    def _send(self, kind, payload=''):
+        with self._lock:
+            self._sock.sendall(HEADER.pack(kind, len(payload)) + payload)
+
+    def _recv(self):
+        kind, size = HEADER.unpack(_recv_exactly(self._sock, HEADER.size))
+        return kind, _recv_exactly(self._sock, size)
+
+    def signal(self, signum):
+        self._send('K', str(signum))
+
+    def run(self, cmd, stdout=None, stderr=None):
+        """
+        Run a command in a login shell in the home folder of the box,
+        streaming its output
+
+        :param cmd: str
+        :param stdout: file Defaults to sys.stdout
+        :param stderr: file Defaults to sys.stderr
+        :return: int The exit code of the command
+        """
+        stdout = stdout or sys.stdout
+        stderr = stderr or sys.stderr
+
+        started = False
+        try:
+            self._send('X', json.dumps({'cmd': cmd}))
+            while True:
+                kind, payload = self._recv()
+                started = True
+                if kind == 'O':
+                    stdout.write(payload)
+                    stdout.flush()
+                elif kind == 'R':
+                    stderr.write(payload)
+                    stderr.flush()
+                elif kind == 'C':
+                    return int(payload)
+                elif kind == 'F':
+                    raise AgentError(payload)
+        except (socket.error, EOFError) as e:
+            # a connection that died while idle (eg. the agent was
+            # restarted) is only noticed when sending the next command
+            if not started:
+                raise AgentUnavailable('lost connection to %s: %s' %
+                                       (self.host, e))
+            raise AgentError('lost connection to %s: %s' % (self.host, e))
+
+    def close(self):
+        self._sock.close()
+
+
+class AgentProcess(object):
+    """
+    Command running through the agent in a background thread, with the
+    subset of the Popen interface used to supervise commands
+    """
+
+    def __init__(self, connection, cmd):
+        self.returncode = None
+        self._connection = connection
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(cmd,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, cmd):
+        try:
+            self.returncode = self._connection.run(cmd)
+        except (AgentUnavailable, AgentError) as e:
+            logger.error(str(e))
+            self.returncode = 255
+        finally:
+            self._connection.close()
+            self._done.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        self._done.wait(timeout)
+        return self.returncode
+
+    def send_signal(self, signum):
+        if self.returncode is not None:
+            return
+        try:
+            self._connection.signal(signum)
+        except socket.error:
+            # the command just exited and the connection was closed
+            pass
+
+    def terminate(self):
+        self.send_signal(15)
+
+    def kill(self):
+        self.send_signal(9)
+
+
+class AgentPool(object):
+    """
+    Keeps one connection per box, connections that failed are reopened on
+    the next call. Boxes whose agent could not be reached are not tried
+    again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = {}
+        self._unavailable = set()
+
+    def _check(self, host):
+        # do not pay for a connection attempt on every command
+        if host in self._unavailable:
+            raise AgentUnavailable('agent of %s is not available' % host)
+
+    def connection(self, host):
+        self._check(host)
+        with self._lock:
+            if host not in self._connections:
+                self._connections[host] = AgentConnection(
+                    host, agent_port(), agent_token())
+            return self._connections[host]
+
+    def run(self, host, cmd):
+        """
+        Run a command on the agent of the given box, reconnecting once if
+        the pooled connection died since its last use
+
+        :param host: str
+        :param cmd: str
+        :return: int The exit code of the command
+        """
+        for attempt in range(2):
+            try:
+                return self.connection(host).run(cmd)
+            except AgentUnavailable:
+                self.close(host)
+                if attempt:
+                    self._unavailable.add(host)
+                    raise
+            except AgentError:
+                self.close(host)
+                raise
+
+    def popen(self, host, cmd):
+        """
+        Start a command on the agent of the given box on a new connection,
+        closed once the command exits
+
+        :param host: str
+        :param cmd: str
+        :return: AgentProcess
+        """
+        self._check(host)
+        try:
+            connection = AgentConnection(host, agent_port(), agent_token())
+        except AgentUnavailable:
+            self._unavailable.add(host)
+            raise
+        return AgentProcess(connection, cmd)
+
+    def close(self, host=None):
+        with self._lock:
+            for key in self._connections.keys():
+                if host is None or key == host:
+                    self._connections.pop(key).close()
+
+
+pool = AgentPool()
+atexit.register(pool.close)
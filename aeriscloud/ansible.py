@@ -1,6 +1,8 @@
 from __future__ import print_function, absolute_import
 
+import json
 import os
+import shutil
 
 from subprocess32 import Popen, PIPE, call
 
@@ -15,6 +17,7 @@ plugin_path = os.path.join(ansible_path, 'plugins')
 job_path = os.path.join(ansible_path, 'jobs')
 inventory_path = os.path.join(data_dir(), 'inventory')
 organization_path = os.path.join(data_dir(), 'organizations')
+vagrant_inventory_path = os.path.join(data_dir(), 'vagrant-inventories')
 
 logger = get_logger('ansible')
 
@@ -175,6 +178,63 @@ def get_inventory_file(inventory):
     return inv_file
 
 
+def write_box_inventory(name, boxes):
+    """
+    Write an inventory containing the given boxes, grouped by project. The
+    connection settings and the configuration of the project of every box
+    are written as host vars so that boxes from several projects can be
+    targeted by a single ansible run.
+
+    Hosts are named after their box like in the inventories generated by
+    vagrant, so that the provisioning history is keyed the same way, only
+    boxes whose name is used by several projects are named after their VM.
+
+    :param name: str Name of the inventory
+    :param boxes: list[aeriscloud.box.Box]
+    :return: str The path of the inventory file
+    """
+    inventory_dir = os.path.join(vagrant_inventory_path, name)
+    # hosts that are not part of the inventory anymore must not keep vars
+    if os.path.isdir(inventory_dir):
+        shutil.rmtree(inventory_dir)
+    os.makedirs(os.path.join(inventory_dir, 'host_vars'))
+
+    names = [box.name() for box in boxes]
+    groups = {}
+    for box in boxes:
+        host = box.name()
+        if names.count(host) > 1:
+            host = box.vm_name()
+        groups.setdefault(box.project.name(), []).append(host)
+
+        host_vars = dict(box.project.config())
+        host_vars.update({
+            'ansible_ssh_host': box.ip(),
+            'ansible_ssh_port': 22,
+            'ansible_ssh_user': 'vagrant',
+            'ansible_ssh_private_key_file': box.ssh_key()
+        })
+        # same ssh settings as the ansible provisioner of the Vagrantfile,
+        # boxes are recreated with the IPs of old ones
+        host_vars['ansible_ssh_common_args'] = ' '.join(
+            box.ssh_transport_options() + box.ssh_mux_options() +
+            ['-o', 'StrictHostKeyChecking=no',
+             '-o', 'UserKnownHostsFile=/dev/null'])
+
+        host_vars_file = os.path.join(inventory_dir, 'host_vars',
+                                      '%s.json' % host)
+        with open(host_vars_file, 'w') as fd:
+            json.dump(host_vars, fd, default=str)
+
+    inventory_file = os.path.join(inventory_dir, 'hosts')
+    with open(inventory_file, 'w') as fd:
+        for group in sorted(groups):
+            fd.write('[%s]\n' % group)
+            fd.write(''.join('%s\n' % host for host in groups[group]))
+            fd.write('\n')
+    return inventory_file
+
+
 def get_inventory_list():
     """
     Return the list of inventory files found in the AerisCloud inventory
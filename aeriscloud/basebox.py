@@ -1,5 +1,50 @@
-from .config import basebox_bucket
+"""
+Base boxes listing and local cache. Box files are downloaded once per host
+in parallel segments using HTTP range requests, verified, stored under
+data_dir by their sha256 and registered into vagrant from the local file,
+so that vagrant never downloads them itself.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+
+from distutils.version import LooseVersion
+
+import requests
+
+from subprocess32 import call
+
+from .clone import basebox_versions
+from .config import basebox_bucket, data_dir, default_organization
+from .log import get_logger
+from .organization import Organization
 from .s3 import S3
+from .utils import run_parallel
+
+logger = get_logger('basebox')
+
+DEFAULT_SEGMENTS = 4
+CHUNK_SIZE = 1024 * 1024
+# segments smaller than this are not worth their own connection
+MIN_SEGMENT_SIZE = 64 * 1024 * 1024
+# how many chunks are written between two saves of the download state
+SAVE_INTERVAL = 16
+
+
+# in-process locks of the files locked with _locked, by path
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+class BaseboxError(Exception):
+    """
+    Thrown when a base box cannot be found, downloaded or registered
+    """
+    pass
 
 
 def baseboxes():
@@ -30,3 +75,407 @@ def baseboxes():
         boxes[current_infra].append(box)
 
     return boxes
+
+
+def server_url(project):
+    """
+    Return the url vagrant fetches the base boxes metadata of a project
+    from, see vagrant.run
+
+    :param project: .project.Project
+    :return: str|None
+    """
+    organization = project.organization() or default_organization()
+    if not organization:
+        return None
+    return Organization(organization).basebox_url()
+
+
+def _latest_source(name, metadata):
+    versions = sorted([version for version in metadata.get('versions', [])
+                       if version.get('status', 'active') == 'active'],
+                      key=lambda version: LooseVersion(version['version']),
+                      reverse=True)
+    for version in versions:
+        for provider in version.get('providers', []):
+            if provider['name'] == 'virtualbox':
+                return {
+                    'name': name,
+                    'version': version['version'],
+                    'url': provider['url'],
+                    'checksum_type': provider.get('checksum_type'),
+                    'checksum': provider.get('checksum')
+                }
+    return None
+
+
+def basebox_source(name, url=None):
+    """
+    Find where the latest version of a base box is downloaded from, using
+    the vagrant metadata served at url like vagrant does, or the base box
+    bucket when no url is set
+
+    :param name: str
+    :param url: str
+    :return: dict[str,str] The name, version, url and checksum of the box
+    """
+    if url:
+        r = requests.get('%s/%s' % (url.rstrip('/'), name), timeout=30)
+        r.raise_for_status()
+        source = _latest_source(name, r.json())
+        if not source:
+            raise BaseboxError('no virtualbox version of %s found at %s' %
+                               (name, url))
+        return source
+
+    if not basebox_bucket() or '/' not in name:
+        raise BaseboxError('cannot find where to download %s from' % name)
+
+    # same naming as the metadata generated by aeris box generate
+    bucket = S3(basebox_bucket())
+    prefix = '%s-' % name
+    boxes = [obj for obj in bucket.list_bucket()
+             if obj['Key'].startswith(prefix) and obj['Key'].endswith('.box')]
+    if not boxes:
+        raise BaseboxError('base box %s not found in %s' %
+                           (name, basebox_bucket()))
+
+    obj = max(boxes, key=lambda obj: LooseVersion(obj['Key'][len(prefix):-4]))
+    # the ETag of files uploaded in several parts is not their md5
+    etag = obj.get('ETag')
+    checksum = etag and '-' not in etag and etag or None
+    return {
+        'name': name,
+        'version': obj['Key'][len(prefix):-4],
+        'url': bucket.url(obj['Key']),
+        'checksum_type': checksum and 'md5',
+        'checksum': checksum
+    }
+
+
+class Download(object):
+    """
+    Download of a file in segments fetched in parallel using HTTP range
+    requests. The progress of every segment is stored next to the partial
+    file so that an interrupted download is resumed where it stopped.
+
+    :param url: str
+    :param dest: str The partial file is dest.part
+    :param segments: int
+    :param progress: callable(int, int) Called with the downloaded and total
+                     sizes as data is received
+    """
+
+    def __init__(self, url, dest, segments=DEFAULT_SEGMENTS, progress=None):
+        self.url = url
+        self.part_file = dest + '.part'
+        self.state_file = dest + '.part.json'
+        self.segments = max(segments, 1)
+        self.progress = progress
+        self.state = None
+        self._lock = threading.Lock()
+
+    def _probe(self):
+        r = requests.head(self.url, allow_redirects=True, timeout=30)
+        r.raise_for_status()
+        size = int(r.headers.get('Content-Length') or 0) or None
+        ranged = size is not None and \
+            r.headers.get('Accept-Ranges') == 'bytes'
+        return size, ranged, r.headers.get('ETag')
+
+    def _load_state(self, size, ranged, etag):
+        if ranged and os.path.exists(self.part_file) and \
+                os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as fd:
+                    state = json.load(fd)
+                if [state['url'], state['size'], state['etag']] == \
+                        [self.url, size, etag]:
+                    logger.info('resuming download of %s', self.url)
+                    return state
+            except (IOError, ValueError, KeyError) as e:
+                logger.debug('ignoring download state: %s', e)
+
+        segments = [[0, size and size - 1, 0]]
+        if ranged:
+            count = max(min(self.segments, size // MIN_SEGMENT_SIZE), 1)
+            step = size // count
+            segments = [[i * step, i < count - 1 and (i + 1) * step - 1 or
+                         size - 1, 0] for i in range(count)]
+
+        with open(self.part_file, 'wb') as fd:
+            if size:
+                fd.truncate(size)
+        return {'url': self.url, 'size': size, 'etag': etag,
+                'ranged': ranged, 'segments': segments}
+
+    def _save_state(self):
+        with self._lock:
+            data = json.dumps(self.state)
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w') as fd:
+            fd.write(data)
+        os.rename(tmp_file, self.state_file)
+
+    def downloaded(self):
+        return sum([segment[2] for segment in self.state['segments']])
+
+    def _fetch(self, index):
+        start, end, done = self.state['segments'][index]
+        if end is not None and start + done > end:
+            return
+
+        headers = {}
+        if self.state['ranged']:
+            headers['Range'] = 'bytes=%d-%d' % (start + done, end)
+
+        r = requests.get(self.url, headers=headers, stream=True, timeout=60)
+        r.raise_for_status()
+        if self.state['ranged'] and r.status_code != 206:
+            raise BaseboxError('%s does not support range requests' %
+                               self.url)
+
+        chunks = 0
+        with open(self.part_file, 'r+b') as fd:
+            fd.seek(start + done)
+            for chunk in r.iter_content(CHUNK_SIZE):
+                fd.write(chunk)
+                done += len(chunk)
+                with self._lock:
+                    self.state['segments'][index][2] = done
+
+                chunks += 1
+                if chunks % SAVE_INTERVAL == 0:
+                    # never record data that is not in the file yet
+                    fd.flush()
+                    self._save_state()
+                if self.progress:
+                    self.progress(self.downloaded(), self.state['size'])
+
+    def run(self):
+        """
+        Download the file, raises a BaseboxError if any segment failed
+
+        :return: str The path of the downloaded file
+        """
+        size, ranged, etag = self._probe()
+        self.state = self._load_state(size, ranged, etag)
+
+        results = run_parallel(self._fetch,
+                               range(len(self.state['segments'])),
+                               len(self.state['segments']))
+        self._save_state()
+
+        errors = [res for _, res in results if isinstance(res, Exception)]
+        if errors:
+            raise BaseboxError('download of %s failed, run again to resume: '
+                               '%s' % (self.url, errors[0]))
+        if size is not None and self.downloaded() != size:
+            raise BaseboxError('download of %s is incomplete' % self.url)
+
+        os.remove(self.state_file)
+        return self.part_file
+
+
+def cache_dir():
+    return os.path.join(data_dir(), 'baseboxes')
+
+
+def _tmp_dir():
+    tmp_dir = os.path.join(cache_dir(), 'tmp')
+    if not os.path.isdir(tmp_dir):
+        os.makedirs(tmp_dir)
+    return tmp_dir
+
+
+def box_path(sha256):
+    """
+    Return where the box file with the given sha256 is stored
+
+    :param sha256: str
+    :return: str
+    """
+    return os.path.join(cache_dir(), 'sha256', sha256[:2], '%s.box' % sha256)
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """
+    Hold an exclusive lock on the given lock file, against the other
+    threads of this process and against other aeris processes
+
+    :param path: str
+    """
+    with _locks_lock:
+        lock = _locks.setdefault(path, threading.Lock())
+    with lock:
+        with open(path, 'a') as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def _index_file():
+    return os.path.join(cache_dir(), 'index.json')
+
+
+def _load_index():
+    """
+    Load the cached box files, indexed by url
+
+    :return: dict[str,dict]
+    """
+    if not os.path.exists(_index_file()):
+        return {}
+    try:
+        with open(_index_file()) as fd:
+            return json.load(fd)
+    except ValueError:
+        logger.warn('invalid base box index %s, ignoring', _index_file())
+        return {}
+
+
+def _save_index(index):
+    tmp_file = _index_file() + '.tmp'
+    with open(tmp_file, 'w') as fd:
+        json.dump(index, fd, indent=2)
+    os.rename(tmp_file, _index_file())
+
+
+def file_digests(path, types):
+    """
+    Compute several digests of a file in a single read
+
+    :param path: str
+    :param types: list[str] hashlib algorithms
+    :return: dict[str,str]
+    """
+    hashes = dict([(hash_type, hashlib.new(hash_type))
+                   for hash_type in set(types)])
+    with open(path, 'rb') as fd:
+        for chunk in iter(lambda: fd.read(CHUNK_SIZE), b''):
+            for digest in hashes.values():
+                digest.update(chunk)
+    return dict([(hash_type, digest.hexdigest())
+                 for hash_type, digest in hashes.iteritems()])
+
+
+def cached(source):
+    """
+    Return the cached box file of the given source
+
+    :param source: dict As returned by basebox_source
+    :return: str|None
+    """
+    entry = _load_index().get(source['url'])
+    if entry and os.path.exists(box_path(entry['sha256'])):
+        return box_path(entry['sha256'])
+    return None
+
+
+def _download(source, dest, segments, progress):
+    part_file = Download(source['url'], dest, segments, progress).run()
+
+    checksum_type = source.get('checksum') and source['checksum_type']
+    digests = file_digests(part_file, ['sha256'] + (checksum_type and
+                                                    [checksum_type] or []))
+    if checksum_type and \
+            digests[checksum_type] != source['checksum'].lower():
+        os.remove(part_file)
+        raise BaseboxError('%s checksum of %s does not match, expected %s '
+                           'got %s' % (checksum_type, source['url'],
+                                       source['checksum'],
+                                       digests[checksum_type]))
+
+    path = box_path(digests['sha256'])
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    os.rename(part_file, path)
+
+    with _locked(_index_file() + '.lock'):
+        index = _load_index()
+        index[source['url']] = {
+            'name': source['name'],
+            'version': source['version'],
+            'sha256': digests['sha256'],
+            'size': os.path.getsize(path)
+        }
+        _save_index(index)
+    return path
+
+
+def fetch(source, segments=DEFAULT_SEGMENTS, progress=None):
+    """
+    Return the path of the box file of the given source, downloading and
+    verifying it if it is not cached yet. Boxes sharing a base box are
+    started in parallel, a single download of each url runs at a time.
+
+    :param source: dict As returned by basebox_source
+    :param segments: int How many parts of the file are downloaded at once
+    :param progress: callable(int, int) See Download
+    :return: str
+    """
+    path = cached(source)
+    if path:
+        return path
+
+    dest = os.path.join(_tmp_dir(), hashlib.sha1(source['url']).hexdigest())
+    with _locked(dest + '.lock'):
+        # the box might have been downloaded while waiting for the lock
+        return cached(source) or _download(source, dest, segments, progress)
+
+
+def register(source, path):
+    """
+    Add a cached box file to vagrant with the version of its source, so
+    that vagrant finds it instead of downloading it
+
+    :param source: dict As returned by basebox_source
+    :param path: str
+    :return: bool False if vagrant already had this version
+    """
+    # boxes added from a file have no version, a local metadata file is
+    # used to keep it, the checksum was already verified
+    metadata_file = os.path.join(_tmp_dir(), '%s.json' %
+                                 os.path.basename(path)[:-4])
+    with _locked(metadata_file + '.lock'):
+        if source['version'] in basebox_versions(source['name']):
+            return False
+
+        with open(metadata_file, 'w') as fd:
+            json.dump({
+                'name': source['name'],
+                'versions': [{
+                    'version': source['version'],
+                    'providers': [{'name': 'virtualbox',
+                                   'url': 'file://%s' % path}]
+                }]
+            }, fd)
+
+        try:
+            if call(['vagrant', 'box', 'add', metadata_file]) != 0:
+                raise BaseboxError('vagrant could not add %s' % path)
+        finally:
+            os.remove(metadata_file)
+    return True
+
+
+def ensure_basebox(name, url=None, segments=DEFAULT_SEGMENTS,
+                   progress=None):
+    """
+    Make sure vagrant has the latest version of a base box, downloading it
+    through the cache
+
+    :param name: str
+    :param url: str The metadata server, see server_url
+    :param segments: int
+    :param progress: callable(int, int) See Download
+    :return: dict The source of the box
+    """
+    source = basebox_source(name, url)
+    path = fetch(source, segments, progress)
+    if register(source, path):
+        logger.info('added %s %s to vagrant', name, source['version'])
+    return source
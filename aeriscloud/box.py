@@ -1,24 +1,134 @@
 import arrow
-import json
+import hashlib
 import os
+import re
+import requests
 import sys
+import tempfile
+import time
 
-from paramiko import SSHClient
-from sh import ssh, rsync, Command, \
-    ErrorReturnCode_1, ErrorReturnCode_255, ErrorReturnCode
+from sh import ssh, rsync, Command, ErrorReturnCode
 from slugify import slugify
-from subprocess32 import call, Popen
-
-from .config import expose_username, expose_url, data_dir, verbosity
+from subprocess32 import call, Popen, DEVNULL
+
+from .agent import agent_enabled, pool as agent_pool, AgentError, \
+    AgentUnavailable
+from .ansible import write_box_inventory
+from .basebox import ensure_basebox, server_url, BaseboxError
+from .clone import clone_box, basebox_versions, BaseboxNotFound
+from .config import expose_username, expose_url, data_dir, verbosity, \
+    ssh_control_persist, ssh_cipher, ssh_compression
 from .expose import expose
+from .filesync import SyncIndex, balance, top_level_sizes, \
+    RsyncOutput
+from .history import HistoryCache, parse_history, tail_command
 from .log import get_logger
-from .utils import quote
-from .vagrant import ansible_env
-from .virtualbox import list_vms, vm_network, vm_ip, \
-    vm_info, vm_start, vm_suspend
+from .sshpool import pool, SSHConnectionError
+from .utils import quote, wait_for_port, memoized, buffered_timestamps, \
+    flush_timestamps, run_parallel, DEFAULT_JOBS
+from .vagrant import ansible_env, MachineIndex
+from .virtualbox import vm_network, vm_ip, vm_info_all, \
+    vm_start, vm_suspend, wait_guest_network, clone_mode, vm_poweroff, \
+    snapshot_take, snapshot_restore, snapshot_list, snapshot_delete, \
+    snapshot_retention
+from .virtualbox_xml import box_settings
 
 logger = get_logger('box')
 
+SNAPSHOT_PREFIX = 'aeris-'
+
+# unix sockets paths are limited to 104 chars on OSX, ssh appends a random
+# suffix to the path while creating it
+MAX_CONTROL_DIR_LENGTH = 70
+
+
+def control_dir():
+    """
+    Return the folder where the ssh ControlMaster sockets are stored
+
+    :return: str
+    """
+    path = os.path.join(data_dir(), 'ssh')
+    if len(path) > MAX_CONTROL_DIR_LENGTH:
+        path = os.path.join(tempfile.gettempdir(),
+                            'aeriscloud-%d' % os.getuid())
+    if not os.path.isdir(path):
+        os.makedirs(path, 0700)
+    return path
+
+
+# how long the introspection bundle of a box is kept, long enough for it to
+# be fetched only once per command
+INTROSPECTION_TTL = 10
+# how many provisioning entries are part of the bundle
+HISTORY_TAIL = 10
+
+# every section is preceded by an empty line in case the previous output
+# did not end with a new line
+_INTROSPECTION_SCRIPT = '''\
+echo; echo ==services==
+for f in /etc/aeriscloud.d/*; do [ -f "$f" ] && cat "$f" && echo; done
+echo; echo ==history==
+{history} 2>/dev/null
+echo; echo ==uptime==
+cat /proc/uptime
+echo; echo ==loadavg==
+cat /proc/loadavg
+echo; echo ==disk==
+df -P -k /data 2>/dev/null | tail -n +2
+echo; echo ==project_dir==
+[ -d {project} ] && echo yes || echo no
+'''
+
+_INTROSPECTION_SECTION = re.compile(r'^==(?P<name>\w+)==$')
+
+
+def _parse_introspection(output):
+    """
+    Parse the output of the introspection script into a bundle
+
+    :param output: str
+    :return: dict[str,any]
+    """
+    sections = {}
+    current = None
+    for line in output.splitlines():
+        line = line.strip()
+        match = _INTROSPECTION_SECTION.match(line)
+        if match:
+            current = sections.setdefault(match.group('name'), [])
+        elif line and current is not None:
+            current.append(line)
+
+    disk = None
+    if sections.get('disk'):
+        fields = sections['disk'][0].split()
+        disk = dict(zip(['size', 'used', 'available'],
+                        [int(field) * 1024 for field in fields[1:4]]))
+
+    return {
+        'services': [
+            dict(zip(['name', 'port', 'path', 'protocol'],
+                     service.split(',')))
+            for service in sections.get('services', [])
+        ],
+        'history': list(parse_history(sections.get('history', []))),
+        'uptime': sections.get('uptime') and
+        float(sections['uptime'][0].split()[0]) or None,
+        'load': sections.get('loadavg') and
+        [float(load) for load in sections['loadavg'][0].split()[:3]] or None,
+        'disk': disk,
+        'project_dir': sections.get('project_dir') == ['yes'],
+    }
+
+
+@memoized(ttl=INTROSPECTION_TTL)
+def _introspect(vm_name, ip, ssh_key, project_name):
+    script = _INTROSPECTION_SCRIPT.format(
+        history=tail_command(HISTORY_TAIL), project=quote(project_name))
+    status, out, err = pool.run(ip, 'vagrant', ssh_key, script)
+    return _parse_introspection(out)
+
 
 class BoxList(list):
     def not_created(self):
@@ -33,6 +143,115 @@ class BoxList(list):
     def status(self, status):
         return [box for box in self if box.status() == status]
 
+    def parallel(self, method, jobs=DEFAULT_JOBS, *args, **kwargs):
+        """
+        Call the given Box method on every box, at most jobs at a time. The
+        output of each box is printed in one block once it is done and
+        expose is only announced once every box is done.
+
+        :param method: str
+        :param jobs: int
+        :return: list[(Box, any|Exception)] In the order of the list
+        """
+        def _run(box):
+            with buffered_timestamps() as buf:
+                try:
+                    return getattr(box, method)(*args, **kwargs)
+                finally:
+                    flush_timestamps(buf, title='==> %s' % box.vm_name())
+
+        with expose.batch():
+            results = dict(run_parallel(_run, self, jobs))
+        return [(box, results[box]) for box in self]
+
+    def ansible(self, cmd='ansible-playbook', forks=None):
+        """
+        Return an ansible command targeting every box of the list through a
+        single inventory, so that they are all provisioned by one run
+
+        :param cmd: str
+        :param forks: int How many boxes ansible works on in parallel
+        :return: sh.Command
+        """
+        projects = dict((box.project.folder(), box.project) for box in self)
+        if len(self) == 1:
+            name = self[0].vm_name()
+        elif len(projects) == 1:
+            name = self[0].project.name()
+        else:
+            name = 'all'
+
+        args = ['-i', write_box_inventory(name, self)]
+        # the configuration of the project keeps the precedence it has when
+        # provisioning through vagrant, it is only part of the host vars
+        # when boxes from several projects are targeted
+        if len(projects) == 1:
+            args += ['--extra-vars', '@%s' % self[0].project.config_file()]
+        if forks:
+            args += ['--forks', str(forks)]
+
+        ansible = Command(cmd)
+        new_env = ansible_env(os.environ.copy())
+        new_env['ANSIBLE_HOST_KEY_CHECKING'] = 'False'
+
+        return ansible.bake(*args,
+                            _env=new_env,
+                            _out_bufsize=0,
+                            _err_bufsize=0)
+
+    def up(self, jobs=DEFAULT_JOBS, *args, **kwargs):
+        return self.parallel('up', jobs, *args, **kwargs)
+
+    def halt(self, jobs=DEFAULT_JOBS, *args, **kwargs):
+        return self.parallel('halt', jobs, *args, **kwargs)
+
+    def suspend(self, jobs=DEFAULT_JOBS):
+        return self.parallel('suspend', jobs)
+
+    def resume(self, jobs=DEFAULT_JOBS):
+        return self.parallel('resume', jobs)
+
+    def provision(self, forks=None, jobs=DEFAULT_JOBS):
+        """
+        Provision every box, the ansible playbook of each organization runs
+        once for all its boxes then the shell provisioners of the boxes run
+        in parallel
+
+        :param forks: int How many boxes ansible works on in parallel
+        :param jobs: int How many shell provisioners run at the same time
+        :return: list[(Box, int|Exception)] In the order of the list
+        """
+        organizations = {}
+        for box in self:
+            if box.data.get('provision', True):
+                organizations.setdefault(box.project.organization(),
+                                         BoxList()).append(box)
+
+        args = []
+        if os.getenv('tags'):
+            args += ['--tags', 'inventory,%s' % os.getenv('tags')]
+        if os.getenv('skip_tags'):
+            args += ['--skip-tags', os.getenv('skip_tags')]
+        if verbosity():
+            args.append('-' + 'v' * verbosity())
+
+        failed = {}
+        for organization, boxes in sorted(organizations.items()):
+            playbook = os.path.join(data_dir(), 'organizations',
+                                    organization, 'env_dev.yml')
+            try:
+                boxes.ansible(forks=forks)(playbook, *args,
+                                           _out=sys.stdout, _err=sys.stderr)
+            except ErrorReturnCode as e:
+                for box in boxes:
+                    failed[box] = e.exit_code
+
+        shell_boxes = BoxList([box for box in self if box not in failed])
+        results = dict(shell_boxes.parallel('vagrant', jobs, 'provision',
+                                            '--provision-with', 'shell'))
+        results.update(failed)
+        return [(box, results[box]) for box in self]
+
 
 class Box(object):
     """
@@ -52,6 +271,8 @@ class Box(object):
         self._vm_name = ''.join([self.project.name(), '-', self.data['name']])
         self._logger = get_logger(self._vm_name)
         self.basebox = self.data.get('basebox', 'chef/centos-7.0')
+        # transfer stats of the last rsync_up or rsync_down
+        self.last_sync = None
 
     def name(self):
         """
@@ -72,13 +293,31 @@ class Box(object):
         """
         return self._vm_name
 
+    def uuid(self):
+        """
+        Return the UUID of the VirtualBox VM backing the box, read from the
+        vagrant machine index without calling VirtualBox nor vagrant
+
+        :return: str|None None if the VM was not created
+        """
+        try:
+            index = MachineIndex()
+        except (IOError, ValueError) as e:
+            self._logger.debug('could not read the vagrant machine index: '
+                               '%s', e)
+            return None
+
+        machine = index.get_by_path(self.project.vagrant_dir(), self.name())
+        return machine and machine.uuid or None
+
     def info(self):
         """
-        Return all the information about a box, kinda messy
+        Return the state, forwards and network information about a box,
+        read from the snapshot shared by every box (see vm_info_all)
 
         :return: dict[str,str]
         """
-        return vm_info(self._vm_name)
+        return vm_info_all().get(self._vm_name, {})
 
     def status(self):
         """
@@ -86,7 +325,7 @@ class Box(object):
 
         :return: str
         """
-        if self._vm_name not in list_vms():
+        if self._vm_name not in vm_info_all():
             return 'not created'
         info = self.info()
         if 'VMState' in info:
@@ -100,7 +339,22 @@ class Box(object):
             return arrow.get(change_time[:-10]).to('local')
         return None
 
+    def settings(self):
+        """
+        Return the static settings of the VM (memory, network adapters,
+        forwards, disks) read from its .vbox file, or None if the VM has
+        not been created
+
+        :return: dict[str,any]|None
+        """
+        return box_settings(self)
+
     def forwards(self):
+        settings = self.settings()
+        if settings:
+            return settings['forwards']
+
+        # fallback on VirtualBox if the VM cannot be found in vagrant's index
         headers = ['protocol', 'host_ip', 'host_port',
                    'guest_ip', 'guest_port']
         return dict([
@@ -118,12 +372,11 @@ class Box(object):
 
         :return: bool
         """
-        return self._vm_name in list_vms(True)
+        return self.info().get('VMState') == 'running'
 
     def network(self):
         """
         Return the information for every network interfaces on the VM
-        (kinda slow)
 
         :return: list[map[str,str]]
         """
@@ -141,6 +394,21 @@ class Box(object):
         """
         return vm_ip(self._vm_name, id)
 
+    def wait_ready(self, timeout=120):
+        """
+        Block until the box is usable, which is when its host only interface
+        is up and ssh accepts connections on it
+
+        :param timeout: float Maximum time to wait in seconds
+        :return: bool Whether the box is ready
+        """
+        deadline = time.time() + timeout
+        ip = wait_guest_network(self._vm_name, 1, timeout)
+        if not ip:
+            self._logger.debug('timed out waiting for the network')
+            return False
+        return wait_for_port(ip, 22, deadline - time.time())
+
     def ssh_key(self):
         # Vagrant 1.7+ support
         local_key = os.path.join(self.project.vagrant_dir(), 'machines',
@@ -163,19 +431,135 @@ class Box(object):
 
         :return: sh.Command
         """
-        return ssh.bake(self.ip(), '-A', '-t', i=self.ssh_key(), l='vagrant',
+        args = [self.ip(), '-A', '-t'] + self.ssh_transport_options() + \
+            self.ssh_mux_options()
+        return ssh.bake(*args, i=self.ssh_key(), l='vagrant',
                         o='StrictHostKeyChecking no', **kwargs)
 
+    def control_path(self):
+        """
+        Return the path of the ControlMaster socket of the box, the ip is
+        part of it so that a recreated box does not reuse a stale master
+
+        :return: str
+        """
+        digest = hashlib.sha1('%s@%s' % (self._vm_name, self.ip()))
+        return os.path.join(control_dir(), digest.hexdigest()[:16])
+
+    def ssh_transport_options(self):
+        """
+        Return the ssh cipher and compression options, see
+        aeris sync --benchmark
+
+        :return: list[str]
+        """
+        options = []
+        if ssh_cipher():
+            options += ['-c', ssh_cipher()]
+        return options + ['-o', 'Compression=%s' % ssh_compression()]
+
+    def ssh_mux_options(self):
+        """
+        Return the ssh options sharing a single connection between every
+        ssh, rsync and ansible call made to the box
+
+        :return: list[str]
+        """
+        persist = ssh_control_persist()
+        if persist == 'no':
+            return []
+        return ['-o', 'ControlMaster=auto',
+                '-o', 'ControlPath=%s' % self.control_path(),
+                '-o', 'ControlPersist=%s' % persist]
+
+    def ssh_disconnect(self):
+        """
+        Close the shared ssh connection to the box, if any
+
+        :return: bool Whether a connection was closed
+        """
+        # the ip, and thus the socket path, is only known while running
+        if not self.is_running() or not self.ip():
+            return False
+
+        pool.close(self.ip())
+        if not os.path.exists(self.control_path()):
+            return False
+
+        res = call(['ssh', '-O', 'exit', '-o',
+                    'ControlPath=%s' % self.control_path(), self.ip()],
+                   stderr=DEVNULL)
+        if os.path.exists(self.control_path()):
+            # the master is dead, only its socket is left
+            os.remove(self.control_path())
+        return res == 0
+
     def ssh_client(self):
         """
         When needing a more precise SSH client, returns a paramiko SSH client
+        from the connection pool, it is shared and must not be closed
 
         :return: paramiko.SSHClient
         """
-        client = SSHClient()
-        client.load_system_host_keys()
-        client.connect(self.ip(), username='vagrant', pkey=self.ssh_key())
-        return client
+        return pool.client(self.ip(), 'vagrant', self.ssh_key())
+
+    def ssh_run(self, cmd):
+        """
+        Run a non interactive command on the box over the pooled connection,
+        raises an SSHConnectionError if the box cannot be reached
+
+        :param cmd: str
+        :return: (int, str, str) The exit status, stdout and stderr
+        """
+        self._logger.debug('running %s', cmd)
+        return pool.run(self.ip(), 'vagrant', self.ssh_key(), cmd)
+
+    def introspect(self, refresh=False):
+        """
+        Return the services, the last provisioning entries, the uptime and
+        load, the usage of the /data disk and whether the project folder
+        exists on the box, all fetched in a single round trip and cached for
+        a few seconds
+
+        :param refresh: bool Ignore the cached bundle
+        :return: dict[str,any]
+        """
+        if refresh:
+            _introspect.invalidate_prefix(self._vm_name)
+
+        try:
+            return _introspect(self._vm_name, self.ip(), self.ssh_key(),
+                               self.project.name())
+        except SSHConnectionError as e:
+            self._logger.error(str(e))
+            return _parse_introspection('')
+
+    def _ssh_read_lines(self, cmd):
+        """
+        Return the output lines of a command, or an empty list if it failed
+        """
+        try:
+            status, out, err = self.ssh_run(cmd)
+        except SSHConnectionError as e:
+            self._logger.error(str(e))
+            return []
+
+        if status != 0:
+            self._logger.debug(err)
+            return []
+        return [line for line in out.splitlines() if line.strip()]
+
+    def _shell_command(self, cmd, cd=True):
+        if isinstance(cmd, tuple) or isinstance(cmd, list):
+            cmd = ' '.join(map(quote, cmd))
+
+        if cd:
+            cmd = '[ ! -d "{0}" ] && exit {1}; cd "{0}"; {2}'.format(
+                self.project.name(),
+                self.NO_PROJECT_DIR,
+                cmd
+            )
+        return cmd
 
     def ssh_shell(self, cmd=None, cd=True, popen=False, **kwargs):
         """
@@ -186,31 +570,66 @@ class Box(object):
         call_args = [
             'ssh', self.ip(), '-t', '-A',
             '-l', 'vagrant',
-            '-i', self.ssh_key()]
+            '-i', self.ssh_key()] + self.ssh_transport_options() + \
+            self.ssh_mux_options()
         if cmd:
-            if isinstance(cmd, tuple) or isinstance(cmd, list):
-                cmd = ' '.join(map(quote, cmd))
-
-            if cd:
-                cmd = '[ ! -d "{0}" ] && exit {1}; cd "{0}"; {2}'.format(
-                    self.project.name(),
-                    self.NO_PROJECT_DIR,
-                    cmd
-                )
-            call_args.append(cmd)
+            call_args.append(self._shell_command(cmd, cd))
         self._logger.debug('calling %s', ' '.join(call_args))
 
         if popen:
             return Popen(call_args, start_new_session=True, **kwargs)
         return call(call_args, **kwargs)
 
+    def run(self, cmd, cd=True, popen=False):
+        """
+        Run a non interactive command on the box through its agent when it
+        is enabled and running, falling back to ssh_shell otherwise. The
+        command does not get any input nor a terminal when using the agent.
+
+        :param cmd: str|list[str]
+        :param cd: bool Run the command in the project folder
+        :param popen: bool Return a process instead of waiting for it
+        :return: int|subprocess32.Popen|agent.AgentProcess
+        """
+        if agent_enabled():
+            command = self._shell_command(cmd, cd)
+            try:
+                if popen:
+                    return agent_pool.popen(self.ip(), command)
+                return agent_pool.run(self.ip(), command)
+            except AgentUnavailable as e:
+                self._logger.debug('falling back to ssh: %s', e)
+            except AgentError as e:
+                self._logger.error(str(e))
+                return 255
+
+        return self.ssh_shell(cmd, cd=cd, popen=popen)
+
     def up(self, *args, **kwargs):
+        if self.status() == 'not created' and \
+                not basebox_versions(self.basebox):
+            try:
+                ensure_basebox(self.basebox, server_url(self.project))
+            except (BaseboxError, IOError, OSError,
+                    requests.RequestException) as e:
+                # let vagrant download the box itself
+                self._logger.warn('could not fetch %s: %s', self.basebox, e)
+
+        if clone_mode() == 'linked' and self.status() == 'not created':
+            try:
+                clone_box(self)
+            except BaseboxNotFound as e:
+                # let vagrant download and import the box
+                self._logger.warn(str(e))
+
         res = self.vagrant('up', *args, **kwargs)
         if res == 0:
+            # vagrant already waited for ssh
             expose.add(self)
         return res
 
     def halt(self, *args, **kwargs):
+        self.ssh_disconnect()
         res = self.vagrant('halt', *args, **kwargs)
         if res == 0:
             expose.remove(self)
@@ -226,6 +645,8 @@ class Box(object):
             return False
 
         vm_start(self._vm_name)
+        if not self.wait_ready():
+            self._logger.warn('box resumed but is not reachable yet')
         expose.add(self)
 
         return True
@@ -239,11 +660,86 @@ class Box(object):
         if not self.is_running():
             return False
 
+        self.ssh_disconnect()
         vm_suspend(self._vm_name)
         expose.remove(self)
         return True
 
+    def snapshots(self):
+        """
+        Return the names of the snapshots of the box, parents first
+
+        :return: list[str]
+        """
+        if self.status() == 'not created':
+            return []
+        return [snapshot['name']
+                for snapshot in snapshot_list(self._vm_name)]
+
+    def _aeris_snapshots(self):
+        # timestamped names sort chronologically, unlike VirtualBox's
+        # order once the snapshot tree has branches
+        return sorted([snapshot for snapshot in self.snapshots()
+                       if snapshot.startswith(SNAPSHOT_PREFIX)])
+
+    def snapshot(self, name=None, retention=None):
+        """
+        Take a snapshot of the box, then delete the oldest snapshots taken
+        by AerisCloud to only keep the given number of them
+
+        :param name: str Defaults to a timestamped name
+        :param retention: int Defaults to virtualbox.snapshot_retention
+        :return: str The name of the snapshot
+        """
+        if not name:
+            name = SNAPSHOT_PREFIX + time.strftime('%Y%m%d-%H%M%S')
+        if retention is None:
+            retention = snapshot_retention()
+
+        snapshot_take(self._vm_name, name)
+
+        # never prune the snapshot we just took
+        snapshots = self._aeris_snapshots()
+        keep = max(retention, 1)
+        for snapshot in snapshots[:max(len(snapshots) - keep, 0)]:
+            self._logger.debug('pruning snapshot %s', snapshot)
+            snapshot_delete(self._vm_name, snapshot)
+
+        return name
+
+    def delete_snapshot(self, name):
+        snapshot_delete(self._vm_name, name)
+
+    def reset(self, name=None):
+        """
+        Restore the box to the given snapshot, by default the last one
+        taken by AerisCloud, and start it back
+
+        :param name: str
+        :return: str|None The name of the restored snapshot
+        """
+        if not name:
+            snapshots = self._aeris_snapshots()
+            if not snapshots:
+                return None
+            name = snapshots[-1]
+
+        if self.status() in ('running', 'paused'):
+            self.ssh_disconnect()
+            vm_poweroff(self._vm_name)
+
+        snapshot_restore(self._vm_name, name)
+        # the synced files on the box went back in time too
+        self.sync_index().reset()
+        vm_start(self._vm_name)
+        if not self.wait_ready():
+            self._logger.warn('box reset but is not reachable yet')
+        expose.add(self)
+
+        return name
+
     def destroy(self):
+        self.ssh_disconnect()
         res = self.vagrant('destroy')
         if res == 0:
             expose.remove(self)
@@ -257,7 +753,11 @@ class Box(object):
         Runs a vagrant command
         """
         args = tuple(list(args) + [self.name()])
-        return self.project.vagrant(*args, **kwargs)
+        try:
+            return self.project.vagrant(*args, **kwargs)
+        finally:
+            # provisioning changes the services and history of the box
+            _introspect.invalidate_prefix(self._vm_name)
 
     def browse(self, endpoint='', ip=False):
         """
@@ -300,66 +800,63 @@ class Box(object):
 
         :return: dict[str,str,str,str]
         """
-        try:
-            return [
-                dict(zip(
-                    ['name', 'port', 'path', 'protocol'],
-                    service.strip().split(',')
-                ))
-                for service in self.ssh().cat('/etc/aeriscloud.d/*')
-            ]
-        except ErrorReturnCode_1 as e:
-            self._logger.warn(e.stderr)
-            return []
-        except ErrorReturnCode_255 as e:
-            self._logger.error(e.stderr)
-            return []
+        return self.introspect()['services']
 
-    def history(self):
-        try:
-            return [json.loads(line.strip()) for line in
-                    self.ssh().cat('/home/vagrant/.provision')]
-        except ErrorReturnCode_1:
-            return []
+    def history(self, limit=HISTORY_TAIL):
+        """
+        Return the provisioning history of the box, the last entries are
+        part of the introspection bundle
 
-        except ErrorReturnCode_255 as e:
-            self._logger.error(e.stderr)
-            return []
+        :param limit: int How many entries to return, None for all of them
+        :return: list[dict]
+        """
+        if limit is not None and 0 < limit <= HISTORY_TAIL:
+            return self.introspect()['history'][-limit:]
+        return list(self.iter_history(limit))
 
-    def ansible(self, cmd='ansible-playbook'):
-        tmp_inventory_dir = os.path.join(data_dir(), 'vagrant-inventory')
-        if not os.path.isdir(tmp_inventory_dir):
-            os.makedirs(tmp_inventory_dir)
-
-        # create a temporary inventory file for ansible
-        tmp_inventory_file = os.path.join(tmp_inventory_dir, self.vm_name())
-        with open(tmp_inventory_file, 'w') as f:
-            f.write('%s ansible_ssh_host=%s ansible_ssh_port=22 '
-                    'ansible_ssh_private_key_file=%s' % (
-                        self.vm_name(),
-                        self.ip(),
-                        self.ssh_key()
-                    ))
+    def iter_history(self, limit=None):
+        """
+        Lazily parse the provisioning history of the box. The history is
+        cached locally and only the entries appended since the last call
+        are downloaded, until the cache exists a limited read only fetches
+        the last entries.
 
-        ansible = Command(cmd)
-        new_env = ansible_env(os.environ.copy())
+        :param limit: int How many entries to return, None for all of them
+        :return: generator[dict]
+        """
+        cache = HistoryCache(self._vm_name, self.uuid())
+        if limit is not None and not cache.exists():
+            lines = self._ssh_read_lines(tail_command(limit))
+        else:
+            try:
+                status, out, err = self.ssh_run(cache.fetch_command())
+                if status == 0:
+                    cache.update(out)
+                else:
+                    self._logger.debug(err)
+            except SSHConnectionError as e:
+                self._logger.error(str(e))
+            lines = cache.lines()
+            if limit is not None:
+                lines = lines[-limit:] if limit else []
+
+        for entry in parse_history(lines):
+            yield entry
 
-        return ansible.bake('-i', tmp_inventory_file,
-                            '--extra-vars', '@%s' %
-                            self.project.config_file(),
-                            _env=new_env,
-                            _out_bufsize=0,
-                            _err_bufsize=0)
+    def ansible(self, cmd='ansible-playbook'):
+        return BoxList([self]).ansible(cmd)
 
-    def rsync(self, src, dest):
-        # enable arcfour and no compression for faster speed
-        ssh_options = 'ssh -T -c arcfour -o Compression=no -x ' \
-                      '-i "%s" -l vagrant' % self.ssh_key()
+    def _rsync_args(self):
+        ssh_options = 'ssh -T -x -i "%s" -l vagrant' % self.ssh_key()
+        ssh_options = ' '.join([ssh_options] +
+                               map(quote, self.ssh_transport_options() +
+                                   self.ssh_mux_options()))
 
-        # basic args for rsync
-        args = ['--delete', '--archive', '--hard-links',
-                '--one-file-system', '--compress-level=0',
-                '--omit-dir-times', '-e', ssh_options]
+        # basic args for rsync, the stats are always retrieved to report
+        # the throughput but only displayed at the highest verbosity
+        args = ['--archive', '--hard-links', '--one-file-system',
+                '--compress-level=0', '--omit-dir-times', '--stats',
+                '-e', ssh_options]
 
         if verbosity():
             args.append('-v')
@@ -367,47 +864,201 @@ class Box(object):
         if verbosity() > 1:
             args.append('--progress')
 
-        if verbosity() > 2:
-            args.append('--stats')
+        # check for ignore, sh does not go through a shell so the patterns
+        # must not be quoted
+        args += ['--exclude=%s' % ignore for ignore in self._rsync_ignores()]
 
-        # check for ignore
-        conf = self.project.config()
-        if 'rsync_ignores' in conf:
-            # TODO: check format
-            args += map(lambda x: '--exclude="%s"' % x,
-                        conf['rsync_ignores'])
+        return args
 
-        # then add sec and dest
-        args += [src, dest]
+    def _rsync_ignores(self):
+        # TODO: check format
+        return self.project.config().get('rsync_ignores') or []
 
+    def _run_rsync(self, args, stats):
         self._logger.debug('running: rsync %s' % ' '.join(args))
 
+        out = RsyncOutput(stats, show_stats=verbosity() > 2)
         try:
             rsync(*args,
-                  _out=sys.stdout, _err=sys.stderr,
+                  _out=out.write, _err=sys.stderr,
                   _out_bufsize=0, _err_bufsize=0)
         except ErrorReturnCode:
             return False
+        finally:
+            out.close()
 
         return True
 
-    def rsync_up(self):
+    def _run_rsync_shards(self, func, shards, stats):
+        """
+        Call func(shard, stats) for every shard in parallel, merging the
+        stats of every rsync process in the given stats
+        """
+        def _run(shard):
+            shard_stats = {}
+            return func(shard, shard_stats), shard_stats
+
+        ok = True
+        for _, res in run_parallel(_run, shards, len(shards)):
+            if isinstance(res, Exception):
+                self._logger.error(str(res))
+                ok = False
+                continue
+            ok = ok and res[0]
+            for key, value in res[1].iteritems():
+                stats[key] = stats.get(key, 0) + value
+        return ok
+
+    def rsync(self, src, dest, stats=None):
+        if stats is None:
+            stats = {}
+        # then add sec and dest
+        return self._run_rsync(['--delete'] + self._rsync_args() +
+                               [src, dest], stats)
+
+    def _rsync_files(self, paths, src, dest, stats, recursive=False):
+        """
+        Only push the given paths, relative to src, when recursive is set
+        directories are pushed with their content and files deleted from
+        them locally are deleted on the box
+        """
+        args = self._rsync_args()
+        if recursive:
+            args += ['--recursive', '--delete']
+
+        with tempfile.NamedTemporaryFile(prefix='aeriscloud-sync-') as fd:
+            fd.write('\0'.join(paths))
+            fd.flush()
+            return self._run_rsync(args + [
+                '--files-from=%s' % fd.name, '--from0', src, dest], stats)
+
+    def _rsync_sharded(self, src, dest, files, jobs, stats):
+        """
+        Full sync split by top level entries, in shards of similar size
+        """
+        # sync the top level first, deleting the entries removed locally
+        if not self._run_rsync(['--delete'] + self._rsync_args() +
+                               ['--no-recursive', '--dirs', src, dest],
+                               stats):
+            return False
+
+        shards = balance(top_level_sizes(files), jobs)
+        self._logger.debug('syncing in %d shards', len(shards))
+        return self._run_rsync_shards(
+            lambda shard, shard_stats: self._rsync_files(
+                shard, src, dest, shard_stats, recursive=True),
+            shards, stats)
+
+    def _rsync_delete(self, paths, dest):
+        """
+        Remove the given paths, relative to dest, from the box. Directories
+        are only removed once empty, files excluded from the sync might
+        still be in them.
+        """
+        # keep the command line well under ARG_MAX
+        chunk = []
+        chunk_size = 0
+        chunks = [chunk]
+        for path in paths:
+            if chunk_size > 65536:
+                chunk = []
+                chunk_size = 0
+                chunks.append(chunk)
+            chunk.append(quote(path))
+            chunk_size += len(chunk[-1]) + 1
+
+        for chunk in chunks:
+            if not chunk:
+                continue
+            args = ' '.join(chunk)
+            try:
+                status, out, err = self.ssh_run(
+                    'cd {0} && {{ for f in {1}; do if [ -d "$f" ]; then '
+                    'rmdir -- "$f" 2>/dev/null; else rm -f -- "$f"; fi; '
+                    'done; true; }}'.format(quote(dest), args))
+            except SSHConnectionError as e:
+                self._logger.error(str(e))
+                return False
+            if status != 0:
+                self._logger.debug(err)
+                return False
+        return True
+
+    def sync_index(self):
+        """
+        Return the index of the files last pushed to the box
+
+        :return: filesync.SyncIndex
+        """
+        return SyncIndex(self._vm_name, self.project.folder(),
+                         self._rsync_ignores(), self.uuid())
+
+    def rsync_up(self, full=False):
+        """
+        Push the project files to the box, only the files that changed since
+        the last sync are pushed unless a full sync is due. The transfer
+        stats are available in last_sync afterwards.
+
+        :param full: bool Force a full sync
+        :return: bool
+        """
         if not self.project.rsync_enabled():
             return
 
-        return self.rsync(
-            '%s/' % self.project.folder(),
-            '%s:/data/%s/' % (self.ip(), self.project.name())
-        )
+        src = '%s/' % self.project.folder()
+        dest = '/data/%s/' % self.project.name()
+        remote = '%s:%s' % (self.ip(), dest)
+        jobs = self.project.rsync_jobs()
+        stats = {}
+        start = time.time()
+
+        index = self.sync_index()
+        files = index.scan()
+        full = full or index.needs_full_sync()
+
+        if full and jobs > 1:
+            res = self._rsync_sharded(src, remote, files, jobs, stats)
+        elif full:
+            res = self.rsync(src, remote, stats)
+        else:
+            changed, deleted = index.changes(files)
+            self._logger.debug('%d changed and %d deleted paths',
+                               len(changed), len(deleted))
+            res = True
+            if deleted:
+                res = self._rsync_delete(deleted, dest)
+            if res and changed:
+                sizes = dict([(path, files[path] and files[path][1] or 0)
+                              for path in changed])
+                res = self._run_rsync_shards(
+                    lambda shard, shard_stats: self._rsync_files(
+                        shard, src, remote, shard_stats),
+                    balance(sizes, jobs), stats)
+
+        stats['duration'] = time.time() - start
+        self.last_sync = stats
+
+        if res:
+            index.save(files, full=full)
+        return res
 
     def rsync_down(self):
         if not self.project.rsync_enabled():
             return
 
-        return self.rsync(
+        # local files are about to change behind the index's back
+        self.sync_index().reset()
+
+        stats = {}
+        start = time.time()
+        res = self.rsync(
             '%s:/data/%s/' % (self.ip(), self.project.name()),
-            '%s/' % self.project.folder()
+            '%s/' % self.project.folder(),
+            stats
         )
+        stats['duration'] = time.time() - start
+        self.last_sync = stats
+        return res
 
     def __repr__(self):
         return '<Box %s from project %s>' % (self.name(),
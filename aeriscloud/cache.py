@@ -0,0 +1,130 @@
+"""
+Small JSON caches stored in the data dir, allowing data that is costly to
+retrieve to be shared between aeris invocations
+"""
+
+import json
+import os
+import tempfile
+import time
+
+from .config import data_dir
+from .log import get_logger
+
+logger = get_logger('cache')
+
+
+def cache_dir():
+    return os.path.join(data_dir(), 'cache')
+
+
+def file_mtime(path):
+    """
+    Return the mtime of the given file, or None if it does not exists
+
+    :param path: str
+    :return: float|None
+    """
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+class FileCache(object):
+    """
+    A dict-like cache stored as a JSON file, every entry is stored with the
+    time it was set at so that callers can apply their own TTL
+
+    :param name: str The name of the cache file
+    """
+
+    def __init__(self, name):
+        self._file = os.path.join(cache_dir(), '%s.json' % name)
+        self._data = None
+        self._mtime = None
+
+    def _load(self):
+        # reload the file if another process updated it
+        mtime = file_mtime(self._file)
+        if self._data is not None and mtime == self._mtime:
+            return
+
+        self._data = {}
+        self._mtime = mtime
+        if mtime is None:
+            return
+
+        try:
+            with open(self._file) as fd:
+                self._data = json.load(fd)
+        except (IOError, ValueError) as e:
+            logger.debug('ignoring invalid cache file %s: %s', self._file, e)
+
+    def get(self, key, ttl=None):
+        """
+        Return the value stored for the given key, or None if it does not
+        exists or is older than ttl seconds
+
+        :param key: str
+        :param ttl: int|float
+        :return: any
+        """
+        self._load()
+        entry = self._data.get(key)
+        if not entry:
+            return None
+        if ttl is not None and time.time() - entry['time'] > ttl:
+            return None
+        return entry['value']
+
+    def age(self, key):
+        """
+        Return the age in seconds of the given entry
+
+        :param key: str
+        :return: float|None
+        """
+        self._load()
+        if key not in self._data:
+            return None
+        return time.time() - self._data[key]['time']
+
+    def set(self, key, value):
+        self._load()
+        self._data[key] = {'time': time.time(), 'value': value}
+        self.save()
+
+    def delete(self, key):
+        self._load()
+        if self._data.pop(key, None) is not None:
+            self.save()
+
+    def delete_prefix(self, prefix):
+        self._load()
+        keys = [key for key in self._data if key.startswith(prefix)]
+        for key in keys:
+            del self._data[key]
+        if keys:
+            self.save()
+
+    def clear(self):
+        self._data = {}
+        self.save()
+
+    def save(self):
+        """
+        Atomically write the cache to the disk, failing to do so is not an
+        error as the cache will just be rebuilt on the next run
+        """
+        if not os.path.isdir(cache_dir()):
+            os.makedirs(cache_dir())
+
+        try:
+            fd, tmp_file = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self._data, f)
+            os.rename(tmp_file, self._file)
+            self._mtime = file_mtime(self._file)
+        except (IOError, OSError) as e:
+            logger.warn('could not write cache file %s: %s', self._file, e)
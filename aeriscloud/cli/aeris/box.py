@@ -4,13 +4,17 @@ import click
 import json
 import os
 import re
+import requests
 import sys
 
 from ordereddict import OrderedDict
 
-from aeriscloud.cli.helpers import Command
-from aeriscloud.basebox import baseboxes
+from aeriscloud.cli.helpers import Command, fatal
+from aeriscloud.basebox import baseboxes, basebox_source, fetch, register, \
+    server_url, BaseboxError, DEFAULT_SEGMENTS
+from aeriscloud.clone import prepare_master, gc_masters, BaseboxNotFound
 from aeriscloud.config import basebox_bucket
+from aeriscloud.project import all as all_projects
 
 
 @click.group()
@@ -135,5 +139,90 @@ def generate(output_json, output_path):
                % (output_path, basebox_bucket()))
 
 
+@cli.command(cls=Command)
+@click.argument('basebox', nargs=-1, required=True)
+def prepare(basebox):
+    """
+    Prepare the master VM used for linked clones
+    """
+    for name in basebox:
+        try:
+            master = prepare_master(name)
+        except BaseboxNotFound as e:
+            fatal(str(e))
+        click.echo('%s is ready as %s' % (
+            click.style(name, fg='cyan'),
+            click.style(master, fg='green')))
+
+
+@cli.command(cls=Command)
+@click.option('--all', 'gc_all', is_flag=True,
+              help="Also delete the masters of the latest base boxes")
+def gc(gc_all):
+    """
+    Delete the master VMs that are not used anymore
+    """
+    deleted = gc_masters(all=gc_all)
+    if not deleted:
+        click.secho('No unused master found', fg='cyan')
+        return
+
+    for name in deleted:
+        click.echo('Deleted %s' % click.style(name, fg='green'))
+
+
+def _progress(name):
+    shown = [None]
+
+    def _echo(done, total):
+        if not total:
+            return
+        percent = done * 100 // total
+        if percent != shown[0]:
+            shown[0] = percent
+            click.echo('\r%s: %d%%' % (name, percent), nl=False)
+            if done == total:
+                click.echo('')
+    return _echo
+
+
+@cli.command(cls=Command)
+@click.option('-s', '--segments', default=DEFAULT_SEGMENTS, type=int,
+              help="How many parts of a box are downloaded at once")
+def prefetch(segments):
+    """
+    Download the base boxes used by the local projects
+    """
+    sources = {}
+    for project in all_projects():
+        url = server_url(project)
+        for box in project.boxes():
+            sources.setdefault(box.basebox, url)
+
+    if not sources:
+        click.secho('No base box used by the local projects', fg='cyan')
+        return
+
+    failed = False
+    for name, url in sorted(sources.items()):
+        try:
+            source = basebox_source(name, url)
+            path = fetch(source, segments, _progress(name))
+            added = register(source, path)
+        except (BaseboxError, IOError, OSError,
+                requests.RequestException) as e:
+            click.secho('%s: %s' % (name, e), fg='red')
+            failed = True
+            continue
+
+        click.echo('%s %s is %s' % (
+            click.style(name, fg='cyan'),
+            click.style(source['version'], fg='green'),
+            added and 'cached and added to vagrant' or 'up to date'))
+
+    if failed:
+        sys.exit(1)
+
+
 if __name__ == '__main__':
     cli()
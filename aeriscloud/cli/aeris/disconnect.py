@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+import click
+
+from aeriscloud.cli.helpers import standard_options, Command
+
+
+@click.command(cls=Command)
+@standard_options(multiple=True)
+def cli(boxes):
+    """
+    Close the shared ssh connections to boxes
+    """
+    for project, project_boxes in boxes.iteritems():
+        for box in project_boxes.running():
+            if box.ssh_disconnect():
+                click.echo(''.join([
+                    click.style('\tConnection to ', fg='green'),
+                    click.style(box.name(), bold=True),
+                    click.style(' closed.', fg='green')
+                ]))
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+
+import click
+import os
+
+from aeriscloud.cli.helpers import Command, CLITable, fatal, info, \
+    success, warning
+from aeriscloud.disk import list_disks, orphan_disks, compact_disks, \
+    clone_disks, delete_orphan
+from aeriscloud.utils import human_size, timestamp, run_parallel, \
+    DEFAULT_JOBS
+from aeriscloud.virtualbox import list_vms
+
+
+def _size(size):
+    if size is None:
+        return '-'
+    return human_size(size)
+
+
+def _progress(names):
+    def _echo(uuid, percent):
+        timestamp('%s: %d%%' % (names.get(uuid, uuid), percent))
+    return _echo
+
+
+def _in_use(disk, running):
+    """
+    Whether the disk is locked, or used by one of the running VMs
+    """
+    if (disk['state'] or '').startswith('locked'):
+        return True
+    return any(['%s (UUID' % name in (disk['vms'] or '')
+                for name in running])
+
+
+def _resolve(disks, specs, all_disks):
+    """
+    Resolve the given uuids or paths to disk uuids
+    """
+    if all_disks:
+        running = list_vms(True)
+        uuids = []
+        for disk in sorted(disks.values(), key=lambda d: d['location']):
+            if disk['format'] != 'VDI':
+                continue
+            if _in_use(disk, running):
+                info('skipping %s, it is in use by a running box' %
+                     (disk['location'] or disk['uuid']))
+                continue
+            uuids.append(disk['uuid'])
+        return uuids
+
+    by_location = dict([(os.path.realpath(disk['location']), uuid)
+                        for uuid, disk in disks.iteritems()
+                        if disk['location']])
+    uuids = []
+    for spec in specs:
+        if spec in disks:
+            uuids.append(spec)
+        elif os.path.realpath(spec) in by_location:
+            uuids.append(by_location[os.path.realpath(spec)])
+        else:
+            fatal('error: unknown disk %s' % spec)
+    return uuids
+
+
+def _report(results, names, action):
+    failed = False
+    for uuid, res in results:
+        if isinstance(res, Exception):
+            warning('%s: %s failed: %s' % (names[uuid], action, res))
+            failed = True
+        else:
+            success('%s: %s' % (names[uuid], action))
+    return failed
+
+
+@click.group()
+def cli():
+    """
+    Manage the disks used by boxes
+    """
+    pass
+
+
+@cli.command('list', cls=Command)
+@click.option('--orphans', is_flag=True,
+              help='Only list data disks not used by any box')
+def list_cmd(orphans):
+    """
+    List disks with their size on disk
+    """
+    if orphans:
+        disks = orphan_disks()
+        if not disks:
+            click.secho('No orphan disk found', fg='cyan')
+            return
+        CLITable('path', 'uuid', 'size').echo([
+            {'path': disk['path'], 'uuid': disk['uuid'] or '-',
+             'size': _size(disk['size'])}
+            for disk in disks
+        ])
+        return
+
+    disks = sorted(list_disks().values(), key=lambda d: d['location'])
+    if not disks:
+        click.secho('No disk found', fg='cyan')
+        return
+
+    CLITable('location', 'format', 'size', 'vms').echo([
+        {'location': disk['location'] or '-',
+         'format': disk['format'] or '-',
+         'size': _size(disk['size']),
+         'vms': disk['vms'] or click.style('none', fg='yellow')}
+        for disk in disks
+    ])
+
+
+@cli.command(cls=Command)
+@click.argument('disks', nargs=-1)
+@click.option('--all', 'all_disks', is_flag=True,
+              help='Compact every VDI disk')
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many disks to compact at the same time')
+def compact(disks, all_disks, jobs):
+    """
+    Reclaim the free space of disks
+
+    Only blocks that have been zeroed in the guest can be reclaimed, and
+    disks used by running boxes cannot be compacted.
+    """
+    if not disks and not all_disks:
+        fatal('error: specify the disks to compact or use --all')
+
+    known = list_disks()
+    uuids = _resolve(known, disks, all_disks)
+    names = dict([(uuid, os.path.basename(known[uuid]['location'] or uuid))
+                  for uuid in uuids])
+
+    results = compact_disks(uuids, jobs, _progress(names))
+    after = list_disks()
+    for uuid, res in results:
+        if not isinstance(res, Exception) and uuid in after:
+            names[uuid] += ' (%s -> %s)' % (_size(known[uuid]['size']),
+                                            _size(after[uuid]['size']))
+
+    if _report(results, names, 'compacted'):
+        fatal('error: some disks could not be compacted')
+
+
+@cli.command(cls=Command)
+@click.argument('disks', nargs=-1, required=True)
+@click.argument('dest', nargs=1)
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many disks to clone at the same time')
+def clone(disks, dest, jobs):
+    """
+    Clone disks to the dest folder
+    """
+    if not os.path.isdir(dest):
+        fatal('error: %s is not a folder' % dest)
+
+    known = list_disks()
+    uuids = _resolve(known, disks, False)
+    names = dict([(uuid, os.path.basename(known[uuid]['location'] or uuid))
+                  for uuid in uuids])
+
+    results = clone_disks(uuids, dest, jobs, _progress(names))
+    if _report(results, names, 'cloned'):
+        fatal('error: some disks could not be cloned')
+
+
+@cli.command(cls=Command)
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many disks to delete at the same time')
+@click.confirmation_option(prompt='Are you sure you want to delete every '
+                                  'orphan disk?')
+def prune(jobs):
+    """
+    Delete the data disks not used by any box
+    """
+    orphans = orphan_disks()
+    if not orphans:
+        click.secho('No orphan disk found', fg='cyan')
+        return
+
+    results = run_parallel(delete_orphan, orphans, jobs)
+    names = dict([(orphan['path'], orphan['path']) for orphan in orphans])
+    if _report([(orphan['path'], res) for orphan, res in results],
+               names, 'deleted'):
+        fatal('error: some disks could not be deleted')
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import click
+import os
+
+from aeriscloud.cli.helpers import Command, CLITable, fatal, info, success
+from aeriscloud.vagrant import NFS, MachineIndex
+
+
+def _machine_name(index, uuid):
+    machine = index and index.get_by_uuid(uuid)
+    if not machine:
+        return '-'
+    return '%s (%s)' % (machine.name,
+                        os.path.dirname(machine.vagrant_path or '') or '-')
+
+
+@click.group()
+def cli():
+    """
+    Diagnose and fix issues with the local environment
+    """
+    pass
+
+
+@cli.command(cls=Command)
+@click.option('-n', '--dry-run', is_flag=True,
+              help='Only list the invalid exports')
+def nfs(dry_run):
+    """
+    Remove the NFS exports of folders that do not exist anymore
+
+    This is done automatically before running vagrant whenever the exports
+    file changed.
+    """
+    exports = NFS()
+    stale = exports.reconcile(force=True, dry_run=True)
+    # keep the folders of the stale exports to display them once pruned
+    folders = dict(exports.exports)
+    if not dry_run:
+        try:
+            exports.reconcile(force=True)
+        except RuntimeError as e:
+            fatal('error: %s' % e)
+
+    try:
+        index = MachineIndex()
+    except (IOError, ValueError):
+        index = None
+
+    if not folders:
+        info('No NFS export found in %s' % exports.export_file)
+        return
+
+    CLITable('uuid', 'machine', 'folders', 'state').echo([
+        {'uuid': uuid,
+         'machine': _machine_name(index, uuid),
+         'folders': ', '.join(folders[uuid]) or '-',
+         'state': click.style('stale', fg='yellow') if dry_run else
+         click.style('pruned', fg='green')}
+        for uuid in stale
+    ] + [
+        {'uuid': uuid,
+         'machine': _machine_name(index, uuid),
+         'folders': ', '.join(paths) or '-',
+         'state': 'ok'}
+        for uuid, paths in sorted(folders.items())
+        if uuid not in stale
+    ])
+
+    if not stale:
+        success('Every NFS export is valid')
+
+
+if __name__ == '__main__':
+    cli()
@@ -3,41 +3,55 @@
 import click
 import sys
 
+from aeriscloud.box import BoxList
 from aeriscloud.cli.helpers import standard_options, Command
+from aeriscloud.utils import DEFAULT_JOBS
 
 
 @click.command(cls=Command)
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many boxes to halt at the same time')
 @standard_options(multiple=True)
-def cli(boxes):
+def cli(boxes, jobs):
     """
     Halt a box, can be started back using up
     """
+    running_boxes = BoxList()
     for project, project_boxes in boxes.iteritems():
-        running_boxes = project_boxes.running()
+        project_running = project_boxes.running()
         project_name = click.style(project.name(), fg='magenta')
 
-        if not running_boxes:
+        if not project_running:
             click.secho('No running boxes found for %s' % project_name,
                         fg='yellow', bold=True)
             continue
 
         click.secho('Halting boxes for %s' % project_name,
                     fg='blue', bold=True)
-        for box in running_boxes:
-            res = box.halt()
-            if res == 0:
-                click.echo(''.join([
-                    click.style('\tbox ', fg='green'),
-                    click.style(box.name(), bold=True),
-                    click.style(' has been halted.', fg='green')
-                ]))
-            else:
-                click.echo(''.join([
-                    click.style('\tan error occured while halting box ',
-                                fg='red'),
-                    click.style(box.name(), bold=True),
-                ]))
-                sys.exit(res)
+        running_boxes.extend(project_running)
+
+    exit_code = 0
+    for box, res in running_boxes.halt(jobs):
+        if res == 0:
+            click.echo(''.join([
+                click.style('\tbox ', fg='green'),
+                click.style(box.vm_name(), bold=True),
+                click.style(' has been halted.', fg='green')
+            ]))
+            continue
+
+        click.echo(''.join([
+            click.style('\tan error occured while halting box ',
+                        fg='red'),
+            click.style(box.vm_name(), bold=True),
+        ]))
+        if isinstance(res, Exception):
+            click.secho('\t%s' % res, fg='red')
+            res = 1
+        exit_code = exit_code or res
+
+    if exit_code:
+        sys.exit(exit_code)
 
 
 if __name__ == '__main__':
@@ -10,8 +10,10 @@ from aeriscloud.cli.helpers import standard_options, Command, render_cli
 
 @click.command(cls=Command)
 @click.option('-q', '--quiet', is_flag=True)
+@click.option('-n', '--last', type=int, default=None,
+              help='Only show the last N provisioning runs')
 @standard_options()
-def cli(box, quiet):
+def cli(box, quiet, last):
     """
     Shows provisioning history for a box
     """
@@ -19,7 +21,7 @@ def cli(box, quiet):
         click.secho('error: box %s is not running' % box.name(), fg='red')
         sys.exit(1)
 
-    history = box.history()
+    history = box.history(limit=last)
 
     # cleanup ansible output
     av = re.compile(r'ansible (\d+\.\d+\.\d+)( \(detached HEAD (\w+)\) '
@@ -5,16 +5,20 @@ import os
 import sys
 
 from aeriscloud.ansible import ansible_path, get_job_file, list_jobs
+from aeriscloud.box import BoxList
 from aeriscloud.cli.helpers import standard_options, Command
 
 
 @click.command(cls=Command)
+@click.option('-f', '--forks', type=int, default=None,
+              help='How many boxes ansible works on at the same time')
 @click.argument('job', required=False)
 @click.argument('extra', nargs=-1)
-@standard_options(start_prompt=False)
-def cli(box, job, extra):
+@standard_options(multiple=True)
+def cli(boxes, forks, job, extra):
     """
-    Run a maintenance job in a box.
+    Run a maintenance job in boxes, every box runs it in a single ansible
+    run.
 
     Call without a job to get the job list
     """
@@ -32,16 +36,20 @@ def cli(box, job, extra):
                 ))
         return
 
-    if not box.is_running():
-        click.secho('error: box %s is not running' % box.name(), fg='red')
+    running_boxes = BoxList()
+    for project, project_boxes in boxes.iteritems():
+        running_boxes.extend(project_boxes.running())
+
+    if not running_boxes:
+        click.secho('error: no running boxes found', fg='red')
         sys.exit(1)
 
+    # the private key of every box is part of the inventory
     playbook = os.path.join(ansible_path, 'dev_jobs.yml')
-    ansible = box.ansible()
+    ansible = running_boxes.ansible(forks=forks)
     ansible(playbook,
             '--extra-vars', 'job_file=%s' % get_job_file(job),
             '--extra-vars', 'deploy_user="vagrant"',
-            '--private-key', box.ssh_key(),
             *extra,
             _out=sys.stdout,
             _err=sys.stderr)
@@ -24,7 +24,7 @@ def cli(box, command):
         # sync failed, message should already be displayed, exit
         sys.exit(1)
 
-    res = box.ssh_shell('make %s' % ' '.join(map(quote, command)))
+    res = box.run('make %s' % ' '.join(map(quote, command)))
 
     # make returns ENOENT if any error happened so we need to use
     # another code
@@ -1,24 +1,55 @@
 #!/usr/bin/env python
 
 import click
+import sys
 
+from aeriscloud.box import BoxList
 from aeriscloud.cli.helpers import standard_options, Command, render_cli
-from aeriscloud.utils import timestamp
+from aeriscloud.utils import timestamp, DEFAULT_JOBS
 
 
 @click.command(cls=Command)
+@click.option('-f', '--forks', type=int, default=None,
+              help='How many boxes ansible provisions at the same time')
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many boxes run their shell provisioners at the '
+                   'same time')
 @click.argument('extra', nargs=-1)
-@standard_options()
-def cli(box, extra):
+@standard_options(multiple=True)
+def cli(boxes, forks, jobs, extra):
     """
-    Provision a box
+    Provision boxes, the boxes of a project are provisioned by a single
+    ansible run
     """
-    res = box.vagrant('provision', *extra)
+    running_boxes = BoxList()
+    for project, project_boxes in boxes.iteritems():
+        running_boxes.extend(project_boxes.running())
 
-    if res == 0:
-        timestamp(render_cli('provision-success', box=box))
+    if not running_boxes:
+        click.secho('No running boxes found', fg='yellow', bold=True)
+        return
+
+    # extra arguments are given to vagrant, one box at a time
+    if len(running_boxes) == 1 or extra:
+        results = [(box, box.vagrant('provision', *extra))
+                   for box in running_boxes]
     else:
-        timestamp(render_cli('provision-failure'))
+        results = running_boxes.provision(forks, jobs)
+
+    exit_code = 0
+    for box, res in results:
+        if isinstance(res, Exception):
+            click.secho('%s: %s' % (box.vm_name(), res), fg='red')
+            res = 1
+
+        if res == 0:
+            timestamp(render_cli('provision-success', box=box))
+        else:
+            timestamp(render_cli('provision-failure'))
+        exit_code = exit_code or res
+
+    if exit_code:
+        sys.exit(exit_code)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+
+import click
+
+from aeriscloud.cli.helpers import standard_options, Command, fatal
+from aeriscloud.utils import timestamp
+from aeriscloud.virtualbox import InvalidState, VMNotFound
+
+
+@click.command(cls=Command)
+@click.argument('snapshot', required=False)
+@standard_options(start_prompt=False)
+def cli(box, snapshot):
+    """
+    Reset a box to its last snapshot, see snapshot
+    """
+    if snapshot and snapshot not in box.snapshots():
+        fatal('error: snapshot %s not found' % snapshot)
+
+    timestamp('Resetting box %s' % box.name())
+    try:
+        snapshot = box.reset(snapshot)
+    except (InvalidState, VMNotFound) as e:
+        fatal('error: %s' % e)
+
+    if not snapshot:
+        fatal('error: box %s does not have any snapshot, they are taken '
+              'after each successful provisioning' % box.name())
+
+    timestamp('Box %s has been reset to %s' % (box.name(), snapshot))
+
+
+if __name__ == '__main__':
+    cli()
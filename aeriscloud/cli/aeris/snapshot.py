@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+import click
+
+from aeriscloud.cli.helpers import standard_options, Command, fatal
+from aeriscloud.virtualbox import InvalidState, VMNotFound
+
+
+@click.group()
+def cli():
+    """
+    Manage box snapshots, see reset
+    """
+    pass
+
+
+@cli.command('list', cls=Command)
+@standard_options(start_prompt=False)
+def list_cmd(box):
+    """
+    List the snapshots of a box
+    """
+    snapshots = box.snapshots()
+    if not snapshots:
+        click.secho('No snapshot found for %s' % box.name(), fg='yellow')
+        return
+
+    for snapshot in snapshots:
+        click.echo('* %s' % click.style(snapshot, fg='green'))
+
+
+@cli.command(cls=Command)
+@click.option('-n', '--name', default=None,
+              help='Name of the snapshot, defaults to a timestamp')
+@click.option('--retention', default=None, type=int,
+              help='How many automatic snapshots to keep')
+@standard_options(start_prompt=False)
+def take(box, name, retention):
+    """
+    Take a snapshot of a box
+    """
+    if box.status() == 'not created':
+        fatal('error: box %s has not been created' % box.name())
+
+    try:
+        name = box.snapshot(name, retention)
+    except InvalidState as e:
+        fatal('error: %s' % e)
+
+    click.echo(''.join([
+        click.style('Snapshot ', fg='green'),
+        click.style(name, bold=True),
+        click.style(' taken.', fg='green')
+    ]))
+
+
+@cli.command(cls=Command)
+@click.argument('name')
+@standard_options(start_prompt=False)
+def delete(box, name):
+    """
+    Delete a snapshot of a box
+    """
+    if name not in box.snapshots():
+        fatal('error: snapshot %s not found' % name)
+
+    try:
+        box.delete_snapshot(name)
+    except (InvalidState, VMNotFound) as e:
+        fatal('error: %s' % e)
+
+    click.echo(''.join([
+        click.style('Snapshot ', fg='green'),
+        click.style(name, bold=True),
+        click.style(' deleted.', fg='green')
+    ]))
+
+
+if __name__ == '__main__':
+    cli()
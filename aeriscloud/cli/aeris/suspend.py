@@ -1,34 +1,55 @@
 #!/usr/bin/env python
 
 import click
+import sys
 
+from aeriscloud.box import BoxList
 from aeriscloud.cli.helpers import standard_options, Command
+from aeriscloud.utils import DEFAULT_JOBS
 
 
 @click.command(cls=Command)
+@click.option('-j', '--jobs', default=DEFAULT_JOBS,
+              help='How many boxes to suspend at the same time')
 @standard_options(multiple=True)
-def cli(boxes):
+def cli(boxes, jobs):
     """
     Suspend a running box, see resume
     """
+    running_boxes = BoxList()
     for project, project_boxes in boxes.iteritems():
-        running_boxes = project_boxes.running()
+        project_running = project_boxes.running()
         project_name = click.style(project.name(), fg='magenta')
 
-        if not running_boxes:
+        if not project_running:
             click.secho('No running boxes found for %s' % project_name,
                         fg='yellow', bold=True)
             continue
 
         click.secho('Suspending boxes for %s' % project_name,
                     fg='blue', bold=True)
-        for box in running_boxes:
-            box.suspend()
+        running_boxes.extend(project_running)
+
+    failed = False
+    for box, res in running_boxes.suspend(jobs):
+        if isinstance(res, Exception):
             click.echo(''.join([
-                click.style('\tBox ', fg='green'),
-                click.style(box.name(), bold=True),
-                click.style(' has been suspended.', fg='green')
+                click.style('\tan error occured while suspending box ',
+                            fg='red'),
+                click.style(box.vm_name(), bold=True),
+                click.style(': %s' % res, fg='red')
             ]))
+            failed = True
+            continue
+
+        click.echo(''.join([
+            click.style('\tBox ', fg='green'),
+            click.style(box.vm_name(), bold=True),
+            click.style(' has been suspended.', fg='green')
+        ]))
+
+    if failed:
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -3,10 +3,55 @@
 import click
 import sys
 
-from aeriscloud.cli.helpers import standard_options, Command
+from aeriscloud import sshbench
+from aeriscloud.cli.helpers import standard_options, Command, CLITable
+from aeriscloud.utils import human_size
 
 
-def sync(box, direction):
+def _throughput(box):
+    stats = box.last_sync
+    if not stats or 'duration' not in stats:
+        return ''
+    transferred = stats.get('sent', 0) + stats.get('received', 0)
+    return ' (%d files, %s in %.1fs, %s/s)' % (
+        stats.get('transferred', 0), human_size(transferred),
+        stats['duration'],
+        human_size(transferred / max(stats['duration'], 0.001)))
+
+
+def _benchmark_row(res):
+    if res['duration'] is None:
+        return {'cipher': res['cipher'], 'compression': res['compression'],
+                'time': click.style('failed', fg='red'), 'throughput': '-'}
+    return {
+        'cipher': res['cipher'],
+        'compression': res['compression'],
+        'time': '%.2fs' % res['duration'],
+        'throughput': '%s/s' % human_size(res['size'] /
+                                          max(res['duration'], 0.001))
+    }
+
+
+def _benchmark(box):
+    click.secho('Benchmarking ssh transports to %s...' % box.name(),
+                fg='cyan', bold=True)
+    results = sshbench.benchmark(box)
+    CLITable('cipher', 'compression', 'time', 'throughput').echo(
+        [_benchmark_row(res) for res in results])
+
+    if not results or results[0]['duration'] is None:
+        click.secho('error: no cipher could be used', fg='red', err=True)
+        sys.exit(1)
+
+    sshbench.save(results[0])
+    # the shared connection still uses the previous options
+    box.ssh_disconnect()
+    click.secho('Using %s with compression %s' %
+                (results[0]['cipher'], results[0]['compression']),
+                fg='green', bold=True)
+
+
+def sync(box, direction, full=False):
     if not box.project.rsync_enabled():
         return None
 
@@ -14,15 +59,17 @@ def sync(box, direction):
         click.secho('Syncing files down from the box...',
                     fg='cyan', bold=True)
         if box.rsync_down():
-            click.secho('Sync down done!', fg='green', bold=True)
+            click.secho('Sync down done!%s' % _throughput(box),
+                        fg='green', bold=True)
         else:
             click.secho('Sync down failed!', fg='red', bold=True)
             return False
     elif direction == 'up':
         click.secho('Syncing files up to the box...',
                     fg='cyan', bold=True)
-        if box.rsync_up():
-            click.secho('Sync up done!', fg='green', bold=True)
+        if box.rsync_up(full=full):
+            click.secho('Sync up done!%s' % _throughput(box),
+                        fg='green', bold=True)
         else:
             click.secho('Sync up failed!', fg='red', bold=True)
             return False
@@ -37,8 +84,14 @@ def sync(box, direction):
 @click.command(cls=Command)
 @click.argument('direction', required=False, default='up',
                 type=click.Choice(['up', 'down']))
+@click.option('--full', is_flag=True,
+              help='Compare every file with the box instead of only '
+                   'pushing the files changed since the last sync')
+@click.option('--benchmark', is_flag=True,
+              help='Find the fastest ssh cipher and compression to talk '
+                   'to the box and use it from now on')
 @standard_options()
-def cli(box, direction='up'):
+def cli(box, direction='up', full=False, benchmark=False):
     """
     Sync data up or down
     """
@@ -47,12 +100,15 @@ def cli(box, direction='up'):
                     fg='red', err=True)
         sys.exit(1)
 
+    if benchmark:
+        return _benchmark(box)
+
     if box.project.name() == 'aeriscloud':
         click.secho('error: cannot be used on infra boxes',
                     fg='red', err=True)
         sys.exit(1)
 
-    res = sync(box, direction)
+    res = sync(box, direction, full)
 
     if res is None:
         click.secho('error: rsync is not enabled on this project',
@@ -4,7 +4,9 @@ import click
 
 from requests.exceptions import HTTPError
 
-from aeriscloud.cli.helpers import standard_options, Command, start_box, fatal
+from aeriscloud.cli.helpers import standard_options, Command, start_box, \
+    fatal, CLITable, bold
+from aeriscloud.vagrantevents import recent_runs, machine_readable
 
 
 def _parse_provision(ctx, param, value):
@@ -18,18 +20,45 @@ def _parse_provision(ctx, param, value):
     return provisioners
 
 
+def _print_timings(box):
+    runs = recent_runs(box.project.name(), box.name())
+    if not runs:
+        click.echo('vagrant was not run, no timings available')
+        return
+
+    for run in runs:
+        click.echo(bold('\nvagrant %s: %.1fs' % (run['command'],
+                                                 run['total'])))
+        total = run['total'] or 1
+        CLITable('phase', 'duration', 'share').echo([
+            {'phase': phase,
+             'duration': '%.1fs' % duration,
+             'share': '%d%%' % round(duration * 100 / total)}
+            for phase, duration in run['phases']
+        ])
+
+
 @click.command(cls=Command)
 @click.option('--provision-with', default=None, callback=_parse_provision)
+@click.option('--timings', is_flag=True,
+              help='Show how long each phase of the vagrant runs took')
 @standard_options(start_prompt=False)
-def cli(box, provision_with):
+def cli(box, provision_with, timings):
     """
     Starts the given box and provision it
     """
+    if timings:
+        machine_readable(True)
+
     try:
-        return start_box(box, provision_with)
+        res = start_box(box, provision_with)
     except HTTPError as e:
         fatal(e.message)
 
+    if timings:
+        _print_timings(box)
+    return res
+
 
 if __name__ == '__main__':
     cli()
@@ -10,6 +10,7 @@ import time
 from watchdog.observers import Observer
 from watchdog.tricks import AutoRestartTrick
 
+from aeriscloud.agent import AgentProcess
 from aeriscloud.cli.aeris.sync import sync
 from aeriscloud.cli.helpers import standard_options, Command
 
@@ -27,9 +28,22 @@ class BoxCommandAutoRestart(AutoRestartTrick):
     def start(self):
         self.state = 'starting'
         sync(self.box, 'up')
-        self.process = self.box.ssh_shell(self.command, popen=True)
+        self.process = self.box.run(self.command, popen=True)
         self.state = 'started'
 
+    def stop(self):
+        """
+        Stop the command, either an ssh process whose whole process group
+        is killed by watchdog, or a command ran by the agent of the box
+        """
+        if not isinstance(self.process, AgentProcess):
+            return AutoRestartTrick.stop(self)
+
+        self.process.send_signal(self.stop_signal)
+        if self.process.wait(self.kill_after) is None:
+            self.process.kill()
+        self.process = None
+
     def poll(self):
         """
         Used to detect if the process quit unexpectedly
@@ -113,6 +127,11 @@ def cli(box, command=None):
                     fg='red', err=True)
         sys.exit(1)
 
+    if not box.wait_ready():
+        click.secho('error: box %s is not reachable' % (box.name()),
+                    fg='red', err=True)
+        sys.exit(1)
+
     if box.project.name() == 'aeriscloud':
         click.secho('error: cannot be used on infra boxes',
                     fg='red', err=True)
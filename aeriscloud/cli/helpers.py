@@ -8,14 +8,16 @@ from aeriscloud import __version__ as ac_version
 from click._compat import strip_ansi
 from functools import update_wrapper
 from requests.exceptions import HTTPError
+from sh import ErrorReturnCode
 
 from ..box import BoxList
-from ..config import config, verbosity
+from ..config import config, verbosity, force_vagrant
 from ..expose import ExposeConnectionError, ExposeTimeout
+from ..history import box_stats
 from ..log import set_log_level, set_log_file, get_logger
 from ..project import get, from_cwd, all as all_projects
-from ..utils import jinja_env, timestamp
-from ..virtualbox import list_vms
+from ..utils import jinja_env, memoized_stats, timestamp
+from ..virtualbox import invalidate_vm, snapshot_retention, InvalidState
 
 logger = get_logger('cli.helpers')
 
@@ -48,6 +50,12 @@ class AerisCLI(click.MultiCommand):
                 param_decls=['--log-file'],
                 help='When using the verbose flag, redirects '
                      'output to this file'
+            ),
+            click.Option(
+                param_decls=['--force-vagrant'],
+                is_flag=True,
+                help='Run every vagrant command through vagrant, even '
+                     'those AerisCloud can run faster by itself'
             )
         ]
         super(AerisCLI, self).__init__(context_settings=cs, params=params,
@@ -100,6 +108,8 @@ you through a series of questions to setup your configuration.
             verbosity(ctx.params['verbose'])
         if 'log_file' in ctx.params and ctx.params['log_file']:
             set_log_file(ctx.params['log_file'])
+        if ctx.params.get('force_vagrant'):
+            force_vagrant(True)
 
         # try running the command
         try:
@@ -141,6 +151,46 @@ you through a series of questions to setup your configuration.
             else:
                 fatal('error: an internal exception caused "%s" '
                       'to exit unexpectedly' % ctx.info_name)
+        finally:
+            if verbosity() >= 3:
+                _log_cache_stats()
+
+
+def _log_cache_stats():
+    for name, info in sorted(memoized_stats().iteritems()):
+        logger.debug('cache %s: %d hits, %d misses, %d evictions, '
+                     '%d/%s entries', name, info['hits'], info['misses'],
+                     info['evictions'], info['size'], info['maxsize'])
+
+
+def _snapshot_box(box, provisioned, res):
+    """
+    Snapshot a box that was just provisioned successfully so that it can be
+    reset to this state with aeris reset
+
+    :param box: aeriscloud.box.Box
+    :param provisioned: bool Whether start_box ran the ansible provisioner
+    :param res: int|bool The result of the provisioning
+    """
+    if not provisioned or not (res == 0 or res is True) or \
+            snapshot_retention() <= 0:
+        return
+
+    try:
+        timestamp('Taking snapshot %s' % box.snapshot())
+    except (ErrorReturnCode, InvalidState) as e:
+        warning('warning: could not snapshot box %s: %s' % (box.name(), e))
+
+
+def _needs_provision(box):
+    """
+    Whether the last provisioning of a running box failed or did not reach it
+    """
+    hist = box.history()
+    if not hist or hist[-1].get('failed_at'):
+        return True
+    stats = box_stats(hist[-1], box)
+    return not stats or stats['unreachable'] > 0
 
 
 def start_box(box, provision_with=None):
@@ -149,7 +199,12 @@ def start_box(box, provision_with=None):
 
     provision = provision_with or []
 
-    if 'shell' not in provision and box.status() != 'not created':
+    # vagrant runs every provisioner when creating a box, only the shell
+    # one when starting it again unless asked otherwise
+    created = box.status() == 'not created'
+    ansible = created or 'ansible' in provision
+
+    if 'shell' not in provision and not created:
         provision.append('shell')
 
     extra_args = []
@@ -161,35 +216,37 @@ def start_box(box, provision_with=None):
         manual_provision = True
         click.echo('Resuming box %s' % box.name())
 
+    provisioned = False
     if not box.is_running():
         try:
             extra_args_copy = extra_args[:]
             if '--provision-with' in extra_args_copy:
                 extra_args_copy.insert(0, '--provision')
             res = box.up(*extra_args_copy)
+            provisioned = ansible and not manual_provision
         except (ExposeTimeout, ExposeConnectionError):
             warning('warning: expose is not available at the moment')
     else:
-        hist = box.history()
-        if not hist or (
-            'failed_at' in hist[-1] and
-                hist[-1]['failed_at']
-        ) or hist[-1]['stats'][box.name()]['unreachable'] > 0:
+        if _needs_provision(box):
             # run provisioning if last one failed
             res = box.vagrant('provision')
+            provisioned = True
 
         box.expose()  # just in case
 
     if manual_provision:
-        box.vagrant('provision', *extra_args)
+        provisioned = box.vagrant('provision', *extra_args) == 0 and \
+            'ansible' in provision
 
     if res == 0 or res is True:
         timestamp(render_cli('provision-success', box=box))
     else:
         timestamp(render_cli('provision-failure'))
 
+    _snapshot_box(box, provisioned, res)
+
     # refresh cache
-    list_vms(clear_cache_only=True)
+    invalidate_vm(box.vm_name())
 
     return res
 
@@ -0,0 +1,212 @@
+"""
+Linked clone support, instead of letting vagrant import the basebox for
+every new box (copying its disks each time), a master VM is imported once
+per basebox version and boxes are created as linked clones of it.
+
+The clone is then handed over to vagrant by writing its UUID in the
+machine's id file, vagrant sees it as an existing VM and just boots and
+provisions it.
+"""
+
+import json
+import os
+
+from distutils.version import LooseVersion
+
+from .config import data_dir
+from .log import get_logger
+from .vagrant import VAGRANT_DATA_FOLDER
+from .virtualbox import list_vms, vm_import, vm_clone, vm_delete, \
+    snapshot_take, VMNotFound, InvalidState
+
+logger = get_logger('clone')
+
+MASTER_SNAPSHOT = 'aeriscloud-base'
+
+
+class BaseboxNotFound(Exception):
+    """
+    Thrown when a basebox has not been downloaded by vagrant yet
+    """
+    def __init__(self, basebox):
+        msg = 'Base box "%s" could not be found, run: vagrant box add %s' % \
+              (basebox, basebox)
+        super(Exception, self).__init__(msg)
+
+
+def _masters_file():
+    return os.path.join(data_dir(), 'masters.json')
+
+
+def _load_masters():
+    """
+    Load the registry of master VMs, indexed by master VM name
+
+    :return: dict[str,dict]
+    """
+    if not os.path.exists(_masters_file()):
+        return {}
+    with open(_masters_file()) as fd:
+        return json.load(fd)
+
+
+def _save_masters(masters):
+    if not os.path.isdir(data_dir()):
+        os.makedirs(data_dir())
+    with open(_masters_file(), 'w') as fd:
+        json.dump(masters, fd, indent=2)
+
+
+def basebox_versions(basebox):
+    """
+    Return the versions of a basebox downloaded by vagrant for the
+    virtualbox provider, latest first
+
+    :param basebox: str
+    :return: list[str]
+    """
+    box_dir = os.path.join(VAGRANT_DATA_FOLDER, 'boxes',
+                           basebox.replace('/', '-VAGRANTSLASH-'))
+    if not os.path.isdir(box_dir):
+        return []
+
+    versions = [
+        version for version in os.listdir(box_dir)
+        if os.path.isfile(os.path.join(box_dir, version, 'virtualbox',
+                                       'box.ovf'))
+    ]
+    return sorted(versions, key=LooseVersion, reverse=True)
+
+
+def basebox_ovf(basebox, version):
+    return os.path.join(VAGRANT_DATA_FOLDER, 'boxes',
+                        basebox.replace('/', '-VAGRANTSLASH-'), version,
+                        'virtualbox', 'box.ovf')
+
+
+def master_name(basebox, version):
+    """
+    Return the name of the master VM for the given basebox version
+
+    :param basebox: str
+    :param version: str
+    :return: str
+    """
+    return 'aeriscloud-master-%s-%s' % (basebox.replace('/', '-'), version)
+
+
+def list_masters():
+    """
+    Return the master VMs known to AerisCloud, dropping the ones that have
+    been deleted outside of it
+
+    :return: dict[str,dict]
+    """
+    masters = _load_masters()
+    vms = list_vms()
+    for name in [name for name in masters if name not in vms]:
+        logger.debug('master %s does not exist anymore', name)
+        del masters[name]
+    return masters
+
+
+def prepare_master(basebox):
+    """
+    Import and snapshot the master VM for the latest downloaded version of
+    the given basebox, if it does not exist yet
+
+    :param basebox: str
+    :return: str The name of the master VM
+    """
+    versions = basebox_versions(basebox)
+    if not versions:
+        raise BaseboxNotFound(basebox)
+
+    name = master_name(basebox, versions[0])
+    masters = list_masters()
+    if name in masters:
+        return name
+
+    logger.info('importing %s as %s', basebox, name)
+    uuid = vm_import(basebox_ovf(basebox, versions[0]), name)
+    snapshot_take(name, MASTER_SNAPSHOT)
+
+    masters[name] = {
+        'basebox': basebox,
+        'version': versions[0],
+        'uuid': uuid,
+        'clones': []
+    }
+    _save_masters(masters)
+
+    return name
+
+
+def clone_box(box):
+    """
+    Create the VM of a box as a linked clone of its basebox master and
+    register it with vagrant
+
+    :param box: box.Box
+    :return: str The UUID of the new VM
+    """
+    name = prepare_master(box.basebox)
+
+    logger.info('creating %s as a linked clone of %s', box.vm_name(), name)
+    uuid = vm_clone(name, box.vm_name(), snapshot=MASTER_SNAPSHOT,
+                    linked=True)
+
+    machine_dir = os.path.join(box.project.vagrant_dir(), 'machines',
+                               box.name(), 'virtualbox')
+    if not os.path.isdir(machine_dir):
+        os.makedirs(machine_dir)
+    with open(os.path.join(machine_dir, 'id'), 'w') as fd:
+        fd.write(uuid)
+
+    masters = list_masters()
+    masters[name]['clones'].append(uuid)
+    _save_masters(masters)
+
+    return uuid
+
+
+def gc_masters(all=False):
+    """
+    Delete the master VMs that do not have any clone left, unless all is
+    set the master of the latest version of every basebox is kept
+
+    :param all: bool
+    :return: list[str] The names of the deleted masters
+    """
+    masters = list_masters()
+    vm_uuids = list_vms().values()
+
+    latest = dict([
+        (info['basebox'], master_name(info['basebox'],
+                                      (basebox_versions(info['basebox']) or
+                                       [info['version']])[0]))
+        for info in masters.values()
+    ])
+
+    deleted = []
+    for name, info in masters.items():
+        info['clones'] = [uuid for uuid in info['clones']
+                          if uuid in vm_uuids]
+        if info['clones'] or (not all and latest[info['basebox']] == name):
+            continue
+
+        logger.info('deleting master %s', name)
+        try:
+            vm_delete(name)
+        except VMNotFound:
+            pass
+        except InvalidState as e:
+            # a clone not created by aeris might still be using it
+            logger.warn('could not delete master %s: %s', name, e)
+            continue
+
+        del masters[name]
+        deleted.append(name)
+
+    _save_masters(masters)
+    return deleted
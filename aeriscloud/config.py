@@ -197,6 +197,52 @@ def has_github_integration():
            config.has('github', 'token')
 
 
+def ssh_control_persist():
+    """
+    How long the multiplexed ssh connection to a box is kept open after
+    its last use, in the ssh_config ControlPersist format, "no" disables
+    connection sharing
+
+    :return: str
+    """
+    return config.get('ssh', 'control_persist', default='10m')
+
+
+def ssh_cipher():
+    """
+    The cipher used by ssh and rsync when talking to boxes, None lets ssh
+    negotiate it, see aeris sync --benchmark
+
+    :return: str|None
+    """
+    return config.get('ssh', 'cipher', default=None)
+
+
+def ssh_compression():
+    """
+    Whether ssh compression is used when talking to boxes, yes or no
+
+    :return: str
+    """
+    return config.get('ssh', 'compression', default='no')
+
+
+def force_vagrant(val=None):
+    """
+    Whether every vagrant command goes through vagrant, even those that
+    AerisCloud can run by itself, see vagrant.fast_run
+
+    :param val: bool
+    :return: bool
+    """
+    if val is not None:
+        force_vagrant.val = val
+    if not hasattr(force_vagrant, 'val'):
+        force_vagrant.val = config.get('vagrant', 'force',
+                                       default='false') == 'true'
+    return force_vagrant.val
+
+
 def verbosity(val=None):
     if not hasattr(verbosity, "val"):
         verbosity.val = 0
@@ -0,0 +1,155 @@
+"""
+Management of the persistent data disks attached to every box, the
+operations on disks are slow so they are run in parallel on a bounded
+pool of threads.
+"""
+
+import os
+
+from .config import data_dir
+from .log import get_logger
+from .virtualbox import list_hdds, hdd_info, hdd_clone, hdd_compact, \
+    hdd_close, HDDNotFound
+from .utils import run_parallel, DEFAULT_JOBS
+
+logger = get_logger('disk')
+
+
+def disks_dir():
+    """
+    Return the folder where the boxes data disks are stored, it is passed
+    to vagrant as VAGRANT_DISKS_PATH
+
+    :return: str
+    """
+    return os.path.join(data_dir(), 'disks')
+
+
+def list_disks():
+    """
+    Return every disk registered in VirtualBox with their size on disk and
+    the VMs using them, the information is retrieved in parallel
+
+    :return: dict[str,dict[str,any]] Indexed by uuid
+    """
+    hdds = list_hdds()
+
+    disks = {}
+    for uuid, info in run_parallel(hdd_info, hdds.keys()):
+        if isinstance(info, HDDNotFound):
+            continue
+        if isinstance(info, Exception):
+            info = {}
+
+        location = hdds[uuid].get('Location')
+        disks[uuid] = {
+            'uuid': uuid,
+            'location': location,
+            'format': hdds[uuid].get('Format') or
+            hdds[uuid].get('Storage format'),
+            'capacity': hdds[uuid].get('Capacity'),
+            'state': hdds[uuid].get('State'),
+            'parent': hdds[uuid].get('Parent UUID'),
+            'size': _file_size(location),
+            'vms': info.get('In use by VMs'),
+        }
+    return disks
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return None
+
+
+def orphan_disks():
+    """
+    Return the data disks in VAGRANT_DISKS_PATH that are not used by any VM,
+    either because they are not registered in VirtualBox anymore or because
+    their VM was destroyed
+
+    :return: list[dict[str,any]] With the path, uuid (None if the disk is not
+             registered) and size of each disk
+    """
+    if not os.path.isdir(disks_dir()):
+        return []
+
+    registered = dict([
+        (os.path.realpath(disk['location']), disk)
+        for disk in list_disks().values()
+        if disk['location']
+    ])
+
+    orphans = []
+    for filename in sorted(os.listdir(disks_dir())):
+        path = os.path.realpath(os.path.join(disks_dir(), filename))
+        if not os.path.isfile(path):
+            continue
+
+        disk = registered.get(path)
+        if disk and disk['vms']:
+            continue
+
+        orphans.append({
+            'path': path,
+            'uuid': disk and disk['uuid'] or None,
+            'size': _file_size(path),
+        })
+    return orphans
+
+
+def _progress(name, callback):
+    if not callback:
+        return None
+    return lambda percent: callback(name, percent)
+
+
+def compact_disks(uuids, jobs=DEFAULT_JOBS, progress=None):
+    """
+    Compact the given disks in parallel
+
+    :param uuids: list[str]
+    :param jobs: int
+    :param progress: callable Called with the uuid and percentage done
+    :return: list[(str, None|Exception)]
+    """
+    return run_parallel(
+        lambda uuid: hdd_compact(uuid, _progress(uuid, progress)),
+        uuids, jobs)
+
+
+def clone_disks(uuids, dest_dir, jobs=DEFAULT_JOBS, progress=None):
+    """
+    Clone the given disks in parallel in the destination folder, keeping
+    their file names
+
+    :param uuids: list[str]
+    :param dest_dir: str
+    :param jobs: int
+    :param progress: callable Called with the uuid and percentage done
+    :return: list[(str, None|Exception)]
+    """
+    hdds = list_hdds()
+
+    def _clone(uuid):
+        if uuid not in hdds:
+            raise HDDNotFound(uuid)
+        dest = os.path.join(dest_dir,
+                            os.path.basename(hdds[uuid]['Location']))
+        hdd_clone(uuid, dest, progress=_progress(uuid, progress))
+
+    return run_parallel(_clone, uuids, jobs)
+
+
+def delete_orphan(orphan):
+    """
+    Delete an orphan disk returned by orphan_disks
+
+    :param orphan: dict[str,any]
+    :return: None
+    """
+    if orphan['uuid']:
+        hdd_close(orphan['uuid'], delete=True)
+    if os.path.exists(orphan['path']):
+        os.remove(orphan['path'])
@@ -1,6 +1,8 @@
+import contextlib
 import json
 import os
 import sys
+import threading
 
 from .config import config, expose_url, \
     configparser, data_dir
@@ -26,6 +28,10 @@ class Expose(object):
     def __init__(self):
         self._config = configparser.SafeConfigParser()
         self._logger = get_logger('expose')
+        # boxes can be added and removed from several threads
+        self._lock = threading.RLock()
+        self._batches = 0
+        self._pending = False
 
         if not os.path.isdir(data_dir()):
             os.makedirs(data_dir())
@@ -70,6 +76,34 @@ class Expose(object):
                         for service in self.list()]
         return client.service(service_list, replace=True)
 
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Defer the announces done by add and remove until the end of the
+        block, so that operating on many boxes only announces once
+        """
+        with self._lock:
+            self._batches += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batches -= 1
+                pending = not self._batches and self._pending
+                if pending:
+                    self._pending = False
+            if pending:
+                self.announce()
+
+    def _announce(self):
+        if not self.enabled():
+            return
+        with self._lock:
+            if self._batches:
+                self._pending = True
+                return
+        self.announce()
+
     def add(self, box, announce=True):
         project_name = box.project.name()
         forwards = box.forwards()
@@ -79,33 +113,35 @@ class Expose(object):
 
         port = forwards['web']['host_port']
 
-        if not self._config.has_section(project_name):
-            self._config.add_section(project_name)
+        with self._lock:
+            if not self._config.has_section(project_name):
+                self._config.add_section(project_name)
 
-        self._logger.info('adding %s-%s (port %s)' %
-                          (project_name, box.name(), port))
-        self._config.set(project_name, box.name(), port)
+            self._logger.info('adding %s-%s (port %s)' %
+                              (project_name, box.name(), port))
+            self._config.set(project_name, box.name(), port)
 
-        self.save()
+            self.save()
 
-        if self.enabled() and announce:
-            self.announce()
+        if announce:
+            self._announce()
 
     def remove(self, box, announce=False):
         project_name = box.project.name()
 
-        if not self._config.has_section(project_name):
-            return
+        with self._lock:
+            if not self._config.has_section(project_name):
+                return
 
-        self._config.remove_option(project_name, box.name())
+            self._config.remove_option(project_name, box.name())
 
-        if not self._config.items(project_name):
-            self._config.remove_section(project_name)
+            if not self._config.items(project_name):
+                self._config.remove_section(project_name)
 
-        self.save()
+            self.save()
 
-        if self.enabled() and announce:
-            self.announce()
+        if announce:
+            self._announce()
 
     def list(self):
         services = []
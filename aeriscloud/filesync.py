@@ -0,0 +1,317 @@
+"""
+Incremental rsync support, instead of letting rsync compare the whole
+project tree with the box on every sync, an index of the mtime and size of
+every file pushed to a box is kept under data_dir and only the paths that
+changed since the last sync are given to rsync. Deleted paths are removed
+from the box separately as rsync ignores --delete for listed files.
+
+A full rsync is still done from time to time to catch any drift between
+the index and the box. Large projects can also be split in shards of
+similar size, each pushed by its own rsync process.
+"""
+
+import fnmatch
+import json
+import os
+import re
+import stat
+import sys
+import time
+
+from .config import config, data_dir
+from .log import get_logger
+
+logger = get_logger('filesync')
+
+
+def full_sync_interval():
+    """
+    How long in seconds incremental syncs are used before doing a full
+    rsync again, 0 to always do full syncs
+
+    :return: float
+    """
+    return float(config.get('rsync', 'full_sync_interval', default=3600))
+
+
+def _match(relpath, is_dir, pattern):
+    """
+    Match a path with an rsync exclude pattern, only the common forms are
+    supported: "name", "*.ext", "dir/" and "/anchored/path"
+    """
+    if pattern.endswith('/'):
+        if not is_dir:
+            return False
+        pattern = pattern.rstrip('/')
+
+    if pattern.startswith('/'):
+        return fnmatch.fnmatch(relpath, pattern[1:])
+    if '/' in pattern:
+        return fnmatch.fnmatch(relpath, pattern) or \
+            fnmatch.fnmatch(relpath, '*/' + pattern)
+    return fnmatch.fnmatch(os.path.basename(relpath), pattern)
+
+
+class SyncIndex(object):
+    """
+    Index of the files of a project folder as last pushed to a box
+
+    :param name: str Name of the index, usually the VM name
+    :param folder: str The project folder
+    :param ignores: list[str] rsync exclude patterns
+    :param target: str Identifies the box, the index is discarded when it
+                   changes (eg. when the box was recreated)
+    """
+
+    def __init__(self, name, folder, ignores=None, target=None):
+        self.name = name
+        self.folder = folder
+        self.ignores = ignores or []
+        self.target = target
+        self.files = {}
+        self.last_full_sync = 0
+
+        self._valid = self._load()
+
+    def file(self):
+        return os.path.join(data_dir(), 'sync', '%s.json' % self.name)
+
+    def _load(self):
+        if not os.path.exists(self.file()):
+            return False
+
+        try:
+            with open(self.file()) as fd:
+                data = json.load(fd)
+        except ValueError:
+            logger.warn('invalid sync index %s, ignoring', self.file())
+            return False
+
+        if data.get('ignores') != self.ignores or \
+                data.get('target') != self.target:
+            logger.debug('sync index %s is outdated', self.name)
+            return False
+
+        self.files = data.get('files', {})
+        self.last_full_sync = data.get('last_full_sync', 0)
+        return True
+
+    def save(self, files, full=False):
+        """
+        Store the state of the files after a successful sync
+
+        :param files: dict[str,list] As returned by scan
+        :param full: bool Whether it was a full sync
+        """
+        if full:
+            self.last_full_sync = time.time()
+        self.files = files
+        self._valid = True
+
+        if not os.path.isdir(os.path.dirname(self.file())):
+            os.makedirs(os.path.dirname(self.file()))
+
+        # write then rename so that an interrupted save does not leave an
+        # index claiming files were synced
+        tmp_file = self.file() + '.tmp'
+        with open(tmp_file, 'w') as fd:
+            json.dump({
+                'target': self.target,
+                'ignores': self.ignores,
+                'last_full_sync': self.last_full_sync,
+                'files': files
+            }, fd)
+        os.rename(tmp_file, self.file())
+
+    def reset(self):
+        """
+        Forget the state of the box, the next sync will be a full one
+        """
+        self.files = {}
+        self._valid = False
+        if os.path.exists(self.file()):
+            os.remove(self.file())
+
+    def needs_full_sync(self):
+        """
+        :return: bool
+        """
+        if not self._valid:
+            return True
+        return time.time() - self.last_full_sync > full_sync_interval()
+
+    def _ignored(self, relpath, is_dir):
+        return any(_match(relpath, is_dir, pattern)
+                   for pattern in self.ignores)
+
+    def _walked(self, path, relpath, root_dev):
+        try:
+            st = os.lstat(path)
+        except OSError:
+            return False
+        # same as --one-file-system
+        return st.st_dev == root_dev and not self._ignored(relpath, True)
+
+    def scan(self):
+        """
+        Return the mtime and size of every file in the project folder,
+        directories are listed with a None value as their mtime changes
+        with their content. Symlinks are synced as links by rsync, links
+        to directories are listed with their target like links to files.
+
+        :return: dict[str,list|None] Indexed by path relative to the folder
+        """
+        files = {}
+        root_dev = os.lstat(self.folder).st_dev
+
+        for dirpath, dirnames, filenames in os.walk(self.folder):
+            reldir = os.path.relpath(dirpath, self.folder)
+            if reldir == '.':
+                reldir = ''
+
+            for dirname in dirnames[:]:
+                relpath = os.path.join(reldir, dirname)
+                path = os.path.join(dirpath, dirname)
+                if os.path.islink(path):
+                    # not walked, rsync copies it like a link to a file
+                    filenames.append(dirname)
+                elif self._walked(path, relpath, root_dev):
+                    files[relpath] = None
+                    continue
+                dirnames.remove(dirname)
+
+            for filename in filenames:
+                relpath = os.path.join(reldir, filename)
+                if self._ignored(relpath, False):
+                    continue
+                try:
+                    files[relpath] = _file_state(
+                        os.path.join(dirpath, filename))
+                except OSError:
+                    # deleted while scanning
+                    continue
+
+        return files
+
+    def changes(self, files):
+        """
+        Compare scanned files with the index
+
+        :param files: dict[str,list|None] As returned by scan
+        :return: (list[str], list[str]) The changed or new paths and the
+                 deleted paths, deleted directories come after their content
+        """
+        changed = sorted([path for path, state in files.iteritems()
+                          if path not in self.files or
+                          self.files[path] != state])
+        deleted = sorted([path for path in self.files
+                          if path not in files], reverse=True)
+        return changed, deleted
+
+
+def _file_state(path):
+    st = os.lstat(path)
+    if stat.S_ISLNK(st.st_mode):
+        # a link can be retargeted within the same second with the same length
+        return [st.st_mtime, st.st_size, os.readlink(path)]
+    return [st.st_mtime, st.st_size]
+
+
+def top_level_sizes(files):
+    """
+    Return the total size of every top level entry of a scanned folder
+
+    :param files: dict[str,list|None] As returned by SyncIndex.scan
+    :return: dict[str,int]
+    """
+    sizes = {}
+    for path, state in files.iteritems():
+        top = path.split(os.sep, 1)[0]
+        sizes[top] = sizes.get(top, 0) + (state and state[1] or 0)
+    return sizes
+
+
+def balance(sizes, buckets):
+    """
+    Split items in at most the given number of buckets of similar total
+    size, biggest items are placed first in the smallest bucket
+
+    :param sizes: dict[str,int]
+    :param buckets: int
+    :return: list[list[str]] Non empty buckets
+    """
+    shards = [(0, []) for _ in range(max(buckets, 1))]
+    for item in sorted(sizes, key=lambda item: (-sizes[item], item)):
+        total, items = min(shards, key=lambda shard: shard[0])
+        shards.remove((total, items))
+        shards.append((total + sizes[item], items + [item]))
+    return [sorted(shard) for _, shard in shards if shard]
+
+
+_RSYNC_STATS = [
+    ('files', re.compile(r'^Number of files: ([\d,]+)')),
+    ('transferred', re.compile(
+        r'^Number of (?:regular )?files transferred: ([\d,]+)')),
+    ('size', re.compile(r'^Total file size: ([\d,]+)')),
+    ('transferred_size', re.compile(
+        r'^Total transferred file size: ([\d,]+)')),
+    ('sent', re.compile(r'^Total bytes sent: ([\d,]+)')),
+    ('received', re.compile(r'^Total bytes received: ([\d,]+)')),
+]
+_RSYNC_STATS_LINE = re.compile(
+    r'^(Number of|Total |Literal data|Matched data|File list )')
+
+
+def parse_rsync_stats(line, stats):
+    """
+    Add the values of an rsync --stats line to the given stats, so that
+    the stats of several rsync processes can be merged
+
+    :param line: str
+    :param stats: dict[str,int]
+    :return: bool Whether the line is part of the stats
+    """
+    for key, regex in _RSYNC_STATS:
+        match = regex.match(line)
+        if match:
+            value = int(match.group(1).replace(',', ''))
+            stats[key] = stats.get(key, 0) + value
+            return True
+    return bool(_RSYNC_STATS_LINE.match(line))
+
+
+class RsyncOutput(object):
+    """
+    Writes the output of rsync as it comes, so that the --progress updates
+    which are only terminated by a carriage return are displayed, while
+    parsing the --stats lines
+
+    :param stats: dict[str,int] See parse_rsync_stats
+    :param show_stats: bool Whether the stats lines are written
+    :param out: file
+    """
+
+    def __init__(self, stats, show_stats=False, out=None):
+        self.stats = stats
+        self.show_stats = show_stats
+        self.out = out or sys.stdout
+        self._pending = ''
+
+    def write(self, data):
+        lines = (self._pending + data).split('\n')
+        self._pending = lines.pop()
+        for line in lines:
+            if parse_rsync_stats(line, self.stats) and not self.show_stats:
+                continue
+            self.out.write(line + '\n')
+
+        if '\r' in self._pending:
+            done, self._pending = self._pending.rsplit('\r', 1)
+            self.out.write(done + '\r')
+        self.out.flush()
+
+    def close(self):
+        if self._pending:
+            self.out.write(self._pending)
+            self._pending = ''
+        self.out.flush()
@@ -0,0 +1,174 @@
+"""
+Provisioning history of boxes, stored as one JSON entry per line in
+/home/vagrant/.provision. The file only grows, so a copy is cached under
+data_dir and only the bytes appended since the last read are downloaded.
+"""
+
+import json
+import os
+
+from .config import data_dir
+from .log import get_logger
+
+logger = get_logger('history')
+
+HISTORY_FILE = '/home/vagrant/.provision'
+
+# prints "<size> <inode> <mtime> append|full" then the requested part of the
+# file, bounded by the size it printed in case an entry is being appended. A
+# file of the same size is only unchanged if it was not modified since.
+_FETCH_SCRIPT = '''\
+f={file}
+if [ ! -f "$f" ]; then echo "0 0 0 full"; exit 0; fi
+set -- $(stat -c '%s %i %Y' "$f")
+if [ "$2" = "{inode}" ] && {{ [ "$1" -gt {size} ] ||
+    {{ [ "$1" -eq {size} ] && [ "$3" = "{mtime}" ]; }}; }}; then
+  echo "$1 $2 $3 append"; head -c "$1" "$f" | tail -c +{offset}
+else
+  echo "$1 $2 $3 full"; head -c "$1" "$f"
+fi
+'''
+
+
+def parse_history(lines):
+    """
+    Lazily parse history lines, invalid entries are skipped
+
+    :param lines: iterable[str]
+    :return: generator[dict]
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logger.debug('invalid history entry: %s', line)
+
+
+def box_stats(entry, box):
+    """
+    Return the ansible statistics of a box in a history entry, boxes are
+    named after their VM when provisioned with boxes of other projects
+    sharing their name
+
+    :param entry: dict
+    :param box: aeriscloud.box.Box
+    :return: dict|None
+    """
+    stats = entry.get('stats') or {}
+    return stats.get(box.name(), stats.get(box.vm_name()))
+
+
+def tail_command(limit):
+    """
+    Return the command printing the last entries of the history
+
+    :param limit: int
+    :return: str
+    """
+    return 'tail -n %d %s' % (limit, HISTORY_FILE)
+
+
+class HistoryCache(object):
+    """
+    Local copy of the history file of a box
+
+    :param name: str Name of the cache, usually the VM name
+    :param target: str Identifies the box, the cache is discarded when it
+                   changes (eg. when the box was recreated)
+    """
+
+    def __init__(self, name, target=None):
+        self.name = name
+        self.target = target
+        self.inode = None
+        self.mtime = None
+        # bytes of the remote file in data, which is kept encoded
+        self.size = 0
+        self.data = ''
+        self._load()
+
+    def file(self):
+        return os.path.join(data_dir(), 'history', '%s.json' % self.name)
+
+    def exists(self):
+        return self.inode is not None
+
+    def _load(self):
+        if not os.path.exists(self.file()):
+            return
+
+        try:
+            with open(self.file()) as fd:
+                cache = json.load(fd)
+        except ValueError:
+            logger.warn('invalid history cache %s, ignoring', self.file())
+            return
+
+        if cache.get('target') != self.target:
+            return
+        self.inode = cache['inode']
+        self.mtime = cache.get('mtime')
+        self.data = cache['data'].encode('utf-8')
+        self.size = cache.get('size', len(self.data))
+
+    def _save(self):
+        if not os.path.isdir(os.path.dirname(self.file())):
+            os.makedirs(os.path.dirname(self.file()))
+
+        tmp_file = self.file() + '.tmp'
+        with open(tmp_file, 'w') as fd:
+            json.dump({
+                'target': self.target,
+                'inode': self.inode,
+                'mtime': self.mtime,
+                'size': self.size,
+                'data': self.data
+            }, fd)
+        os.rename(tmp_file, self.file())
+
+    def reset(self):
+        self.inode = None
+        self.mtime = None
+        self.size = 0
+        self.data = ''
+        if os.path.exists(self.file()):
+            os.remove(self.file())
+
+    def fetch_command(self):
+        """
+        Return the command downloading what changed since the last fetch
+
+        :return: str
+        """
+        return _FETCH_SCRIPT.format(file=HISTORY_FILE,
+                                    inode=self.inode or '',
+                                    mtime=self.mtime or '',
+                                    size=self.size,
+                                    offset=self.size + 1)
+
+    def update(self, output):
+        """
+        Update the cache with the output of the fetch command
+
+        :param output: str
+        """
+        header, _, data = output.partition('\n')
+        size, inode, mtime, mode = header.split()
+        if mode == 'append':
+            self.data += data
+        else:
+            logger.debug('history of %s was replaced', self.name)
+            self.data = data
+        self.inode = inode
+        self.mtime = mtime
+        self.size = int(size)
+        self._save()
+
+    def lines(self):
+        """
+        :return: list[str]
+        """
+        return self.data.splitlines()
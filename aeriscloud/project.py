@@ -230,6 +230,14 @@ class Project(object):
     def rsync_enabled(self):
         return 'use_rsync' in self.config() and self.config()['use_rsync']
 
+    def rsync_jobs(self):
+        """
+        How many rsync processes are used to sync the project
+
+        :return: int
+        """
+        return max(int(self.config().get('rsync_jobs', 1)), 1)
+
     def box(self, name=''):
         """
         Retrieve a box by name
@@ -19,6 +19,16 @@ class S3:
         if not self._endpoint_url:
             self._endpoint_url = 'http://%s.s3.amazonaws.com' % bucket
 
+    def url(self, key):
+        """
+        Return the url of a file of the bucket
+
+        :param key: The name of the file
+        :type key: String
+        :rtype: String
+        """
+        return self._endpoint_url + '/' + key
+
     def put(self, data, key):
         """
         Upload a file to the S3 bucket
@@ -30,7 +40,7 @@ class S3:
         :return: The url of the uploaded file
         :rtype: String
         """
-        url = self._endpoint_url + '/' + key
+        url = self.url(key)
         r = requests.put(url, data=data)
         r.raise_for_status()
         return url
@@ -77,6 +87,8 @@ class S3:
                         file['LastModified'] = file_data.text
                     if file_data.tag.endswith('Size'):
                         file['Size'] = file_data.text
+                    if file_data.tag.endswith('ETag'):
+                        file['ETag'] = file_data.text.strip('"')
 
                 files.append(file)
 
@@ -0,0 +1,119 @@
+"""
+Benchmark of the ssh ciphers and compression used to talk to boxes, the
+same payload is sent to the box with every combination and the fastest
+one is stored in the config, to be used by every ssh and rsync call.
+"""
+
+import os
+import tempfile
+import time
+
+from subprocess32 import call, check_output, CalledProcessError, \
+    TimeoutExpired, DEVNULL
+
+from .config import config
+from .log import get_logger
+
+logger = get_logger('sshbench')
+
+# fastest first on most hardware, arcfour is not shipped by recent OpenSSH
+CIPHERS = ['aes128-gcm@openssh.com', 'chacha20-poly1305@openssh.com',
+           'aes128-ctr']
+PAYLOAD_SIZE = 32 * 1024 * 1024
+
+
+def available_ciphers():
+    """
+    Return the benchmarked ciphers supported by the local ssh client
+
+    :return: list[str]
+    """
+    try:
+        supported = check_output(['ssh', '-Q', 'cipher'],
+                                 stderr=DEVNULL).split()
+    except (CalledProcessError, OSError):
+        # ssh -Q is only available since OpenSSH 6.3, let the box decide
+        return CIPHERS
+    return [cipher for cipher in CIPHERS if cipher in supported]
+
+
+def _write_payload(fd, size):
+    # half source-like text and half random bytes, so that compression
+    # is neither useless nor unfairly efficient
+    text = ''.join(['def function_%d(arg):\n    return arg * %d\n' % (i, i)
+                    for i in range(1000)])
+    written = 0
+    while written < size / 2:
+        fd.write(text)
+        written += len(text)
+    while written < size:
+        fd.write(os.urandom(1024 * 1024))
+        written += 1024 * 1024
+    fd.flush()
+
+
+def _run(box, cipher, compression, payload, timeout):
+    # the shared connection is bypassed, it would use its own cipher
+    args = ['ssh', box.ip(), '-T', '-x',
+            '-l', 'vagrant', '-i', box.ssh_key(),
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', 'ControlPath=none',
+            '-o', 'Compression=%s' % compression,
+            '-c', cipher, 'cat > /dev/null']
+
+    with open(payload) as fd:
+        start = time.time()
+        try:
+            res = call(args, stdin=fd, stdout=DEVNULL, stderr=DEVNULL,
+                       timeout=timeout)
+        except TimeoutExpired:
+            logger.debug('%s timed out', ' '.join(args))
+            return None
+    if res != 0:
+        logger.debug('%s failed with %d', ' '.join(args), res)
+        return None
+    return time.time() - start
+
+
+def benchmark(box, ciphers=None, size=PAYLOAD_SIZE, timeout=60):
+    """
+    Time sending a payload to the box over every cipher, with and without
+    compression
+
+    :param box: box.Box
+    :param ciphers: list[str] Defaults to the available ciphers
+    :param size: int Size of the payload in bytes
+    :param timeout: float Maximum time for a single run
+    :return: list[dict[str,any]] With the cipher, compression and duration
+             of each run, fastest first, failed runs last with a None
+             duration
+    """
+    if ciphers is None:
+        ciphers = available_ciphers()
+
+    results = []
+    with tempfile.NamedTemporaryFile(prefix='aeriscloud-bench-') as fd:
+        _write_payload(fd, size)
+        for cipher in ciphers:
+            for compression in ['no', 'yes']:
+                results.append({
+                    'cipher': cipher,
+                    'compression': compression,
+                    'size': size,
+                    'duration': _run(box, cipher, compression, fd.name,
+                                     timeout)
+                })
+
+    return sorted(results, key=lambda res: (res['duration'] is None,
+                                            res['duration']))
+
+
+def save(result):
+    """
+    Store the cipher and compression of a benchmark result in the config
+
+    :param result: dict[str,any]
+    """
+    config.set('ssh', 'cipher', result['cipher'])
+    config.set('ssh', 'compression', result['compression'])
+    config.save()
@@ -0,0 +1,140 @@
+"""
+Pool of authenticated paramiko connections, one per box, used to run many
+short remote commands (reading the services or the provisioning history of
+a box) without paying for a new ssh handshake every time.
+"""
+
+import atexit
+import socket
+import threading
+import time
+
+from paramiko import AutoAddPolicy, SSHClient, SSHException
+
+from .config import config
+from .log import get_logger
+
+logger = get_logger('sshpool')
+
+
+class SSHConnectionError(Exception):
+    """
+    Thrown when a command could not be run on a box, even after
+    reconnecting to it
+    """
+    pass
+
+
+def idle_timeout():
+    """
+    How long in seconds an unused connection is kept in the pool
+
+    :return: float
+    """
+    return float(config.get('ssh', 'pool_idle_timeout', default=300))
+
+
+class SSHPool(object):
+    """
+    Keeps one connection per host, user and key. Connections that have not
+    been used for idle_timeout seconds are closed on the next access, dead
+    connections are transparently reopened.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+
+    def _connect(self, host, username, key_filename, port):
+        logger.debug('connecting to %s@%s:%d', username, host, port)
+        client = SSHClient()
+        # boxes ips are reused with different host keys, like the ssh
+        # commands ran with StrictHostKeyChecking=no
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        client.connect(host, port=port, username=username,
+                       key_filename=key_filename, look_for_keys=False,
+                       allow_agent=False, timeout=10)
+        client.get_transport().set_keepalive(30)
+        return client
+
+    def _evict_idle(self):
+        now = time.time()
+        for key, (client, last_used) in self._clients.items():
+            if now - last_used > idle_timeout():
+                logger.debug('closing idle connection to %s', key[0])
+                client.close()
+                del self._clients[key]
+
+    def client(self, host, username, key_filename, port=22):
+        """
+        Return a connected client for the given host, reusing the pooled
+        connection when it is still alive. The client is shared and must
+        not be closed by the caller.
+
+        :param host: str
+        :param username: str
+        :param key_filename: str
+        :param port: int
+        :return: paramiko.SSHClient
+        """
+        key = (host, port, username, key_filename)
+        with self._lock:
+            self._evict_idle()
+
+            client = self._clients.get(key, (None, None))[0]
+            transport = client and client.get_transport()
+            if not transport or not transport.is_active():
+                if client:
+                    client.close()
+                client = self._connect(host, username, key_filename, port)
+
+            self._clients[key] = (client, time.time())
+            return client
+
+    def run(self, host, username, key_filename, cmd, port=22, timeout=30):
+        """
+        Run a command on a new channel of the pooled connection, reconnecting
+        once if the connection died since its last use
+
+        :param host: str
+        :param username: str
+        :param key_filename: str
+        :param cmd: str
+        :param port: int
+        :param timeout: float
+        :return: (int, str, str) The exit status, stdout and stderr
+        """
+        for attempt in range(2):
+            try:
+                client = self.client(host, username, key_filename, port)
+                _, stdout, stderr = client.exec_command(cmd, timeout=timeout)
+                out = stdout.read()
+                err = stderr.read()
+                return stdout.channel.recv_exit_status(), out, err
+            except (SSHException, socket.error, EOFError) as e:
+                logger.debug('running "%s" on %s failed: %s', cmd, host, e)
+                # boxes are reached through ports forwarded on localhost,
+                # the connections of other boxes must be kept
+                self.close(host, port)
+                if attempt:
+                    raise SSHConnectionError(
+                        'could not run "%s" on %s: %s' % (cmd, host, e))
+
+    def close(self, host=None, port=None):
+        """
+        Close the pooled connections to the given host, only those to the
+        given port if set, or every connection
+
+        :param host: str
+        :param port: int
+        """
+        with self._lock:
+            for key, (client, _) in self._clients.items():
+                if (host is None or key[0] == host) and \
+                        (port is None or key[1] == port):
+                    client.close()
+                    del self._clients[key]
+
+
+pool = SSHPool()
+atexit.register(pool.close)
@@ -0,0 +1,61 @@
+import imp
+import os
+import signal
+import threading
+import time
+
+from StringIO import StringIO
+
+from .test_base import TestBase
+from ..agent import AgentConnection, AgentProcess, AgentUnavailable
+
+guest_agent = imp.load_source(
+    'aeriscloud_guest_agent',
+    os.path.join(os.path.dirname(__file__), '..', '..', 'vagrant',
+                 'agent.py'))
+
+
+class TestAgent(TestBase):
+    def setUp(self):
+        self.server = guest_agent.Server(('127.0.0.1', 0),
+                                         guest_agent.Handler)
+        self.server.token = 'secret'
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_run(self):
+        conn = AgentConnection('127.0.0.1', self.port, 'secret')
+        out = StringIO()
+        err = StringIO()
+
+        assert conn.run('echo out; echo err >&2; exit 3', out, err) == 3
+        assert out.getvalue() == 'out\n'
+        # login shells might print warnings from the profile
+        assert err.getvalue().endswith('err\n')
+
+        # the connection is reused for the next command
+        assert conn.run('true', out, err) == 0
+        conn.close()
+
+    def test_invalid_token(self):
+        try:
+            AgentConnection('127.0.0.1', self.port, 'invalid')
+        except AgentUnavailable:
+            pass
+        else:
+            assert False, 'the agent accepted an invalid token'
+
+    def test_terminate(self):
+        conn = AgentConnection('127.0.0.1', self.port, 'secret')
+        process = AgentProcess(conn, 'sleep 10')
+        time.sleep(0.2)
+        assert process.poll() is None
+
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(5) == 128 + signal.SIGTERM
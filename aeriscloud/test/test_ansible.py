@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+
+from .test_base import TestBase
+from ..ansible import write_box_inventory, vagrant_inventory_path
+
+
+class FakeProject(object):
+    def __init__(self, name):
+        self._name = name
+
+    def name(self):
+        return self._name
+
+    def config(self):
+        return {'project_name': self._name}
+
+
+class FakeBox(object):
+    def __init__(self, project, name, ip):
+        self.project = project
+        self._name = name
+        self._ip = ip
+
+    def name(self):
+        return self._name
+
+    def vm_name(self):
+        return '%s-%s' % (self.project.name(), self._name)
+
+    def ip(self):
+        return self._ip
+
+    def ssh_key(self):
+        return '/keys/%s' % self._name
+
+    def ssh_transport_options(self):
+        return ['-o', 'Compression=no']
+
+    def ssh_mux_options(self):
+        return ['-o', 'ControlMaster=auto']
+
+
+class TestBoxInventory(TestBase):
+    def setUp(self):
+        self.name = 'test-inventory-%d' % os.getpid()
+
+    def tearDown(self):
+        shutil.rmtree(os.path.join(vagrant_inventory_path, self.name))
+
+    def _host_vars(self, inventory, host):
+        path = os.path.join(os.path.dirname(inventory), 'host_vars',
+                            '%s.json' % host)
+        with open(path) as fd:
+            return json.load(fd)
+
+    def test_write(self):
+        web, api = FakeProject('web'), FakeProject('api')
+        boxes = [FakeBox(web, 'front', '172.16.0.2'),
+                 FakeBox(web, 'db', '172.16.0.3'),
+                 FakeBox(api, 'app', '172.16.0.4')]
+        inventory = write_box_inventory(self.name, boxes)
+
+        with open(inventory) as fd:
+            assert fd.read() == '[api]\napp\n\n' \
+                                '[web]\nfront\ndb\n\n'
+
+        host_vars = self._host_vars(inventory, 'app')
+        assert host_vars['project_name'] == 'api'
+        assert host_vars['ansible_ssh_host'] == '172.16.0.4'
+        assert host_vars['ansible_ssh_private_key_file'] == '/keys/app'
+        assert host_vars['ansible_ssh_common_args'] == \
+            '-o Compression=no -o ControlMaster=auto ' \
+            '-o StrictHostKeyChecking=no -o UserKnownHostsFile=/dev/null'
+
+    def test_rewrite(self):
+        web = FakeProject('web')
+        write_box_inventory(self.name, [FakeBox(web, 'front', '172.16.0.2'),
+                                        FakeBox(web, 'db', '172.16.0.3')])
+        inventory = write_box_inventory(self.name,
+                                        [FakeBox(web, 'db', '172.16.0.3')])
+
+        assert os.listdir(os.path.join(os.path.dirname(inventory),
+                                       'host_vars')) == ['db.json']
+
+    def test_shared_name(self):
+        web, api = FakeProject('web'), FakeProject('api')
+        inventory = write_box_inventory(self.name,
+                                        [FakeBox(web, 'front', '172.16.0.2'),
+                                         FakeBox(web, 'db', '172.16.0.3'),
+                                         FakeBox(api, 'db', '172.16.0.4')])
+
+        with open(inventory) as fd:
+            assert fd.read() == '[api]\napi-db\n\n' \
+                                '[web]\nfront\nweb-db\n\n'
+        assert self._host_vars(inventory, 'api-db')['ansible_ssh_host'] == \
+            '172.16.0.4'
@@ -0,0 +1,152 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+from BaseHTTPServer import BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn, TCPServer
+
+from .test_base import TestBase
+from .. import basebox
+from ..basebox import BaseboxError, Download, box_path, cached, fetch
+
+CONTENT = os.urandom(200 * 1024)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    # requests served so far, with the range they asked for
+    served = []
+    # stop after sending that many bytes of a response
+    fail_after = None
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, status, start, end):
+        self.send_response(status)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', '"v1"')
+        if status == 206:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' %
+                             (start, end, len(CONTENT)))
+        self.end_headers()
+
+    def do_HEAD(self):
+        self._headers(200, 0, len(CONTENT) - 1)
+
+    def do_GET(self):
+        status, start, end = 200, 0, len(CONTENT) - 1
+        if 'Range' in self.headers:
+            status = 206
+            start, end = [int(pos) for pos in
+                          self.headers['Range'][6:].split('-')]
+        self.served.append((start, end))
+
+        self._headers(status, start, end)
+        data = CONTENT[start:end + 1]
+        if self.fail_after is not None:
+            data = data[:self.fail_after]
+        self.wfile.write(data)
+
+
+class Server(ThreadingMixIn, TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class TestBasebox(TestBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.server = Server(('127.0.0.1', 0), RangeHandler)
+        self.url = 'http://127.0.0.1:%d/box' % self.server.server_address[1]
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        RangeHandler.served = []
+        RangeHandler.fail_after = None
+        self._min_segment_size = basebox.MIN_SEGMENT_SIZE
+        basebox.MIN_SEGMENT_SIZE = 32 * 1024
+        shutil.rmtree(basebox.cache_dir(), ignore_errors=True)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        basebox.MIN_SEGMENT_SIZE = self._min_segment_size
+        shutil.rmtree(basebox.cache_dir(), ignore_errors=True)
+        shutil.rmtree(self.tmp_dir)
+
+    def test_download_segments(self):
+        dest = os.path.join(self.tmp_dir, 'box')
+        path = Download(self.url, dest, segments=4).run()
+
+        with open(path, 'rb') as fd:
+            assert fd.read() == CONTENT
+        assert len(RangeHandler.served) == 4
+        assert not os.path.exists(dest + '.part.json')
+
+    def test_download_resume(self):
+        dest = os.path.join(self.tmp_dir, 'box')
+        RangeHandler.fail_after = 1024
+        self.assertRaises(BaseboxError, Download(self.url, dest, 4).run)
+        assert os.path.exists(dest + '.part.json')
+
+        RangeHandler.served = []
+        RangeHandler.fail_after = None
+        path = Download(self.url, dest, 4).run()
+
+        with open(path, 'rb') as fd:
+            assert fd.read() == CONTENT
+        # every segment continues after the 1024 bytes it already had
+        assert [end - start + 1 for start, end in RangeHandler.served] == \
+            [len(CONTENT) / 4 - 1024] * 4
+
+    def test_fetch(self):
+        source = {
+            'name': 'aeris/centos-7',
+            'version': '1.0.0',
+            'url': self.url,
+            'checksum_type': 'md5',
+            'checksum': hashlib.md5(CONTENT).hexdigest()
+        }
+        path = fetch(source)
+
+        assert path == box_path(hashlib.sha256(CONTENT).hexdigest())
+        assert cached(source) == path
+
+        RangeHandler.served = []
+        assert fetch(source) == path
+        assert RangeHandler.served == []
+
+    def test_fetch_concurrent(self):
+        # no checksum to catch a download corrupted by another one
+        source = {
+            'name': 'aeris/centos-7',
+            'version': '1.0.0',
+            'url': self.url,
+            'checksum_type': None,
+            'checksum': None
+        }
+        paths = []
+        threads = [threading.Thread(target=lambda: paths.append(fetch(source)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert paths == [box_path(hashlib.sha256(CONTENT).hexdigest())] * 3
+        assert len(RangeHandler.served) == 4
+
+    def test_fetch_checksum(self):
+        source = {
+            'name': 'aeris/centos-7',
+            'version': '1.0.0',
+            'url': self.url,
+            'checksum_type': 'sha1',
+            'checksum': hashlib.sha1('other').hexdigest()
+        }
+        self.assertRaises(BaseboxError, fetch, source)
+        assert cached(source) is None
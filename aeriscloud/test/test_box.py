@@ -0,0 +1,116 @@
+import time
+
+from .test_base import TestBase
+from ..box import Box, BoxList, _parse_introspection
+from ..config import config
+
+INTROSPECTION_OUTPUT = '''
+==services==
+web,80,/,http
+
+api,8080,/api,http
+
+==history==
+{"type": "provision", "status": "success", "time": 1460000000}
+not json
+
+==uptime==
+3600.25 7000.10
+
+==loadavg==
+0.52 0.40 0.31 1/120 4242
+
+==disk==
+/dev/sdb1 10485760 2097152 8388608 20% /data
+
+==project_dir==
+yes
+'''
+
+
+class TestIntrospection(TestBase):
+    def test_parse(self):
+        bundle = _parse_introspection(INTROSPECTION_OUTPUT)
+
+        assert bundle['services'] == [
+            {'name': 'web', 'port': '80', 'path': '/', 'protocol': 'http'},
+            {'name': 'api', 'port': '8080', 'path': '/api',
+             'protocol': 'http'},
+        ]
+        assert bundle['history'] == [
+            {'type': 'provision', 'status': 'success', 'time': 1460000000}
+        ]
+        assert bundle['uptime'] == 3600.25
+        assert bundle['load'] == [0.52, 0.40, 0.31]
+        assert bundle['disk'] == {'size': 10737418240, 'used': 2147483648,
+                                  'available': 8589934592}
+        assert bundle['project_dir'] is True
+
+    def test_parse_empty(self):
+        bundle = _parse_introspection('')
+
+        assert bundle['services'] == []
+        assert bundle['history'] == []
+        assert bundle['uptime'] is None
+        assert bundle['load'] is None
+        assert bundle['disk'] is None
+        assert bundle['project_dir'] is False
+
+
+class FakeBox(object):
+    def __init__(self, name, running=None):
+        self.name = name
+        self.running = running
+
+    def vm_name(self):
+        return self.name
+
+    def suspend(self):
+        if self.name == 'broken':
+            raise RuntimeError('cannot suspend')
+        if self.running is None:
+            return True
+
+        # only succeeds if both boxes are suspended at the same time
+        self.running.append(self.name)
+        deadline = time.time() + 1
+        while len(self.running) < 2 and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self.running) == 2
+
+
+class TestBoxList(TestBase):
+    def test_parallel(self):
+        boxes = BoxList([FakeBox('web'), FakeBox('broken'), FakeBox('db')])
+        results = boxes.suspend(jobs=2)
+
+        assert [box.name for box, _ in results] == ['web', 'broken', 'db']
+        assert results[0][1] is True
+        assert isinstance(results[1][1], RuntimeError)
+        assert results[2][1] is True
+
+    def test_parallel_concurrency(self):
+        running = []
+        boxes = BoxList([FakeBox('web', running), FakeBox('db', running)])
+
+        assert [res for _, res in boxes.suspend(jobs=2)] == [True, True]
+
+
+class FakeProject(object):
+    def name(self):
+        return 'project'
+
+
+class TestTransportOptions(TestBase):
+    def tearDown(self):
+        config.unset('ssh', 'cipher')
+
+    def test_default(self):
+        box = Box(FakeProject(), {'name': 'web'})
+        assert box.ssh_transport_options() == ['-o', 'Compression=no']
+
+    def test_benchmarked_cipher(self):
+        config.set('ssh', 'cipher', 'aes128-ctr')
+        box = Box(FakeProject(), {'name': 'web'})
+        assert box.ssh_transport_options() == ['-c', 'aes128-ctr',
+                                               '-o', 'Compression=no']
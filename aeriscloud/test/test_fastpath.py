@@ -0,0 +1,47 @@
+from .test_base import TestBase
+from ..config import force_vagrant
+from ..vagrant import FastMachine, fast_run
+
+
+class FakeMachine(object):
+    data_path = '/nonexistent'
+
+
+class FakeFastMachine(FastMachine):
+    def __init__(self, state):
+        super(FakeFastMachine, self).__init__(
+            'web', FakeMachine(), {'name': 'project-web', 'forwards': {
+                'ssh': {'host_port': '2222'}}})
+        self._state = state
+
+    def state(self):
+        return self._state
+
+
+class TestFastPath(TestBase):
+    def tearDown(self):
+        force_vagrant(False)
+
+    def test_vagrant_commands(self):
+        # never reaches the project, those always run through vagrant
+        assert fast_run(None, 'up', 'web') is None
+        assert fast_run(None, 'provision', 'web') is None
+        assert fast_run(None, 'destroy', 'web') is None
+        assert fast_run(None, 'halt', '-f', 'web') is None
+
+        force_vagrant(True)
+        assert fast_run(None, 'status') is None
+
+    def test_states(self):
+        assert FakeFastMachine('poweroff').halt() == 0
+        assert FakeFastMachine('saved').halt() is None
+        assert FakeFastMachine('saved').suspend() == 0
+        assert FakeFastMachine('poweroff').suspend() is None
+        assert FakeFastMachine('running').resume() is None
+        assert FakeFastMachine('poweroff').ssh_config() is None
+
+    def test_ssh_config(self):
+        machine = FakeFastMachine('running')
+
+        assert machine.ssh_port() == 2222
+        assert machine.private_key().endswith('insecure_private_key')
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+
+from .test_base import TestBase
+from ..filesync import SyncIndex, RsyncOutput, balance, top_level_sizes, \
+    parse_rsync_stats
+
+
+class TestSyncIndex(TestBase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self._write('index.js')
+        self._write('lib/app.js')
+        self._write('node_modules/dep/index.js')
+        self._write('debug.log')
+
+        self.ignores = ['node_modules/', '*.log']
+        self.index = SyncIndex('test-filesync-%d' % os.getpid(),
+                               self.folder, self.ignores, 'uuid')
+        self.index.reset()
+
+    def tearDown(self):
+        self.index.reset()
+        shutil.rmtree(self.folder)
+
+    def _write(self, path, data='data'):
+        path = os.path.join(self.folder, path)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as fd:
+            fd.write(data)
+
+    def test_scan(self):
+        files = self.index.scan()
+
+        assert sorted(files) == ['index.js', 'lib', 'lib/app.js']
+        assert files['lib'] is None
+        assert files['index.js'][1] == 4
+
+    def test_changes(self):
+        assert self.index.needs_full_sync()
+        self.index.save(self.index.scan(), full=True)
+
+        index = SyncIndex(self.index.name, self.folder, self.ignores, 'uuid')
+        assert not index.needs_full_sync()
+        assert index.changes(index.scan()) == ([], [])
+
+        self._write('index.js', 'changed')
+        self._write('lib/new/file.js')
+        os.remove(os.path.join(self.folder, 'lib', 'app.js'))
+
+        assert index.changes(index.scan()) == (
+            ['index.js', 'lib/new', 'lib/new/file.js'], ['lib/app.js'])
+
+    def test_symlinks(self):
+        self._write('shared/conf.js')
+        self._write('common/conf.js')
+        os.symlink('shared', os.path.join(self.folder, 'lib', 'conf'))
+        self.index.save(self.index.scan(), full=True)
+
+        index = SyncIndex(self.index.name, self.folder, self.ignores, 'uuid')
+        files = index.scan()
+        # the link is not walked, rsync copies it as a link
+        assert 'lib/conf/conf.js' not in files
+        assert files['lib/conf'][2] == 'shared'
+
+        link = os.path.join(self.folder, 'lib', 'conf')
+        st = os.lstat(link)
+        os.remove(link)
+        os.symlink('common', link)
+        os.utime(os.path.join(self.folder, 'lib'), None)
+        # same mtime and length, only the target changed
+        assert os.lstat(link).st_size == st.st_size
+        assert 'lib/conf' in index.changes(index.scan())[0]
+
+    def test_outdated(self):
+        self.index.save(self.index.scan(), full=True)
+
+        # the box was recreated
+        index = SyncIndex(self.index.name, self.folder, self.ignores, 'other')
+        assert index.needs_full_sync()
+
+        # the ignores changed
+        index = SyncIndex(self.index.name, self.folder, [], 'uuid')
+        assert index.needs_full_sync()
+
+        index = SyncIndex(self.index.name, self.folder, self.ignores, 'uuid')
+        index.last_full_sync = time.time() - 7200
+        assert index.needs_full_sync()
+
+
+class TestSharding(TestBase):
+    def test_balance(self):
+        sizes = {'big': 100, 'medium': 60, 'small': 30, 'tiny': 10}
+
+        assert balance(sizes, 2) == [['big'], ['medium', 'small', 'tiny']]
+        assert balance(sizes, 1) == [['big', 'medium', 'small', 'tiny']]
+        assert len(balance(sizes, 8)) == 4
+        assert balance({}, 4) == []
+
+    def test_top_level_sizes(self):
+        files = {'lib': None, 'lib/a.js': [0, 10], 'lib/b.js': [0, 5],
+                 'index.js': [0, 3]}
+
+        assert top_level_sizes(files) == {'lib': 15, 'index.js': 3}
+
+    def test_parse_rsync_stats(self):
+        stats = {}
+        output = [
+            'Number of files: 1,234 (reg: 1,000, dir: 234)',
+            'Number of regular files transferred: 12',
+            'Total file size: 10,485,760 bytes',
+            'Total bytes sent: 2,048',
+            'Literal data: 1,024 bytes',
+        ]
+        for line in output:
+            assert parse_rsync_stats(line, stats)
+        # rsync 2.6 format, merged with the previous stats
+        assert parse_rsync_stats('Number of files transferred: 3', stats)
+        assert not parse_rsync_stats('lib/app.js', stats)
+
+        assert stats == {'files': 1234, 'transferred': 15,
+                         'size': 10485760, 'sent': 2048}
+
+    def test_rsync_output(self):
+        stats = {}
+        out = StringIO()
+        output = RsyncOutput(stats, out=out)
+        output.write('lib/app.js\n      1,024  50%')
+        assert out.getvalue() == 'lib/app.js\n'
+        # partial progress is written as soon as rsync redraws it
+        output.write('\r      2,048 100%')
+        assert out.getvalue() == 'lib/app.js\n      1,024  50%\r'
+        output.write('\r\nTotal bytes sent: 2,048\n')
+        output.close()
+
+        assert out.getvalue() == \
+            'lib/app.js\n      1,024  50%\r      2,048 100%\r\n'
+        assert stats == {'sent': 2048}
@@ -0,0 +1,77 @@
+from .test_base import TestBase
+from ..cli import helpers
+
+
+class FakeBox(object):
+    def __init__(self, state):
+        self.state = state
+        self.snapshots = 0
+        self.provisions = []
+
+    def name(self):
+        return 'web'
+
+    def vm_name(self):
+        return 'project-web'
+
+    def status(self):
+        return self.state
+
+    def is_running(self):
+        return self.state == 'running'
+
+    def up(self, *args):
+        self.provisions.append(args)
+        self.state = 'running'
+        return 0
+
+    def vagrant(self, *args):
+        self.provisions.append(args)
+        return 0
+
+    def history(self):
+        return [{'stats': {'web': {'unreachable': 0}}}]
+
+    def expose(self):
+        pass
+
+    def snapshot(self):
+        self.snapshots += 1
+        return 'aeris-%d' % self.snapshots
+
+
+class TestStartBox(TestBase):
+    def setUp(self):
+        self._helpers = dict((name, getattr(helpers, name)) for name in
+                             ['snapshot_retention', 'render_cli',
+                              'invalidate_vm', 'timestamp'])
+        helpers.snapshot_retention = lambda: 3
+        helpers.render_cli = lambda *args, **kwargs: ''
+        helpers.invalidate_vm = lambda name: None
+        helpers.timestamp = lambda text: None
+
+    def tearDown(self):
+        for name, value in self._helpers.items():
+            setattr(helpers, name, value)
+
+    def test_snapshot_new_box(self):
+        box = FakeBox('not created')
+        assert helpers.start_box(box) == 0
+        assert box.snapshots == 1
+
+    def test_no_snapshot_halted_box(self):
+        box = FakeBox('poweroff')
+        assert helpers.start_box(box) == 0
+        assert box.provisions == [('--provision', '--provision-with',
+                                   'shell')]
+        assert box.snapshots == 0
+
+    def test_no_snapshot_saved_box(self):
+        box = FakeBox('saved')
+        assert helpers.start_box(box) == 0
+        assert box.snapshots == 0
+
+    def test_snapshot_ansible(self):
+        box = FakeBox('saved')
+        assert helpers.start_box(box, ['ansible']) == 0
+        assert box.snapshots == 1
@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import tempfile
+
+from subprocess import check_output
+
+from .test_base import TestBase
+from .. import history
+from ..history import HistoryCache, box_stats, parse_history
+
+
+def _entry(n, user='vagrant'):
+    return json.dumps({'date': 'run %d' % n, 'user': user},
+                      ensure_ascii=False).encode('utf-8') + '\n'
+
+
+class TestHistory(TestBase):
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.history_file = history.HISTORY_FILE
+        history.HISTORY_FILE = os.path.join(self.folder, '.provision')
+        self.cache = HistoryCache('test-history-%d' % os.getpid(), 'uuid')
+        self.cache.reset()
+
+    def tearDown(self):
+        history.HISTORY_FILE = self.history_file
+        self.cache.reset()
+        shutil.rmtree(self.folder)
+
+    def _append(self, *entries, **kwargs):
+        with open(history.HISTORY_FILE, 'a') as fd:
+            for n in entries:
+                fd.write(_entry(n, **kwargs))
+
+    def _fetch(self):
+        output = check_output(['bash', '-c', self.cache.fetch_command()])
+        self.cache.update(output)
+        return output.split('\n', 1)[0].split()[-1]
+
+    def test_parse_history(self):
+        lines = [_entry(1), '', 'not json', _entry(2)]
+        entries = parse_history(lines)
+
+        assert not isinstance(entries, list)
+        assert [e['date'] for e in entries] == ['run 1', 'run 2']
+
+    def test_box_stats(self):
+        class Box(object):
+            def name(self):
+                return 'web'
+
+            def vm_name(self):
+                return 'project-web'
+
+        stats = {'unreachable': 0}
+        assert box_stats({'stats': {'web': stats}}, Box()) == stats
+        assert box_stats({'stats': {'project-web': stats}}, Box()) == stats
+        assert box_stats({'stats': {'db': stats}}, Box()) is None
+        assert box_stats({}, Box()) is None
+
+    def test_missing_file(self):
+        assert self._fetch() == 'full'
+        assert self.cache.lines() == []
+
+    def test_incremental_fetch(self):
+        self._append(1, 2)
+        assert self._fetch() == 'full'
+        self._append(3)
+        assert self._fetch() == 'append'
+        assert self._fetch() == 'append'
+
+        assert [e['date'] for e in parse_history(self.cache.lines())] == \
+            ['run 1', 'run 2', 'run 3']
+
+        cache = HistoryCache(self.cache.name, 'uuid')
+        assert cache.exists()
+        assert cache.data == self.cache.data
+
+    def test_replaced_file(self):
+        self._append(1, 2)
+        self._fetch()
+
+        os.remove(history.HISTORY_FILE)
+        self._append(4)
+        assert self._fetch() == 'full'
+        assert self.cache.lines() == [_entry(4).strip()]
+
+    def test_non_ascii(self):
+        self._append(1, 2, user=u'h\xe9l\xe8ne')
+        self._fetch()
+
+        # the cache is decoded when loaded back from its JSON file
+        self.cache = HistoryCache(self.cache.name, 'uuid')
+        self._append(3)
+        assert self._fetch() == 'append'
+        assert [e['user'] for e in parse_history(self.cache.lines())] == \
+            [u'h\xe9l\xe8ne', u'h\xe9l\xe8ne', 'vagrant']
+
+    def test_rewritten_file(self):
+        self._append(1, 2)
+        self._fetch()
+
+        # same inode and size, only the modification time tells
+        with open(history.HISTORY_FILE, 'r+') as fd:
+            fd.write(_entry(7))
+        mtime = os.stat(history.HISTORY_FILE).st_mtime + 10
+        os.utime(history.HISTORY_FILE, (mtime, mtime))
+        assert self._fetch() == 'full'
+        assert self.cache.lines()[0] == _entry(7).strip()
+        assert self._fetch() == 'append'
+
+    def test_other_target(self):
+        self._append(1)
+        self._fetch()
+
+        assert not HistoryCache(self.cache.name, 'other-uuid').exists()
@@ -0,0 +1,57 @@
+import os
+import shutil
+import tempfile
+
+from .test_base import TestBase
+from ..vagrant import NFS
+
+EXPORTS = '''\
+/srv/shared 10.0.0.0/8(rw)
+# VAGRANT-BEGIN:{uid} 1111-valid
+"{valid}" 172.16.0.2(rw,no_subtree_check)
+# VAGRANT-END:{uid} 1111-valid
+# VAGRANT-BEGIN:{uid} 2222-stale
+"{stale}" 172.16.0.3(rw,no_subtree_check)
+# VAGRANT-END:{uid} 2222-stale
+# VAGRANT-BEGIN: 99999 3333-other
+"{stale}" 172.16.0.4(rw,no_subtree_check)
+# VAGRANT-END: 99999 3333-other
+'''
+
+
+class TestNFS(TestBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.export_file = os.path.join(self.tmp_dir, 'exports')
+        with open(self.export_file, 'w') as fd:
+            fd.write(EXPORTS.format(uid=' %d' % os.getuid(),
+                                    valid=self.tmp_dir,
+                                    stale=os.path.join(self.tmp_dir, 'gone')))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_parse(self):
+        nfs = NFS(self.export_file)
+        nfs.parse_exports()
+
+        assert sorted(nfs.exports) == ['1111-valid', '2222-stale']
+        assert nfs.stale_exports() == ['2222-stale']
+
+    def test_reconcile(self):
+        assert NFS(self.export_file).reconcile(dry_run=True) == \
+            ['2222-stale']
+        assert NFS(self.export_file).reconcile() == ['2222-stale']
+
+        with open(self.export_file) as fd:
+            content = fd.read()
+        assert '2222-stale' not in content
+        assert '1111-valid' in content
+        assert '3333-other' in content
+        assert content.startswith('/srv/shared')
+
+        # the file did not change, it is not checked again
+        os.makedirs(os.path.join(self.tmp_dir, 'gone'))
+        nfs = NFS(self.export_file)
+        assert nfs.reconcile() == []
+        assert sorted(nfs.exports) == ['1111-valid']
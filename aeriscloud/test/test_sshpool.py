@@ -0,0 +1,107 @@
+import socket
+
+from .test_base import TestBase
+from ..sshpool import SSHPool, SSHConnectionError
+
+
+class FakeFile(object):
+    def __init__(self, data, status=0):
+        self.data = data
+        self.channel = self
+        self.status = status
+
+    def read(self):
+        return self.data
+
+    def recv_exit_status(self):
+        return self.status
+
+
+class FakeClient(object):
+    def __init__(self, fail=0):
+        self.active = True
+        self.closed = False
+        self.fail = fail
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return self.active
+
+    def exec_command(self, cmd, timeout=None):
+        if self.fail:
+            self.fail -= 1
+            raise socket.error('connection reset')
+        return None, FakeFile(cmd), FakeFile('')
+
+    def close(self):
+        self.closed = True
+
+
+class FakePool(SSHPool):
+    def __init__(self, fail=0):
+        super(FakePool, self).__init__()
+        self.connections = []
+        self.fail = fail
+
+    def _connect(self, host, username, key_filename, port):
+        client = FakeClient(self.fail)
+        self.fail = 0
+        self.connections.append(client)
+        return client
+
+
+class TestSSHPool(TestBase):
+    def test_reuse(self):
+        pool = FakePool()
+
+        assert pool.run('box', 'vagrant', 'key', 'ls') == (0, 'ls', '')
+        assert pool.run('box', 'vagrant', 'key', 'pwd') == (0, 'pwd', '')
+        assert len(pool.connections) == 1
+
+        # dead transports are replaced
+        pool.connections[0].active = False
+        pool.run('box', 'vagrant', 'key', 'ls')
+        assert len(pool.connections) == 2
+        assert pool.connections[0].closed
+
+    def test_reconnect(self):
+        pool = FakePool(fail=1)
+
+        assert pool.run('box', 'vagrant', 'key', 'ls') == (0, 'ls', '')
+        assert len(pool.connections) == 2
+
+    def test_failure(self):
+        pool = FakePool()
+        # every connection fails
+        pool._connect = lambda *args: FakeClient(fail=1)
+
+        self.assertRaises(SSHConnectionError, pool.run, 'box', 'vagrant',
+                          'key', 'ls')
+
+    def test_close(self):
+        pool = FakePool()
+        pool.client('box1', 'vagrant', 'key')
+        pool.client('box2', 'vagrant', 'key')
+
+        pool.close('box1')
+        assert pool.connections[0].closed
+        assert not pool.connections[1].closed
+
+    def test_close_port(self):
+        pool = FakePool()
+        pool.client('127.0.0.1', 'vagrant', 'key', port=2222)
+        pool.client('127.0.0.1', 'vagrant', 'key', port=2200)
+
+        pool.close('127.0.0.1', 2222)
+        assert pool.connections[0].closed
+        assert not pool.connections[1].closed
+
+    def test_reconnect_port(self):
+        pool = FakePool()
+        pool.client('127.0.0.1', 'vagrant', 'key', port=2200)
+        pool.fail = 1
+
+        pool.run('127.0.0.1', 'vagrant', 'key', 'ls', port=2222)
+        assert not pool.connections[0].closed
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from .test_base import TestBase
+from ..utils import memoized, run_parallel
+
+
+class TestMemoized(TestBase):
+    def test_lru_eviction(self):
+        calls = []
+
+        @memoized(maxsize=2)
+        def double(val):
+            calls.append(val)
+            return val * 2
+
+        assert double(1) == 2
+        assert double(2) == 4
+        assert double(1) == 2
+        # 2 is the least recently used entry and gets evicted
+        assert double(3) == 6
+        assert double(1) == 2
+        assert double(2) == 4
+
+        assert calls == [1, 2, 3, 2]
+        assert double.cache_info()['evictions'] == 2
+        assert double.cache_info()['hits'] == 2
+
+    def test_ttl(self):
+        calls = []
+
+        @memoized(ttl=0.05)
+        def identity(val):
+            calls.append(val)
+            return val
+
+        identity(1)
+        identity(1)
+        time.sleep(0.1)
+        identity(1)
+
+        assert calls == [1, 1]
+
+    def test_callable_ttl(self):
+        calls = []
+        ttl = [None]
+
+        @memoized(ttl=lambda: ttl[0])
+        def identity(val):
+            calls.append(val)
+            return val
+
+        identity(1)
+        # the ttl is resolved when results are stored
+        ttl[0] = 0.05
+        identity(2)
+        time.sleep(0.1)
+        identity(1)
+        identity(2)
+
+        assert calls == [1, 2, 2]
+
+    def test_invalidate_prefix(self):
+        calls = []
+
+        @memoized
+        def prop(vm, name):
+            calls.append((vm, name))
+            return name
+
+        prop('vm1', 'ip')
+        prop('vm1', 'mac')
+        prop('vm2', 'ip')
+
+        assert prop.invalidate_prefix('vm1') == 2
+
+        prop('vm1', 'ip')
+        prop('vm2', 'ip')
+
+        assert calls == [('vm1', 'ip'), ('vm1', 'mac'),
+                         ('vm2', 'ip'), ('vm1', 'ip')]
+
+    def test_clear_cache_only(self):
+        calls = []
+
+        @memoized
+        def identity(val):
+            calls.append(val)
+            return val
+
+        identity(1)
+        assert identity(clear_cache_only=True) is None
+        identity(1)
+
+        assert calls == [1, 1]
+
+
+class TestRunParallel(TestBase):
+    def test_results(self):
+        def _check(val):
+            if val == 3:
+                raise ValueError('invalid value')
+            return val * 2
+
+        results = dict(run_parallel(_check, [1, 2, 3], jobs=2))
+
+        assert results[1] == 2
+        assert results[2] == 4
+        assert isinstance(results[3], ValueError)
+
+    def test_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def _work(val):
+            with lock:
+                running.append(val)
+                peak.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(val)
+
+        run_parallel(_work, range(8), jobs=3)
+
+        assert max(peak) <= 3
+        assert run_parallel(_work, []) == []
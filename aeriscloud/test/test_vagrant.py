@@ -0,0 +1,69 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from .test_base import TestBase
+from ..vagrant import MachineIndex
+
+
+class TestMachineIndex(TestBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index_file = MachineIndex.machine_index_file
+        MachineIndex.machine_index_file = os.path.join(self.tmp_dir, 'index')
+
+        self.project = os.path.join(self.tmp_dir, 'project')
+        self._write_index({'a1': self._machine('web', 'uuid-web'),
+                           'b2': self._machine('db', 'uuid-db')})
+
+    def tearDown(self):
+        MachineIndex.machine_index_file = self.index_file
+        # the real index is loaded again on next use
+        MachineIndex._mtime = None
+        shutil.rmtree(self.tmp_dir)
+
+    def _machine(self, name, uuid):
+        data_path = os.path.join(self.project, '.vagrant', 'machines', name,
+                                 'virtualbox')
+        if not os.path.isdir(data_path):
+            os.makedirs(data_path)
+        with open(os.path.join(data_path, 'id'), 'w') as fd:
+            fd.write(uuid)
+        return {
+            'local_data_path': os.path.join(self.project, '.vagrant'),
+            'name': name,
+            'provider': 'virtualbox',
+            'state': 'running',
+            'vagrantfile_path': '/opt/aeriscloud',
+        }
+
+    def _write_index(self, machines, mtime=None):
+        with open(MachineIndex.machine_index_file, 'w') as fd:
+            json.dump({'version': 1, 'machines': machines}, fd)
+        if mtime:
+            os.utime(MachineIndex.machine_index_file, (mtime, mtime))
+
+    def test_lookups(self):
+        index = MachineIndex()
+
+        assert index.get('a1').name == 'web'
+        assert index.get_by_name('db').id == 'b2'
+        assert index.get_by_path(self.project + '/.vagrant/', 'web').id == 'a1'
+        assert index.get_by_path(self.project + '/.vagrant', 'api') is None
+        assert index.get_by_uuid('uuid-db').id == 'b2'
+        assert sorted(m.id for m in index.get_by_folder(self.project)) == \
+            ['a1', 'b2']
+        assert len(index.get_by_vagrantfile('/opt/aeriscloud/Vagrantfile')) \
+            == 2
+
+    def test_reload(self):
+        MachineIndex()
+        self._write_index({'c3': self._machine('api', 'uuid-api')},
+                          time.time() + 10)
+
+        index = MachineIndex()
+        assert index.get('a1') is None
+        assert index.get_by_uuid('uuid-api').id == 'c3'
+        assert index.get_by_name('web') is None
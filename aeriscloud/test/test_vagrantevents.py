@@ -0,0 +1,85 @@
+import json
+import os
+
+from .test_base import TestBase
+from .. import vagrantevents
+from ..vagrantevents import PhaseTimer, VagrantRun, parse_line, render, \
+    recent_runs, machine_readable
+
+OUTPUT = [
+    '1476290245,web,metadata,provider,virtualbox\n',
+    '1476290245,web,ui,info,Importing base box \'centos-7\'...\n',
+    '1476290250,web,ui,info,Booting VM...\n',
+    '1476290251,web,ui,info,Waiting for machine to boot. This may take a '
+    'few minutes...\n',
+    '1476290251,web,ui,detail,SSH address: 127.0.0.1:2222\n',
+    '1476290260,web,ui,info,Machine booted and ready!\n',
+    '1476290262,web,ui,info,Running provisioner: shell...\n',
+    '1476290263,web,ui,output,done%!(VAGRANT_COMMA) bye\\n\n',
+]
+
+
+class TestVagrantEvents(TestBase):
+    def setUp(self):
+        self.log_file = vagrantevents.log_file()
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+
+    def tearDown(self):
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        if hasattr(machine_readable, 'val'):
+            del machine_readable.val
+
+    def test_machine_readable(self):
+        # vagrant would lose its colors and prompts
+        assert not machine_readable()
+        # aeris up --timings
+        assert machine_readable(True)
+        assert machine_readable()
+
+    def test_parse(self):
+        event = parse_line(OUTPUT[7])
+
+        assert event.timestamp == 1476290263
+        assert event.target == 'web'
+        assert event.data == ['output', 'done, bye\n']
+        assert parse_line('Vagrant failed to initialize\n') is None
+
+    def test_render(self):
+        assert render(parse_line(OUTPUT[0])) == []
+        assert render(parse_line(OUTPUT[2])) == ['==> web: Booting VM...']
+        assert render(parse_line(OUTPUT[4])) == \
+            ['    web: SSH address: 127.0.0.1:2222']
+        assert render(parse_line(OUTPUT[7])) == ['done, bye']
+
+    def test_phases(self):
+        timer = PhaseTimer(now=0)
+        for now, line in enumerate(OUTPUT):
+            timer.feed(parse_line(line), now=now + 1)
+
+        assert timer.finish(now=10) == [
+            ['startup', 2], ['import', 1], ['boot', 1], ['ssh', 2],
+            ['guest', 1], ['provision:shell', 3]
+        ]
+
+    def test_run(self):
+        run = VagrantRun('project', 'web', 'up')
+        lines = []
+        for line in OUTPUT:
+            lines.extend(run.feed(line))
+        timings = run.finish(0)
+
+        assert lines[0] == '==> web: Importing base box \'centos-7\'...'
+        assert [phase for phase, _ in timings['phases']] == [
+            'startup', 'import', 'boot', 'ssh', 'guest', 'provision:shell'
+        ]
+        assert recent_runs('project', 'web')[-1] is timings
+        assert recent_runs('project', 'db') == []
+
+        with open(self.log_file) as fd:
+            records = [json.loads(line) for line in fd]
+        assert len(records) == len(OUTPUT) + 1
+        assert records[1]['phase'] == 'import'
+        assert records[-1]['type'] == 'timings'
+        assert records[-1]['run'] == run.id
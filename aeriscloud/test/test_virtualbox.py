@@ -0,0 +1,217 @@
+import time
+
+from .test_base import TestBase
+from .. import virtualbox
+from ..virtualbox import VMNotFound, InvalidState, set_backend
+from ..virtualbox_fake import FakeBackend
+
+LIST_LONG = '''Name:            test-web
+Groups:          /
+UUID:            0b6c0e8f-1111-2222-3333-444455556666
+Config file:     /vms/test-web/test-web.vbox
+State:           running (since 2016-03-22T09:15:10.123000000)
+NIC 1:           MAC: 080027C30A0B, Attachment: NAT, Cable connected: on
+NIC 1 Rule(0):   name = ssh, protocol = tcp, host ip = 127.0.0.1, \
+host port = 20241, guest ip = , guest port = 22
+NIC 2:           MAC: 0800270DAB12, Attachment: Host-only Interface \
+'vboxnet1', Cable connected: on
+NIC 3:           disabled
+
+Name: 'vagrant', Host path: '/vagrant' (machine mapping), writable
+
+Name:            test-db
+UUID:            0b6c0e8f-1111-2222-3333-777777777777
+State:           powered off (since 2016-03-22T09:15:10.123000000)
+'''
+
+GUEST_PROPERTIES = '''\
+Name: /VirtualBox/GuestInfo/Net/0/V4/IP, value: 10.0.2.15, timestamp: 1
+Name: /VirtualBox/GuestInfo/Net/1/V4/IP, value: 172.16.1.2, timestamp: 1
+Name: /VirtualBox/GuestInfo/Net/1/Status, value: Up, timestamp: 1
+Name: /VirtualBox/GuestInfo/Net/Count, value: 2, timestamp: 1
+'''
+
+SNAPSHOTS = '''\
+SnapshotName="aeris-20160322-091510"
+SnapshotUUID="7a8a1c6e-1111-2222-3333-444455556666"
+SnapshotName-1="aeris-20160323-101010"
+SnapshotUUID-1="7a8a1c6e-1111-2222-3333-777777777777"
+CurrentSnapshotName="aeris-20160323-101010"
+CurrentSnapshotUUID="7a8a1c6e-1111-2222-3333-777777777777"
+CurrentSnapshotNode="SnapshotName-1"
+'''
+
+
+class TestParsers(TestBase):
+    def test_list_long(self):
+        vms = virtualbox._parse_list_long(LIST_LONG.splitlines())
+
+        assert sorted(vms.keys()) == ['test-db', 'test-web']
+        assert vms['test-web']['VMState'] == 'running'
+        assert vms['test-web']['VMStateChangeTime'] == \
+            '2016-03-22T09:15:10.123000000'
+        assert vms['test-web']['Forwarding(0)'] == \
+            'ssh,tcp,127.0.0.1,20241,,22'
+        assert vms['test-web']['hostonlyadapter2'] == 'vboxnet1'
+        assert vms['test-web']['nic3'] == 'none'
+        assert vms['test-db']['VMState'] == 'poweroff'
+
+    def test_guest_properties(self):
+        props = virtualbox._parse_guest_properties(
+            GUEST_PROPERTIES.splitlines())
+
+        assert props['/VirtualBox/GuestInfo/Net/1/V4/IP'] == '172.16.1.2'
+        assert props['/VirtualBox/GuestInfo/Net/Count'] == '2'
+
+    def test_snapshots(self):
+        snapshots = virtualbox._parse_snapshots(SNAPSHOTS.splitlines())
+
+        assert [snapshot['name'] for snapshot in snapshots] == \
+            ['aeris-20160322-091510', 'aeris-20160323-101010']
+        assert snapshots[1]['uuid'] == '7a8a1c6e-1111-2222-3333-777777777777'
+
+    def test_progress(self):
+        assert virtualbox._parse_progress('0%...10%...20%') == [0, 10, 20]
+        assert virtualbox._parse_progress('...1') == []
+
+
+class TestFakeBackend(TestBase):
+    def setUp(self):
+        self.backend = FakeBackend()
+        self.backend.add_vm('test-web', state='saved', guest_properties={
+            '/VirtualBox/GuestInfo/Net/0/V4/IP': '10.0.2.15',
+            '/VirtualBox/GuestInfo/Net/1/V4/IP': '172.16.1.2',
+            '/VirtualBox/GuestInfo/Net/Count': '2',
+            '/VirtualBox/HostInfo/GUI/LanguageID': 'C'
+        })
+        set_backend(self.backend)
+
+    def tearDown(self):
+        set_backend(None)
+
+    def test_guest_network(self):
+        assert virtualbox.vm_ip('test-web', 1) == '172.16.1.2'
+        assert virtualbox.vm_ip('test-web', 2) is None
+        assert len(virtualbox.vm_network('test-web')) == 2
+
+    def test_wait_guest_network(self):
+        # the interface has an IP but is not reported as up yet
+        assert virtualbox.wait_guest_network('test-web', 1, 0.05) is None
+
+        props = self.backend.vms['test-web']['guest_properties']
+        props['/VirtualBox/GuestInfo/Net/1/Status'] = 'Up'
+        assert virtualbox.wait_guest_network('test-web', 1, 0.05) == \
+            '172.16.1.2'
+
+    def test_wait_guest_network_missed_change(self):
+        props = self.backend.vms['test-web']['guest_properties']
+        read = self.backend.guest_properties
+
+        def guest_properties(name, pattern):
+            # the interface comes up right after being read, before the
+            # wait starts, so the wait is never notified of it
+            res = read(name, pattern)
+            props['/VirtualBox/GuestInfo/Net/1/Status'] = 'Up'
+            return res
+
+        self.backend.guest_properties = guest_properties
+        slice_, virtualbox.GUEST_WAIT_SLICE = \
+            virtualbox.GUEST_WAIT_SLICE, 0.05
+        try:
+            start = time.time()
+            assert virtualbox.wait_guest_network('test-web', 1, 5) == \
+                '172.16.1.2'
+            assert time.time() - start < 1
+        finally:
+            virtualbox.GUEST_WAIT_SLICE = slice_
+
+    def test_state_changes(self):
+        virtualbox.vm_start('test-web')
+        assert virtualbox.vm_info_all()['test-web']['VMState'] == 'running'
+        assert 'test-web' in virtualbox.list_vms(True)
+
+        virtualbox.vm_suspend('test-web')
+        assert virtualbox.vm_info_all()['test-web']['VMState'] == 'saved'
+
+        self.assertRaises(InvalidState, virtualbox.vm_suspend, 'test-web')
+
+    def test_linked_clone(self):
+        virtualbox.vm_import('/boxes/box.ovf', 'master')
+        self.assertRaises(ValueError, virtualbox.vm_clone, 'master',
+                          'test-clone', linked=True)
+
+        virtualbox.snapshot_take('master', 'base')
+        uuid = virtualbox.vm_clone('master', 'test-clone', snapshot='base',
+                                   linked=True)
+        assert virtualbox.list_vms()['test-clone'] == uuid
+
+        # masters cannot be deleted while they have clones
+        self.assertRaises(InvalidState, virtualbox.vm_delete, 'master')
+        virtualbox.vm_delete('test-clone')
+        virtualbox.vm_delete('master')
+        assert 'master' not in virtualbox.list_vms()
+
+    def test_snapshot_restore(self):
+        virtualbox.vm_start('test-web')
+        virtualbox.snapshot_take('test-web', 'provisioned')
+        assert virtualbox.snapshot_list('test-web') == \
+            [{'name': 'provisioned', 'uuid': 'provisioned'}]
+
+        # snapshots cannot be restored while the VM is running
+        self.assertRaises(InvalidState, virtualbox.snapshot_restore,
+                          'test-web', 'provisioned')
+        virtualbox.vm_poweroff('test-web')
+        virtualbox.snapshot_restore('test-web', 'provisioned')
+        assert virtualbox.vm_info_all()['test-web']['VMState'] == 'saved'
+
+        virtualbox.snapshot_delete('test-web', 'provisioned')
+        assert virtualbox.snapshot_list('test-web') == []
+
+    def test_not_found(self):
+        self.assertRaises(VMNotFound, virtualbox.vm_info, 'test-db')
+
+
+class CountingBackend(FakeBackend):
+    cacheable = True
+
+    def __init__(self):
+        super(CountingBackend, self).__init__()
+        self.calls = []
+
+    def list_vms(self, running=False):
+        self.calls.append('list_vms')
+        return super(CountingBackend, self).list_vms(running)
+
+    def vm_info_all(self):
+        self.calls.append('vm_info_all')
+        return super(CountingBackend, self).vm_info_all()
+
+
+class TestCache(TestBase):
+    def setUp(self):
+        self.backend = CountingBackend()
+        self.backend.add_vm('test-web', state='running')
+        set_backend(self.backend)
+        virtualbox.clear_cache()
+
+    def tearDown(self):
+        virtualbox.clear_cache()
+        set_backend(None)
+
+    def _call(self):
+        # only the persistent cache is kept between aeris runs
+        virtualbox.list_vms.clear()
+        virtualbox.vm_info_all.clear()
+        self.backend.calls = []
+        virtualbox.vm_info_all()
+        return self.backend.calls
+
+    def test_expired_states(self):
+        assert self._call() == ['vm_info_all']
+        assert self._call() == []
+
+        # once expired, states are checked once then trusted again
+        virtualbox._cache._data['vms']['time'] -= \
+            virtualbox.cache_ttl() + 1
+        assert self._call() == ['list_vms']
+        assert self._call() == []
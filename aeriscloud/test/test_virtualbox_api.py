@@ -0,0 +1,81 @@
+import sys
+import types
+
+from .test_base import TestBase
+
+
+class FakeConstants(object):
+    NetworkAttachmentType_NAT = 1
+    NetworkAttachmentType_HostOnly = 4
+    NetworkAttachmentType_Bridged = 2
+
+    def all_values(self, name):
+        return {'PoweredOff': 1, 'Running': 5}
+
+
+class FakeAdapter(object):
+    def __init__(self, attachment_type=None, redirects=None, **kwargs):
+        self.enabled = attachment_type is not None
+        self.attachmentType = attachment_type
+        self.MACAddress = '080027C30A0B'
+        self.NATEngine = type('NATEngine', (object,),
+                              {'redirects': redirects or []})()
+        self.__dict__.update(kwargs)
+
+
+class FakeMachine(object):
+    accessible = True
+    name = 'test-web'
+    id = '0b6c0e8f-1111-2222-3333-444455556666'
+    settingsFilePath = '/vms/test-web/test-web.vbox'
+    memorySize = 1024
+    CPUCount = 2
+    state = 5
+    lastStateChange = 1458638110123
+
+    def getNetworkAdapter(self, slot):
+        if slot == 0:
+            return FakeAdapter(1, ['ssh,1,127.0.0.1,2222,,22',
+                                   'dns,0,,5353,,53'])
+        if slot == 1:
+            return FakeAdapter(4, hostOnlyInterface='vboxnet1')
+        return FakeAdapter()
+
+
+class FakeManager(object):
+    def __init__(self, style, params):
+        self.vbox = type('VirtualBox', (object,), {'version': '5.0.16'})()
+        self.constants = FakeConstants()
+
+    def getArray(self, obj, field):
+        if field == 'machines':
+            return [FakeMachine()]
+        return getattr(obj, field)
+
+
+class TestVBoxAPIBackend(TestBase):
+    def setUp(self):
+        vboxapi = types.ModuleType('vboxapi')
+        vboxapi.VirtualBoxManager = FakeManager
+        self._vboxapi = sys.modules.get('vboxapi')
+        sys.modules['vboxapi'] = vboxapi
+
+    def tearDown(self):
+        if self._vboxapi is None:
+            del sys.modules['vboxapi']
+        else:
+            sys.modules['vboxapi'] = self._vboxapi
+
+    def test_vm_info_all(self):
+        from ..virtualbox_api import VBoxAPIBackend
+
+        info = VBoxAPIBackend().vm_info_all()['test-web']
+
+        assert info['VMState'] == 'running'
+        assert info['VMStateChangeTime'] == '2016-03-22T09:15:10.123000000'
+        assert info['nic1'] == 'nat'
+        assert info['Forwarding(0)'] == 'ssh,tcp,127.0.0.1,2222,,22'
+        assert info['Forwarding(1)'] == 'dns,udp,,5353,,53'
+        assert info['nic2'] == 'hostonly'
+        assert info['hostonlyadapter2'] == 'vboxnet1'
+        assert info['nic3'] == 'none'
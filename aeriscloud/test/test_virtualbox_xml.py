@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+
+from .test_base import TestBase
+from .. import virtualbox_xml
+
+VIRTUALBOX_XML = '''<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.virtualbox.org/" version="1.15-linux">
+  <Global>
+    <MachineRegistry>
+      <MachineEntry uuid="{0b6c0e8f-1111-2222-3333-444455556666}"
+                    src="test-web/test-web.vbox"/>
+    </MachineRegistry>
+  </Global>
+</VirtualBox>
+'''
+
+MACHINE_XML = '''<?xml version="1.0"?>
+<VirtualBox xmlns="http://www.virtualbox.org/" version="1.15-linux">
+  <Machine uuid="{0b6c0e8f-1111-2222-3333-444455556666}" name="test-web">
+    <MediaRegistry>
+      <HardDisks>
+        <HardDisk uuid="{aaaa}" location="box-disk1.vmdk" format="VMDK"/>
+      </HardDisks>
+    </MediaRegistry>
+    <Hardware>
+      <CPU count="2"/>
+      <Memory RAMSize="1024"/>
+      <Network>
+        <Adapter slot="0" enabled="true" MACAddress="080027C30A0B">
+          <NAT>
+            <Forwarding name="ssh" proto="1" hostip="127.0.0.1"
+                        hostport="2222" guestport="22"/>
+            <Forwarding name="web" proto="1" hostport="8080"
+                        guestport="80"/>
+          </NAT>
+        </Adapter>
+        <Adapter slot="1" enabled="true" MACAddress="0800270DAB12">
+          <HostOnlyInterface name="vboxnet1"/>
+        </Adapter>
+      </Network>
+    </Hardware>
+    <StorageControllers>
+      <StorageController name="SATA" type="AHCI">
+        <AttachedDevice type="HardDisk" port="0" device="0">
+          <Image uuid="{aaaa}"/>
+        </AttachedDevice>
+      </StorageController>
+    </StorageControllers>
+    <Snapshot uuid="{bbbb}" name="old">
+      <Hardware>
+        <Memory RAMSize="4096"/>
+        <Network>
+          <Adapter slot="0" enabled="true" MACAddress="000000000000">
+            <NAT>
+              <Forwarding name="old" proto="0" hostport="1" guestport="1"/>
+            </NAT>
+          </Adapter>
+        </Network>
+      </Hardware>
+    </Snapshot>
+  </Machine>
+</VirtualBox>
+'''
+
+
+class TestVirtualBoxXML(TestBase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.global_file = os.path.join(self.tmp_dir, 'VirtualBox.xml')
+        self.machine_file = os.path.join(self.tmp_dir, 'test-web',
+                                         'test-web.vbox')
+
+        os.makedirs(os.path.dirname(self.machine_file))
+        with open(self.global_file, 'w') as fd:
+            fd.write(VIRTUALBOX_XML)
+        with open(self.machine_file, 'w') as fd:
+            fd.write(MACHINE_XML)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        virtualbox_xml._parsed.clear()
+
+    def test_registry(self):
+        registry = virtualbox_xml._parse_registry(self.global_file)
+
+        assert registry == {
+            '0b6c0e8f-1111-2222-3333-444455556666': self.machine_file
+        }
+
+    def test_machine(self):
+        machine = virtualbox_xml.machine_settings(self.machine_file)
+
+        assert machine['name'] == 'test-web'
+        assert machine['memory'] == 1024
+        assert machine['cpus'] == 2
+        assert [nic['type'] for nic in machine['nics']] == \
+            ['nat', 'hostonly']
+        assert machine['nics'][1]['interface'] == 'vboxnet1'
+        assert machine['forwards'] == {
+            'ssh': {'protocol': 'tcp', 'host_ip': '127.0.0.1',
+                    'host_port': '2222', 'guest_ip': '',
+                    'guest_port': '22'},
+            'web': {'protocol': 'tcp', 'host_ip': '',
+                    'host_port': '8080', 'guest_ip': '',
+                    'guest_port': '80'},
+        }
+        assert machine['disks'] == [{
+            'controller': 'SATA', 'port': 0, 'device': 0, 'uuid': 'aaaa',
+            'location': os.path.join(self.tmp_dir, 'test-web',
+                                     'box-disk1.vmdk')
+        }]
+
+    def test_cache(self):
+        first = virtualbox_xml.machine_settings(self.machine_file)
+        assert virtualbox_xml.machine_settings(self.machine_file) is first
+
+        stat = os.stat(self.machine_file)
+        os.utime(self.machine_file, (stat.st_atime, stat.st_mtime + 10))
+
+        assert virtualbox_xml.machine_settings(self.machine_file) \
+            is not first
@@ -1,18 +1,33 @@
 from __future__ import print_function
 
-import collections
 import contextlib
 import os
 import re
+import socket
 import sys
+import threading
+import time
 
 from arrow import now
 from click import secho
 from functools import update_wrapper
 from jinja2 import Environment, PackageLoader
+from multiprocessing.pool import ThreadPool
 from platform import system
 from sh import Command, CommandNotFound
 
+from .log import get_logger
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6
+    from ordereddict import OrderedDict
+
+logger = get_logger('utils')
+
+# how many operations on boxes, disks or files run_parallel runs at once
+DEFAULT_JOBS = 4
 
 # python3 compat
 if sys.version_info[0] == 3 and sys.version_info[1] >= 3:
@@ -33,9 +48,111 @@ else:
         return "'" + s.replace("'", "'\"'\"'") + "'"
 
 
+# every memoized function, used to report cache statistics
+_memoized_functions = []
+
+
+class _MemoizeCache(object):
+    """
+    LRU cache with optional per-entry TTL used by the memoized decorator
+
+    :param maxsize: int Maximum number of entries, None for unbounded
+    :param ttl: int|float|callable Time to live of entries in seconds,
+                None for never expiring entries, a callable is called every
+                time an entry is stored
+    """
+
+    def __init__(self, maxsize=None, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        """
+        Return a (found, value) tuple for the given key
+        """
+        with self._lock:
+            if key in self._entries:
+                value, expires = self._entries.pop(key)
+                if expires is None or expires > time.time():
+                    # re-insert the entry to mark it as recently used
+                    self._entries[key] = (value, expires)
+                    self.hits += 1
+                    return True, value
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            ttl = self.ttl() if callable(self.ttl) else self.ttl
+            expires = None
+            if ttl is not None:
+                expires = time.time() + ttl
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+
+            while self.maxsize is not None and \
+                    len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, match):
+        """
+        Remove every entry whose arguments match the given function
+
+        :param match: callable(tuple) -> bool
+        :return: int The number of removed entries
+        """
+        with self._lock:
+            keys = [key for key in self._entries if match(key[0])]
+            for key in keys:
+                del self._entries[key]
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'size': len(self._entries),
+            'maxsize': self.maxsize
+        }
+
+
 # inspired from https://wiki.python.org/moin/PythonDecoratorLibrary
-def memoized(func):
-    _cache = {}
+def memoized(func=None, maxsize=256, ttl=None):
+    """
+    Cache the results of the decorated function, can be used either as
+    @memoized or @memoized(maxsize=..., ttl=...)
+
+    The decorated function gets the following helpers:
+    * invalidate(*args): drop the entry for the given arguments
+    * invalidate_prefix(*args): drop every entry whose arguments start with
+      the given ones (eg. every entry for a given VM name)
+    * clear(): drop every entry
+    * cache_info(): returns the hits/misses/evictions counters
+
+    For backward compatibility, calling the function with clear_cache=True
+    clears the cache before calling it and clear_cache_only=True only
+    clears the cache.
+
+    :param maxsize: int Maximum number of cached results, None for unbounded
+    :param ttl: int|float|callable Seconds before a result expires, None
+                for never, a callable is resolved every time a result is
+                stored so that it can depend on the configuration
+    """
+    if func is None:
+        return lambda f: memoized(f, maxsize=maxsize, ttl=ttl)
+
+    _cache = _MemoizeCache(maxsize, ttl)
 
     def _deco(*args, **kwargs):
         if 'clear_cache' in kwargs or 'clear_cache_only' in kwargs:
@@ -43,18 +160,83 @@ def memoized(func):
             if 'clear_cache_only' in kwargs:
                 return  # we don't care about the output
             del kwargs['clear_cache']
-        if not isinstance(args, collections.Hashable):
+
+        key = (args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
             return func(*args, **kwargs)
-        if args in _cache:
-            return _cache[args]
-        else:
-            value = func(*args, **kwargs)
-            _cache[args] = value
+
+        found, value = _cache.get(key)
+        if found:
             return value
 
+        value = func(*args, **kwargs)
+        _cache.set(key, value)
+        return value
+
+    def invalidate(*args):
+        return _cache.invalidate(lambda key_args: key_args == args)
+
+    def invalidate_prefix(*args):
+        return _cache.invalidate(
+            lambda key_args: key_args[:len(args)] == args)
+
+    _deco.invalidate = invalidate
+    _deco.invalidate_prefix = invalidate_prefix
+    _deco.clear = _cache.clear
+    _deco.cache_info = _cache.info
+
+    _memoized_functions.append(_deco)
+
     return update_wrapper(_deco, func)
 
 
+def memoized_stats():
+    """
+    Return the cache statistics of every memoized function that was used
+    at least once
+
+    :return: dict[str,dict[str,int]]
+    """
+    stats = {}
+    for func in _memoized_functions:
+        info = func.cache_info()
+        if info['hits'] or info['misses']:
+            stats['%s.%s' % (func.__module__, func.__name__)] = info
+    return stats
+
+
+def run_parallel(func, items, jobs=DEFAULT_JOBS):
+    """
+    Call func on every item using at most jobs threads, exceptions are
+    returned instead of being raised so that one failure does not stop the
+    other operations
+
+    :param func: callable
+    :param items: list
+    :param jobs: int
+    :return: list[(any, any|Exception)] Every item with its result, in the
+             order they completed
+    """
+    def _run(item):
+        try:
+            return item, func(item)
+        except Exception as e:
+            logger.debug('%r failed: %s', item, e)
+            return item, e
+
+    if not items:
+        return []
+
+    pool = ThreadPool(max(min(jobs, len(items)), 1))
+    try:
+        return list(pool.imap_unordered(_run, items))
+    finally:
+        pool.close()
+        pool.join()
+
+
 @contextlib.contextmanager
 def cd(path):
     """
@@ -75,20 +257,77 @@ def cd(path):
         os.chdir(oldPath)
 
 
+# lines written by timestamp are buffered per thread while running
+# operations on many boxes at the same time, see buffered_timestamps
+_timestamp_buffers = threading.local()
+_timestamp_lock = threading.Lock()
+
+
 def timestamp(text, **kwargs):
     """
     Writes text with a timestamp
     :param text:
     :return:
     """
+    buf = getattr(_timestamp_buffers, 'lines', None)
     for line in text.split('\n'):
         # TODO: something we could do is detect the last ansi code on each
         # line and report it to the next line so that multiline codes
         # are not reset/lost
-        secho('[%s] ' % (now().format('HH:mm:ss')), fg='reset', nl=False)
+        prefix = '[%s] ' % (now().format('HH:mm:ss'))
+        if buf is not None:
+            buf.append((prefix, line, kwargs))
+            continue
+        secho(prefix, fg='reset', nl=False)
         secho(line, **kwargs)
 
 
+@contextlib.contextmanager
+def buffered_timestamps():
+    """
+    Buffer the lines written by timestamp in the current thread instead of
+    printing them, yields the buffer to pass to flush_timestamps
+    """
+    buf = []
+    _timestamp_buffers.lines = buf
+    try:
+        yield buf
+    finally:
+        _timestamp_buffers.lines = None
+
+
+def flush_timestamps(buf, title=None):
+    """
+    Print buffered lines in one block, without interleaving them with the
+    lines flushed by other threads
+
+    :param buf: list
+    :param title: str Printed before the lines
+    """
+    if not buf:
+        return
+    with _timestamp_lock:
+        if title:
+            secho(title, bold=True)
+        for prefix, line, kwargs in buf:
+            secho(prefix, fg='reset', nl=False)
+            secho(line, **kwargs)
+
+
+def human_size(size):
+    """
+    Format a number of bytes, eg. 1.5MB
+
+    :param size: int|float
+    :return: str
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if size < 1024:
+            return '%.1f%s' % (size, unit)
+        size /= 1024.0
+    return '%.1fTB' % size
+
+
 @memoized
 def jinja_env(package_name='aeriscloud', package_path='templates'):
     return Environment(loader=PackageLoader(package_name, package_path))
@@ -152,3 +391,27 @@ def local_ip():
         ][0].split(' ')[1]
 
     return None
+
+
+def wait_for_port(host, port, timeout):
+    """
+    Wait until a TCP connection can be established to the given host and
+    port, or timeout seconds elapsed
+
+    :param host: str
+    :param port: int
+    :param timeout: float
+    :return: bool
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            sock = socket.create_connection(
+                (host, port), max(deadline - time.time(), 0.1))
+            sock.close()
+            return True
+        except (socket.error, socket.timeout):
+            if time.time() >= deadline:
+                return False
+            # connection refused, the service is not started yet
+            time.sleep(min(0.5, max(deadline - time.time(), 0)))
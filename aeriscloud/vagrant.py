@@ -2,21 +2,43 @@ from __future__ import print_function
 
 import json
 import os
-import platform
 import re
 import six
+import tempfile
+import threading
+import time
 
 from subprocess32 import call, Popen, PIPE
 
+from .agent import agent_enabled, agent_port, agent_token
 from .ansible import ansible_env
-from .config import aeriscloud_path, data_dir, verbosity, default_organization
+from .cache import FileCache, file_mtime
+from .config import aeriscloud_path, data_dir, verbosity, \
+    default_organization, ssh_cipher, ssh_compression, force_vagrant
+from .disk import disks_dir
 from .log import get_logger
 from .organization import Organization
-from .utils import timestamp, cd
+from .sshpool import pool as ssh_pool, SSHConnectionError
+from .utils import timestamp
+from .vagrantevents import VagrantRun, machine_readable
+from .virtualbox import backend, vm_info_all, vm_start, vm_suspend, \
+    vm_poweroff, invalidate_vm, InvalidState, VMNotFound
+from .virtualbox_xml import settings_file, machine_settings
 
 logger = get_logger('vagrant')
 
 VAGRANT_DATA_FOLDER = os.path.join(os.getenv('HOME'), '.vagrant.d')
+INSECURE_PRIVATE_KEY = os.path.join(VAGRANT_DATA_FOLDER,
+                                    'insecure_private_key')
+
+# how long a plain halt waits for the guest to shut down before powering
+# off the VM, like the vagrant graceful_halt_timeout
+HALT_TIMEOUT = 60
+
+# /etc/exports is fixed before every vagrant run, which might happen
+# concurrently when operating on many boxes
+_nfs_lock = threading.Lock()
+_nfs_cache = FileCache('nfs')
 
 
 class Machine(object):
@@ -48,42 +70,137 @@ class Machine(object):
 
         if not self._uuid:
             with open(id_file) as fd:
-                self._uuid = fd.read()
+                self._uuid = fd.read().strip()
         return self._uuid
 
 
 class MachineIndex(object):
+    """
+    Index of the machines known to vagrant, shared by every instance and
+    reloaded whenever vagrant writes the index file. Lookups by UUID read
+    the id file of every machine once per reload.
+    """
     machines = {}
     machine_index_file = os.path.join(VAGRANT_DATA_FOLDER, 'data',
                                       'machine-index', 'index')
 
-    def __init__(self):
-        if MachineIndex.machines:
-            return
+    _lock = threading.Lock()
+    _mtime = None
+    _by_name = {}
+    _by_path = {}
+    _by_vagrantfile = {}
+    _by_folder = {}
+    _by_uuid = None
 
-        with open(MachineIndex.machine_index_file) as fd:
-            machine_index = json.load(fd)
-            machines = machine_index.get('machines', {})
-            for mid, json_data in six.iteritems(machines):
-                MachineIndex.machines[mid] = Machine(mid, json_data)
+    def __init__(self):
+        MachineIndex.reload()
+
+    @classmethod
+    def reload(cls, force=False):
+        """
+        Load the index file if it changed since it was last loaded, raises
+        IOError or ValueError if it cannot be read
+
+        :param force: bool Load the file even if it did not change
+        """
+        with cls._lock:
+            mtime = file_mtime(cls.machine_index_file)
+            if not force and mtime is not None and mtime == cls._mtime:
+                return
+
+            with open(cls.machine_index_file) as fd:
+                machine_index = json.load(fd)
+
+            machines = {}
+            by_name, by_path, by_vagrantfile, by_folder = {}, {}, {}, {}
+            for mid, json_data in six.iteritems(
+                    machine_index.get('machines', {})):
+                machine = Machine(mid, json_data)
+                machines[mid] = machine
+
+                by_name.setdefault(machine.name, []).append(machine)
+                by_vagrantfile.setdefault(
+                    os.path.normpath(machine.vagrantfile), []).append(machine)
+                if machine.vagrant_path:
+                    vagrant_path = os.path.normpath(machine.vagrant_path)
+                    by_path[(vagrant_path, machine.name)] = machine
+                    by_folder.setdefault(os.path.dirname(vagrant_path),
+                                         []).append(machine)
+
+            cls.machines = machines
+            cls._by_name = by_name
+            cls._by_path = by_path
+            cls._by_vagrantfile = by_vagrantfile
+            cls._by_folder = by_folder
+            cls._by_uuid = None
+            cls._mtime = mtime
 
     def get(self, mid):
         return MachineIndex.machines.get(mid)
 
     def get_by_name(self, name):
-        for machine in MachineIndex.machines.values():
-            if machine.name == name:
-                return machine
-        return None
+        """
+        Return the first machine with the given name, machine names are only
+        unique within a project (see get_by_path)
+
+        :param name: str
+        :return: Machine|None
+        """
+        machines = MachineIndex._by_name.get(name)
+        return machines and machines[0] or None
+
+    def get_by_path(self, vagrant_path, name):
+        """
+        Return the machine with the given name in the given .vagrant folder,
+        machine names are only unique within a project
+
+        :param vagrant_path: str
+        :param name: str
+        :return: Machine|None
+        """
+        return MachineIndex._by_path.get((os.path.normpath(vagrant_path),
+                                          name))
+
+    def get_by_vagrantfile(self, vagrantfile):
+        """
+        :param vagrantfile: str Path to a Vagrantfile
+        :return: list[Machine]
+        """
+        return list(MachineIndex._by_vagrantfile.get(
+            os.path.normpath(vagrantfile), []))
+
+    def get_by_folder(self, folder):
+        """
+        Return the machines of the project in the given folder, that is
+        whose .vagrant folder is in it
+
+        :param folder: str
+        :return: list[Machine]
+        """
+        return list(MachineIndex._by_folder.get(os.path.normpath(folder),
+                                                []))
 
     def get_by_uuid(self, uuid):
-        for machine in MachineIndex.machines.values():
-            if machine.uuid == uuid:
-                return machine
-        return None
+        by_uuid = MachineIndex._by_uuid
+        if by_uuid is None:
+            machines = MachineIndex.machines
+            by_uuid = dict((machine.uuid, machine)
+                           for machine in machines.values()
+                           if machine.uuid)
+            with MachineIndex._lock:
+                # do not keep the UUIDs of an index reloaded meanwhile
+                if MachineIndex.machines is machines:
+                    MachineIndex._by_uuid = by_uuid
+        return by_uuid.get(uuid.strip())
 
 
 class NFS(object):
+    """
+    Reconciles the NFS exports vagrant writes for our boxes with the
+    folders that still exist. The parsed exports are cached by the mtime,
+    inode and size of the exports file, which is only checked again once
+    it changed.
+    """
     nfs_exports = '/etc/exports'
     re_exports_headers = re.compile(
         r'^# VAGRANT-(?P<type>BEGIN|END):(?P<uid> [0-9]+) '
@@ -94,9 +211,20 @@ class NFS(object):
         self.exports = {}
         self.export_file = export_file
 
-        self.parse_exports()
+    def _key(self):
+        try:
+            st = os.stat(self.export_file)
+        except OSError:
+            return None
+        return [st.st_mtime, st.st_ino, st.st_size]
+
+    def _ours(self, match):
+        # ignore uids that are not ours
+        return not match.group('uid') or \
+            int(match.group('uid').strip()) == os.getuid()
 
     def parse_exports(self):
+        self.exports = {}
         if not os.path.exists(self.export_file):
             return
 
@@ -108,14 +236,13 @@ class NFS(object):
                 if match:
                     # store exports
                     if match.group('type') == 'END':
-                        self.exports[current_uuid] = current_exports
+                        if current_uuid:
+                            self.exports[current_uuid] = current_exports
                         current_uuid = None
                         current_exports = []
                         continue
 
-                    # ignore uids that are not ours
-                    if match.group('uid') and \
-                            int(match.group('uid').strip()) != os.getuid():
+                    if not self._ours(match):
                         continue
 
                     current_uuid = match.group('uuid')
@@ -126,52 +253,57 @@ class NFS(object):
                     export_path = path_match.group(0).strip('"')
                     current_exports.append(export_path)
 
-    def fix_anomalies(self):
-        to_prune = []
+    def stale_exports(self):
+        """
+        Return the UUIDs of the exports with a folder that does not exist
+        anymore
 
-        # machine_index = MachineIndex()
-        for uuid, exports in six.iteritems(self.exports):
-            # machine = machine_index.get_by_uuid(uuid)
-            # machine cannot be found in the index
-            # if not machine:
-            #    to_prune.append(uuid)
-            #    continue
+        :return: list[str]
+        """
+        return sorted([uuid for uuid, exports in six.iteritems(self.exports)
+                       if [path for path in exports
+                           if not os.path.exists(path)]])
 
-            # one of the path does not exists anymore
-            if [path for path in exports if not os.path.exists(path)]:
-                to_prune.append(uuid)
-                continue
-
-        # remove all exports that have issues
-        for uuid in to_prune:
+    def _without(self, uuids):
+        lines = []
+        skipping = False
+        with open(self.export_file) as fd:
+            for line in fd:
+                match = NFS.re_exports_headers.match(line.strip())
+                if match and match.group('uuid') in uuids and \
+                        self._ours(match):
+                    skipping = match.group('type') == 'BEGIN'
+                    continue
+                if not skipping:
+                    lines.append(line)
+        return ''.join(lines)
+
+    def prune(self, uuids):
+        """
+        Remove the exports of the given UUIDs, the exports file is rewritten
+        once and atomically replaced
+
+        :param uuids: list[str]
+        """
+        for uuid in uuids:
             logger.info('pruning NFS entry for %s' % uuid)
 
-            # taken from vagrant/plugins/hosts/linux/cap/nfs.rb
-            extended_re_flag = '-r'
-            sed_expr = '\\\x01^# VAGRANT-BEGIN:( {user})? {id}\x01,' \
-                       '\\\x01^# VAGRANT-END:( {user})? {id}\x01 d'.format(
-                           id=uuid,
-                           user=os.getuid()
-                       )
-            if platform.system() == 'Darwin':
-                extended_re_flag = '-E'
-                sed_expr = '/^# VAGRANT-BEGIN:( {user})? {id}/,' \
-                           '/^# VAGRANT-END:( {user})? {id}/ d'.format(
-                               id=uuid,
-                               user=os.getuid()
-                           )
+        fd, tmp_file = tempfile.mkstemp(prefix='aeriscloud-exports')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(self._without(set(uuids)))
 
+            # the copy keeps the permissions of the exports file and is
+            # renamed over it so that nfsd never reads a partial file
             cmd = [
-                'sed',
-                extended_re_flag,
-                '-e',
-                sed_expr,
-                '-ibak',
-                self.export_file
+                'sh', '-c',
+                'cp -p "$2" "$2.aeriscloud" && cat "$1" > "$2.aeriscloud" '
+                '&& mv "$2.aeriscloud" "$2"',
+                'sh', tmp_file, self.export_file
             ]
 
             # if we do not have write access, use sudo
-            if not os.access(self.export_file, os.W_OK):
+            if not os.access(os.path.dirname(self.export_file), os.W_OK):
                 cmd = [
                     'sudo',
                     '-p'
@@ -182,7 +314,275 @@ class NFS(object):
 
             if call(cmd) != 0:
                 raise RuntimeError('could not prune invalid nfs exports '
-                                   '"%s" from /etc/exports' % uuid)
+                                   '"%s" from %s' % ('", "'.join(uuids),
+                                                     self.export_file))
+        finally:
+            os.remove(tmp_file)
+
+    def reconcile(self, force=False, dry_run=False):
+        """
+        Prune the exports with missing folders, nothing is done if the
+        exports file did not change since it was last reconciled
+
+        :param force: bool Check the exports even if the file did not change
+        :param dry_run: bool Only return the stale exports
+        :return: list[str] The UUIDs of the stale exports
+        """
+        key = self._key()
+        if key is None:
+            return []
+
+        cached = _nfs_cache.get(self.export_file)
+        if cached and cached['key'] == key and not force:
+            self.exports = cached['exports']
+            return []
+
+        self.parse_exports()
+        stale = self.stale_exports()
+        if dry_run:
+            return stale
+
+        if stale:
+            self.prune(stale)
+            self.parse_exports()
+        _nfs_cache.set(self.export_file, {'key': self._key(),
+                                          'exports': self.exports})
+        return stale
+
+
+class FastMachine(object):
+    """
+    A vagrant machine operated without vagrant, from the machine index, its
+    data under .vagrant/machines and the VirtualBox settings of its VM
+    """
+
+    def __init__(self, name, machine, settings):
+        self.name = name
+        self.machine = machine
+        self.settings = settings
+
+    @classmethod
+    def find(cls, pro, name):
+        """
+        :param pro: .project.Project
+        :param name: str The name of the box
+        :return: FastMachine|None None if the VM was not created
+        """
+        machine = MachineIndex().get_by_path(pro.vagrant_dir(), name)
+        if not machine or machine.provider != 'virtualbox' or \
+                not machine.uuid:
+            return None
+
+        path = settings_file(machine.uuid)
+        settings = path and machine_settings(path)
+        if not settings or not settings['name']:
+            return None
+        return cls(name, machine, settings)
+
+    def vm_name(self):
+        return self.settings['name']
+
+    def state(self):
+        info = vm_info_all().get(self.vm_name(), {})
+        return info.get('VMState', 'poweroff').strip('"')
+
+    def ssh_port(self):
+        forward = self.settings['forwards'].get('ssh')
+        return forward and int(forward['host_port']) or None
+
+    def private_key(self):
+        key = os.path.join(self.machine.data_path, 'private_key')
+        if os.path.exists(key):
+            return key
+        return INSECURE_PRIVATE_KEY
+
+    def _echo(self, message):
+        timestamp('==> %s: %s' % (self.name, message))
+
+    def ssh_config(self):
+        if self.state() != 'running' or not self.ssh_port():
+            return None
+
+        for line in ['Host %s' % self.name,
+                     '  HostName 127.0.0.1',
+                     '  User vagrant',
+                     '  Port %d' % self.ssh_port(),
+                     '  UserKnownHostsFile /dev/null',
+                     '  StrictHostKeyChecking no',
+                     '  PasswordAuthentication no',
+                     '  IdentityFile %s' % self.private_key(),
+                     '  IdentitiesOnly yes',
+                     '  LogLevel FATAL']:
+            print(line)
+        return 0
+
+    def suspend(self):
+        state = self.state()
+        if state == 'saved':
+            return 0
+        if state not in ('running', 'paused'):
+            return None
+
+        self._echo('Saving VM state and suspending execution...')
+        vm_suspend(self.vm_name())
+        return 0
+
+    def resume(self):
+        if self.state() != 'saved':
+            return None
+
+        self._echo('Resuming suspended VM...')
+        vm_start(self.vm_name())
+        return 0
+
+    def halt(self):
+        state = self.state()
+        if state in ('poweroff', 'aborted'):
+            return 0
+        if state != 'running':
+            return None
+
+        self._echo('Attempting graceful shutdown of VM...')
+        if self.ssh_port():
+            try:
+                ssh_pool.run('127.0.0.1', 'vagrant', self.private_key(),
+                             'sudo shutdown -h now', port=self.ssh_port(),
+                             timeout=10)
+            except SSHConnectionError as e:
+                # the connection is closed as the guest goes down
+                logger.debug(str(e))
+            ssh_pool.close('127.0.0.1', self.ssh_port())
+
+        deadline = time.time() + HALT_TIMEOUT
+        while self.vm_name() in backend().list_vms(True):
+            if time.time() > deadline:
+                self._echo('Forcing shutdown of VM...')
+                vm_poweroff(self.vm_name())
+                break
+            time.sleep(1)
+        invalidate_vm(self.vm_name())
+        return 0
+
+
+FAST_COMMANDS = ['status', 'ssh-config', 'suspend', 'resume', 'halt']
+
+
+def _fast_status(pro, names):
+    timestamp('Current machine states:')
+    timestamp('')
+    for name in names or [box.name() for box in pro.boxes()]:
+        machine = FastMachine.find(pro, name)
+        state = machine and machine.state() or 'not created'
+        timestamp('%-25s %s (virtualbox)' % (name, state))
+    return 0
+
+
+def fast_run(pro, *args):
+    """
+    Run the given vagrant command without vagrant when possible: status
+    and ssh-config are answered and suspend, resume and halt are done
+    through VirtualBox, saving the startup of vagrant. Creating,
+    provisioning and destroying boxes is left to vagrant, as well as any
+    command with options.
+
+    :param pro: .project.Project
+    :param args: list[string]
+    :return: int|None The exit code, None if vagrant has to run the command
+    """
+    if force_vagrant() or not args or args[0] not in FAST_COMMANDS or \
+            [arg for arg in args[1:] if arg.startswith('-')]:
+        return None
+
+    try:
+        if args[0] == 'status':
+            return _fast_status(pro, args[1:])
+
+        # commands on many machines are rare, leave them to vagrant
+        if len(args) != 2:
+            return None
+
+        machine = FastMachine.find(pro, args[1])
+        if not machine:
+            return None
+        return getattr(machine, args[0].replace('-', '_'))()
+    except (IOError, ValueError) as e:
+        logger.debug('could not read the state of the machine: %s', e)
+        return None
+    except (InvalidState, VMNotFound) as e:
+        logger.debug('letting vagrant handle %s: %s', args[0], e)
+        return None
+
+
+def _vagrant_env(pro):
+    """
+    Return the environment vagrant is ran with for the given project
+
+    :param pro: .project.Project
+    :return: dict[str,str]
+    """
+    new_env = ansible_env(os.environ.copy())
+
+    new_env['PATH'] = os.pathsep.join([
+        new_env['PATH'],
+        os.path.join(aeriscloud_path, 'venv/bin')
+    ])
+    new_env['VAGRANT_DOTFILE_PATH'] = pro.vagrant_dir()
+    new_env['VAGRANT_CWD'] = pro.vagrant_working_dir()
+    new_env['VAGRANT_DISKS_PATH'] = disks_dir()
+    new_env['AERISCLOUD_SSH_COMPRESSION'] = ssh_compression()
+    if ssh_cipher():
+        new_env['AERISCLOUD_SSH_CIPHER'] = ssh_cipher()
+    if agent_enabled():
+        new_env['AERISCLOUD_AGENT_TOKEN'] = agent_token()
+        new_env['AERISCLOUD_AGENT_PORT'] = str(agent_port())
+
+    # We might want to remove that or bump the verbosity level even more
+    if verbosity() >= 4:
+        new_env['VAGRANT_LOG'] = 'info'
+
+    new_env['AERISCLOUD_PATH'] = aeriscloud_path
+    new_env['AERISCLOUD_ORGANIZATIONS_DIR'] = os.path.join(data_dir(),
+                                                           'organizations')
+
+    org = default_organization()
+    if org:
+        new_env['AERISCLOUD_DEFAULT_ORGANIZATION'] = org
+
+    organization_name = pro.organization()
+    if organization_name:
+        organization = Organization(organization_name)
+    else:
+        organization = Organization(org)
+
+    basebox_url = organization.basebox_url()
+    if basebox_url:
+        new_env['VAGRANT_SERVER_URL'] = basebox_url
+
+    return new_env
+
+
+def _stream(args, vagrant_run, **kwargs):
+    """
+    Run vagrant, printing its output with timestamps as it comes, through
+    vagrant_run when its output is machine readable
+
+    :param args: list[str]
+    :param vagrant_run: .vagrantevents.VagrantRun|None
+    :param kwargs: dict[string,string] Passed to Popen
+    :return: int
+    """
+    process = Popen(args, stdout=PIPE, bufsize=1, **kwargs)
+    for line in iter(process.stdout.readline, b''):
+        if not vagrant_run:
+            timestamp(line[:-1])
+            continue
+        for output in vagrant_run.feed(line):
+            timestamp(output)
+    # empty output buffers
+    process.wait()
+    if vagrant_run:
+        vagrant_run.finish(process.returncode)
+    return process.returncode
 
 
 def run(pro, *args, **kwargs):
@@ -193,56 +593,36 @@ def run(pro, *args, **kwargs):
     :param kwargs: dict[string,string]
     :return:
     """
-    with cd(pro.folder()):
-        # fix invalid exports for vagrant
-        NFS().fix_anomalies()
-
-        new_env = ansible_env(os.environ.copy())
-
-        new_env['PATH'] = os.pathsep.join([
-            new_env['PATH'],
-            os.path.join(aeriscloud_path, 'venv/bin')
-        ])
-        new_env['VAGRANT_DOTFILE_PATH'] = pro.vagrant_dir()
-        new_env['VAGRANT_CWD'] = pro.vagrant_working_dir()
-        new_env['VAGRANT_DISKS_PATH'] = os.path.join(data_dir(), 'disks')
-
-        # We might want to remove that or bump the verbosity level even more
-        if verbosity() >= 4:
-            new_env['VAGRANT_LOG'] = 'info'
-
-        new_env['AERISCLOUD_PATH'] = aeriscloud_path
-        new_env['AERISCLOUD_ORGANIZATIONS_DIR'] = os.path.join(data_dir(),
-                                                               'organizations')
-
-        org = default_organization()
-        if org:
-            new_env['AERISCLOUD_DEFAULT_ORGANIZATION'] = org
-
-        organization_name = pro.organization()
-        if organization_name:
-            organization = Organization(organization_name)
-        else:
-            organization = Organization(org)
-
-        basebox_url = organization.basebox_url()
-        if basebox_url:
-            new_env['VAGRANT_SERVER_URL'] = basebox_url
+    res = fast_run(pro, *args)
+    if res is not None:
+        return res
 
+    # boxes can be started from several threads, the working directory
+    # is given to the process rather than changed for the whole program
+    kwargs.setdefault('cwd', pro.folder())
+    # fix invalid exports for vagrant
+    with _nfs_lock:
+        NFS().reconcile()
+
+    new_env = _vagrant_env(pro)
+
+    command = args and args[0] or None
+    box = len(args) > 1 and not args[-1].startswith('-') and args[-1] or None
+
+    # support for the vagrant prompt
+    if command == 'destroy':
         args = ['vagrant'] + list(args)
         logger.debug('running: %s\nenv: %r', ' '.join(args), new_env)
+        return call(args, env=new_env, **kwargs)
+
+    vagrant_run = None
+    if machine_readable():
+        vagrant_run = VagrantRun(pro.name(), box, command)
+        args = ['--machine-readable'] + list(args)
 
-        # support for the vagrant prompt
-        if args[1] == 'destroy':
-            return call(args, env=new_env, **kwargs)
-        else:
-            process = Popen(args, env=new_env, stdout=PIPE,
-                            bufsize=1, **kwargs)
-            for line in iter(process.stdout.readline, b''):
-                timestamp(line[:-1])
-            # empty output buffers
-            process.poll()
-            return process.returncode
+    args = ['vagrant'] + list(args)
+    logger.debug('running: %s\nenv: %r', ' '.join(args), new_env)
+    return _stream(args, vagrant_run, env=new_env, **kwargs)
 
 
 def version():
@@ -0,0 +1,296 @@
+"""
+Parsing of the vagrant --machine-readable output. Events are rendered like
+the human output of vagrant, the time spent in each phase of a run
+(importing the box, booting, waiting for ssh, NFS, provisioners) is measured
+and every event is appended to a JSONL log so that boot times can be
+compared across hosts and over time.
+"""
+
+import binascii
+import collections
+import json
+import os
+import re
+import socket
+import threading
+import time
+
+from .config import config, data_dir
+from .log import get_logger
+
+logger = get_logger('vagrant.events')
+
+# the log is rotated once it reaches this size
+MAX_LOG_SIZE = 10 * 1024 * 1024
+
+# timings of the last vagrant runs of this process, most recent last
+runs = collections.deque(maxlen=50)
+
+_log_lock = threading.Lock()
+
+# matched against the ui messages, the first message of a phase starts it
+_PHASES = [
+    ('import', re.compile(r'^(Importing base box|Cloning VM|Matching MAC)')),
+    ('configure', re.compile(r'^(Clearing any previously set|Preparing '
+                             r"network|Forwarding ports|Running 'pre-boot)")),
+    ('boot', re.compile(r'^Booting VM')),
+    ('ssh', re.compile(r'^Waiting for machine to boot')),
+    ('guest', re.compile(r'^Machine booted and ready')),
+    ('nfs', re.compile(r'^(Preparing to edit /etc/exports|Exporting NFS|'
+                       r'Mounting NFS)')),
+    ('provision', re.compile(r'^Running provisioner: (?P<name>[\w-]+)')),
+]
+
+
+def machine_readable(val=None):
+    """
+    Whether vagrant is ran with --machine-readable so that its output can
+    be timed and logged, off by default as vagrant then drops the colors of
+    its output and cannot prompt
+
+    :param val: bool
+    :return: bool
+    """
+    if val is not None:
+        machine_readable.val = val
+    if not hasattr(machine_readable, 'val'):
+        machine_readable.val = config.get('vagrant', 'machine_readable',
+                                          default='false') == 'true'
+    return machine_readable.val
+
+
+def log_file():
+    return os.path.join(data_dir(), 'logs', 'vagrant-events.jsonl')
+
+
+def _unescape(value):
+    return value.replace('%!(VAGRANT_COMMA)', ',') \
+        .replace('\\n', '\n').replace('\\r', '\r')
+
+
+class VagrantEvent(object):
+    """
+    A line of the vagrant --machine-readable output
+
+    :param timestamp: int
+    :param target: str The machine the event is about, empty for global ones
+    :param type: str
+    :param data: list[str]
+    """
+
+    def __init__(self, timestamp, target, type, data):
+        self.timestamp = timestamp
+        self.target = target
+        self.type = type
+        self.data = data
+
+    def message(self):
+        """
+        Return the message of ui and error events
+
+        :return: str|None
+        """
+        if self.type in ('ui', 'error-exit') and len(self.data) > 1:
+            return self.data[1]
+        return None
+
+    def to_dict(self):
+        return {
+            'timestamp': self.timestamp,
+            'target': self.target,
+            'type': self.type,
+            'data': self.data
+        }
+
+
+def parse_line(line):
+    """
+    Parse a line of the vagrant --machine-readable output
+
+    :param line: str
+    :return: VagrantEvent|None None if the line is not an event
+    """
+    fields = line.rstrip('\r\n').split(',')
+    if len(fields) < 3 or not fields[0].isdigit():
+        return None
+    return VagrantEvent(int(fields[0]), fields[1], fields[2],
+                        [_unescape(field) for field in fields[3:]])
+
+
+def render(event):
+    """
+    Return the lines vagrant prints for the given event in its human output
+
+    :param event: VagrantEvent
+    :return: list[str]
+    """
+    message = event.message()
+    if message is None:
+        return []
+
+    # output streamed by provisioners is printed as is, unlike messages
+    # it comes in chunks ending with a new line
+    if message.endswith('\n'):
+        return message[:-1].split('\n')
+
+    prefix = ''
+    if event.target:
+        if event.type == 'ui' and event.data[0] in ('output', 'detail'):
+            prefix = '    %s: ' % event.target
+        else:
+            prefix = '==> %s: ' % event.target
+    return [prefix + line for line in message.split('\n')]
+
+
+def _phase(event):
+    message = event.message()
+    if message is None:
+        return None
+
+    for name, regex in _PHASES:
+        match = regex.match(message)
+        if match:
+            if 'name' in regex.groupindex:
+                return '%s:%s' % (name, match.group('name'))
+            return name
+    return None
+
+
+class PhaseTimer(object):
+    """
+    Measures the time spent in each phase of a vagrant run, the time
+    before the first known phase is accounted as startup. Events are timed
+    when they are received as vagrant timestamps only have a one second
+    resolution.
+    """
+
+    def __init__(self, now=None):
+        self.phases = []
+        self.current = 'startup'
+        self._since = time.time() if now is None else now
+
+    def _switch(self, name, now):
+        self.phases.append([self.current, now - self._since])
+        self.current = name
+        self._since = now
+
+    def feed(self, event, now=None):
+        """
+        :param event: VagrantEvent
+        :param now: float
+        :return: str The phase the event belongs to
+        """
+        name = _phase(event)
+        if name and name != self.current:
+            self._switch(name, time.time() if now is None else now)
+        return self.current
+
+    def finish(self, now=None):
+        """
+        :param now: float
+        :return: list[[str, float]] Every phase with its duration
+        """
+        if self.current is not None:
+            self._switch(None, time.time() if now is None else now)
+        return self.phases
+
+
+class VagrantRun(object):
+    """
+    Renders, times and logs the events of a vagrant run
+
+    :param project: str
+    :param box: str|None
+    :param command: str
+    """
+
+    def __init__(self, project, box, command):
+        self.id = binascii.hexlify(os.urandom(8))
+        self.project = project
+        self.box = box
+        self.command = command
+        self.started = time.time()
+        self.timer = PhaseTimer(self.started)
+        self._lines = []
+
+    def _record(self, data):
+        record = {
+            'run': self.id,
+            'host': socket.gethostname(),
+            'project': self.project,
+            'box': self.box,
+            'command': self.command,
+            'time': time.time()
+        }
+        record.update(data)
+        self._lines.append(json.dumps(record))
+
+    def feed(self, line):
+        """
+        Handle a line of output
+
+        :param line: str
+        :return: list[str] The lines to display
+        """
+        event = parse_line(line)
+        if not event:
+            # not every line is an event, eg. when vagrant crashes
+            return [line.rstrip('\r\n')]
+
+        phase = self.timer.feed(event)
+        data = event.to_dict()
+        data['phase'] = phase
+        self._record(data)
+        return render(event)
+
+    def finish(self, returncode):
+        """
+        Store the timings of the run and write its events to the log
+
+        :param returncode: int
+        :return: dict The timings of the run
+        """
+        timings = {
+            'run': self.id,
+            'project': self.project,
+            'box': self.box,
+            'command': self.command,
+            'returncode': returncode,
+            'total': time.time() - self.started,
+            'phases': self.timer.finish()
+        }
+        runs.append(timings)
+
+        self._record({'type': 'timings', 'returncode': returncode,
+                      'total': timings['total'],
+                      'phases': timings['phases']})
+        try:
+            _write_log(self._lines)
+        except (IOError, OSError) as e:
+            logger.warn('could not write the vagrant events log: %s', e)
+        return timings
+
+
+def _write_log(lines):
+    path = log_file()
+    with _log_lock:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        if os.path.exists(path) and os.path.getsize(path) > MAX_LOG_SIZE:
+            os.rename(path, path + '.1')
+        with open(path, 'a') as fd:
+            fd.write(''.join('%s\n' % line for line in lines))
+
+
+def recent_runs(project, box=None):
+    """
+    Return the timings of the vagrant runs of this process on the given
+    project or box
+
+    :param project: str
+    :param box: str
+    :return: list[dict]
+    """
+    return [timings for timings in list(runs)
+            if timings['project'] == project and
+            (box is None or timings['box'] == box)]
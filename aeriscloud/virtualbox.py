@@ -1,12 +1,24 @@
 """
 This module encapsulate VirtualBox commands in an easy to use set of commands
+
+The actual work is done by a backend, by default the in-process VirtualBox
+API (vboxapi) is used when available, falling back to VBoxManage calls
+otherwise. See the virtualbox.backend configuration option.
 """
 
-from sh import Command, CommandNotFound, ErrorReturnCode_1
+from platform import system
+from sh import Command, CommandNotFound, ErrorReturnCode, ErrorReturnCode_1
+import os
 import re
+import time
 
+from .cache import FileCache, file_mtime
+from .config import config
+from .log import get_logger
 from .utils import memoized
 
+logger = get_logger('virtualbox')
+
 
 class VMNotFound(Exception):
     """
@@ -32,6 +44,11 @@ class InvalidState(Exception):
     pass
 
 _vbm = None
+_backend = None
+
+# persistent cache shared between aeris invocations, entries are validated
+# against the mtime of VirtualBox.xml and of the VMs .vbox files
+_cache = FileCache('virtualbox')
 
 
 def VBoxManage(*args, **kwargs):
@@ -41,41 +58,160 @@ def VBoxManage(*args, **kwargs):
     return _vbm(*args, **kwargs)
 
 
-@memoized
-def list_vms(running=False):
+def settings_dir():
     """
-    Return the list of VM in for the form name => uuid, when the running bool
-    is set to true, only return running VMs
-    :param running: bool
+    Return the folder where VirtualBox stores its global settings
+
+    :return: str
+    """
+    if os.getenv('VBOX_USER_HOME'):
+        return os.getenv('VBOX_USER_HOME')
+
+    home = os.path.expanduser('~')
+    if system() == 'Darwin':
+        return os.path.join(home, 'Library', 'VirtualBox')
+
+    # VirtualBox keeps using the legacy folder if it exists
+    if os.path.isdir(os.path.join(home, '.VirtualBox')):
+        return os.path.join(home, '.VirtualBox')
+
+    return os.path.join(os.getenv('XDG_CONFIG_HOME',
+                                  os.path.join(home, '.config')),
+                        'VirtualBox')
+
+
+def global_settings_file():
+    return os.path.join(settings_dir(), 'VirtualBox.xml')
+
+
+def cache_ttl():
+    """
+    How long in seconds runtime information such as VM states and guest
+    properties are kept in the persistent cache
+
+    :return: float
+    """
+    return float(config.get('virtualbox', 'cache_ttl', default=30))
+
+
+def _settings_mtimes(vms):
+    """
+    Return the mtimes of VirtualBox.xml and of the settings file of every
+    given VM
+
+    :param vms: dict[str,dict[str,str]]
+    :return: dict[str,float]
+    """
+    files = [global_settings_file()] + [info['CfgFile'].strip('"')
+                                        for info in vms.values()
+                                        if 'CfgFile' in info]
+    return dict([(path, file_mtime(path)) for path in files])
+
+
+def _cache_get(key, ttl=None):
+    """
+    Retrieve an entry from the persistent cache, provided none of the
+    VirtualBox settings files it depends on changed since it was stored
+    """
+    if not backend().cacheable:
+        return None
+
+    entry = _cache.get(key, ttl=ttl)
+    if not entry:
+        return None
+    for path, mtime in entry['mtimes'].iteritems():
+        if file_mtime(path) != mtime:
+            return None
+    return entry['value']
+
+
+def _cache_set(key, value, vms):
+    if not backend().cacheable:
+        return
+    _cache.set(key, {'mtimes': _settings_mtimes(vms), 'value': value})
+
+
+def clear_cache():
+    """
+    Drop every cached VirtualBox information, both in memory and on disk
+    """
+    list_vms.clear()
+    vm_info_all.clear()
+    vm_info.clear()
+    guest_properties.clear()
+    _cache.clear()
+
+
+def invalidate_vm(name):
+    """
+    Drop the cached information about the given VM, both in memory and on
+    disk, while keeping the cache of other VMs. As the VM list and the
+    bulk snapshot cover every VMs, those are dropped as well.
+
+    :param name: str
+    """
+    list_vms.clear()
+    vm_info_all.clear()
+    vm_info.invalidate(name)
+    guest_properties.invalidate_prefix(name)
+    _cache.delete('vms')
+    _cache.delete('info:%s' % name)
+    _cache.delete_prefix('guest:%s:' % name)
+
+
+_LIST_PARSER = re.compile(r'"(?P<name>[^"]+)" \{(?P<uuid>[^\}]+)\}')
+_INFO_PARSER = re.compile(
+    r'^("(?P<quoted_key>[^"]+)"|(?P<key>[^=]+))=(?P<value>.*)$')
+
+
+def _parse_list(lines):
+    """
+    Parse the output of "VBoxManage list vms" in the form name => uuid
+
+    :param lines: iterable[str]
     :return: dict[str,str]
     """
-    try:
-        LIST_PARSER = re.compile(r'"(?P<name>[^"]+)" \{(?P<uuid>[^\}]+)\}')
-        vms = {}
-        list = running and 'runningvms' or 'vms'
-        for line in VBoxManage('list', list, _iter=True):
-            res = re.match(LIST_PARSER, line)
-            if res:
-                vms[res.group('name')] = res.group('uuid')
-        return vms
-    except CommandNotFound:
-        return {}
+    vms = {}
+    for line in lines:
+        res = re.match(_LIST_PARSER, line)
+        if res:
+            vms[res.group('name')] = res.group('uuid')
+    return vms
 
 
-@memoized
-def list_hdds():
+def _parse_vm_info(lines):
     """
-    Return the list of HDDs in for the form
-    uuid => {state, type, location, format, cap}
+    Parse the output of "VBoxManage showvminfo --machinereadable"
+
+    :param lines: iterable[str]
+    :return: dict[str,str]
+    """
+    info = {}
+    for line in lines:
+        matches = re.match(_INFO_PARSER, line)
+        if matches:
+            key = matches.group('key') or matches.group('quoted_key')
+            value = matches.group('value')
+
+            if key and value:
+                info[key] = value
+    return info
+
+
+def _parse_hdds(lines):
+    """
+    Parse the output of "VBoxManage list hdds"
+
+    :param lines: iterable[str]
     :return: dict[str,dict[str,str]]
     """
     hdds = {}
     uuid = None
-    for line in VBoxManage('list', 'hdds', _iter=True):
+    for line in lines:
         if not line.strip():
             continue
 
-        key, val = line.strip().split(':')
+        key, val = line.strip().split(':', 1)
         val = val.strip()
 
         if key == 'UUID':
@@ -87,67 +223,695 @@ def list_hdds():
     return hdds
 
 
+def _parse_hdd_info(lines):
+    """
+    Parse the output of "VBoxManage showhdinfo"
+
+    :param lines: iterable[str]
+    :return: dict[str,str]
+    """
+    info = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        key, val = line.strip().split(':', 1)
+        info[key] = val.strip()
+    return info
+
+
+# human readable states from "list -l vms" that do not map directly to
+# the --machinereadable ones
+_HUMAN_STATES = {
+    'powered off': 'poweroff',
+    'guru meditation': 'gurumeditation',
+    'teleporting (incoming)': 'teleportingin',
+    'deleting snapshot live': 'deletingsnapshotlive',
+    'deleting snapshot live paused': 'deletingsnapshotlivepaused',
+}
+
+_LIST_LONG_VM = re.compile(r"^Name:\s+(?P<name>[^'\s].*)$")
+_LIST_LONG_FIELD = re.compile(r'^(?P<key>[A-Z][^:]+):\s*(?P<value>.*)$')
+_LIST_LONG_STATE = re.compile(r'^(?P<state>.+?)(?: \(since (?P<since>.+)\))?$')
+_LIST_LONG_NIC = re.compile(r'^NIC (?P<id>\d+)$')
+_LIST_LONG_RULE = re.compile(r'^NIC (?P<id>\d+) Rule\(\d+\)$')
+
+
+def _parse_nic(info, nic_id, value):
+    """
+    Parse a "NIC x:" line from "list -l vms" and store it using the same keys
+    as showvminfo --machinereadable
+    """
+    if value == 'disabled':
+        info['nic%s' % nic_id] = 'none'
+        return
+
+    fields = dict([
+        (field.split(':', 1)[0].strip(), field.split(':', 1)[1].strip())
+        for field in value.split(', ') if ':' in field
+    ])
+    attachment = fields.get('Attachment', '')
+    if 'MAC' in fields:
+        info['macaddress%s' % nic_id] = fields['MAC']
+
+    if attachment == 'NAT':
+        info['nic%s' % nic_id] = 'nat'
+    elif attachment.startswith('Host-only Interface'):
+        info['nic%s' % nic_id] = 'hostonly'
+        info['hostonlyadapter%s' % nic_id] = attachment[21:-1]
+    elif attachment.startswith('Bridged Interface'):
+        info['nic%s' % nic_id] = 'bridged'
+        info['bridgeadapter%s' % nic_id] = attachment[19:-1]
+    else:
+        info['nic%s' % nic_id] = attachment.lower() or 'none'
+
+
+def _parse_rule(value):
+    """
+    Convert a NAT rule from "list -l vms" to the comma separated format used
+    by showvminfo --machinereadable:
+    name,protocol,host ip,host port,guest ip,guest port
+    """
+    fields = dict([
+        (field.split('=', 1)[0].strip(), field.split('=', 1)[1].strip())
+        for field in value.split(', ') if '=' in field
+    ])
+    return ','.join([fields.get(key, '') for key in [
+        'name', 'protocol', 'host ip', 'host port', 'guest ip', 'guest port'
+    ]])
+
+
+def _parse_field(info, key, value):
+    """
+    Store a field of a VM from "list -l vms" in info, using the keys of
+    showvminfo --machinereadable
+    """
+    if key == 'UUID' and 'UUID' not in info:
+        info['UUID'] = value
+    elif key == 'Config file':
+        info['CfgFile'] = value
+    elif key == 'Memory size':
+        info['memory'] = value.rstrip('MB')
+    elif key == 'Number of CPUs':
+        info['cpus'] = value
+    elif key == 'State':
+        state = _LIST_LONG_STATE.match(value)
+        human = state.group('state')
+        info['VMState'] = _HUMAN_STATES.get(
+            human, re.sub(r'[^a-z]', '', human))
+        if state.group('since'):
+            info['VMStateChangeTime'] = state.group('since')
+    elif _LIST_LONG_NIC.match(key):
+        _parse_nic(info, _LIST_LONG_NIC.match(key).group('id'), value)
+    elif _LIST_LONG_RULE.match(key):
+        forwards = len([name for name in info
+                        if name.startswith('Forwarding(')])
+        info['Forwarding(%d)' % forwards] = _parse_rule(value)
+
+
+def _parse_list_long(lines):
+    """
+    Parse the output of "VBoxManage list -l vms", returns a dict of
+    name => info, where info uses the same keys as showvminfo
+    --machinereadable for the fields we care about
+
+    :param lines: iterable[str]
+    :return: dict[str,dict[str,str]]
+    """
+    vms = {}
+    info = None
+    for line in lines:
+        line = line.rstrip()
+
+        match = _LIST_LONG_VM.match(line)
+        if match:
+            info = {'name': match.group('name')}
+            vms[info['name']] = info
+            continue
+
+        match = _LIST_LONG_FIELD.match(line)
+        if info and match:
+            _parse_field(info, match.group('key'),
+                         match.group('value').strip())
+
+    return vms
+
+
+GUEST_NET_PATTERN = '/VirtualBox/GuestInfo/Net/*'
+
+_GUEST_PROPERTY = re.compile(
+    r'^Name: (?P<name>[^,]+), value: (?P<value>.*?), timestamp: ')
+# VirtualBox 7+ dropped the "Name: ..." format
+_GUEST_PROPERTY_V7 = re.compile(r"^(?P<name>/\S+)\s+= '(?P<value>.*)'")
+_GUEST_NET_PROPERTY = re.compile(
+    r'^/VirtualBox/GuestInfo/Net/(?P<id>\d+)/(?P<key>.+)$')
+_GUEST_NET_MAPPINGS = {
+    'V4/IP': 'ip',
+    'MAC': 'mac',
+    'V4/Netmask': 'netmask',
+    'Status': 'status',
+    'V4/Broadcast': 'broadcast'
+}
+
+
+def _parse_guest_properties(lines):
+    """
+    Parse the output of "VBoxManage guestproperty enumerate"
+
+    :param lines: iterable[str]
+    :return: dict[str,str]
+    """
+    props = {}
+    for line in lines:
+        match = _GUEST_PROPERTY.match(line.strip()) or \
+            _GUEST_PROPERTY_V7.match(line.strip())
+        if match:
+            props[match.group('name')] = match.group('value')
+    return props
+
+
+_SNAPSHOT_PARSER = re.compile(
+    r'^Snapshot(?P<key>Name|UUID)(?P<path>(-\d+)*)="(?P<value>.*)"$')
+
+
+def _parse_snapshots(lines):
+    """
+    Parse the output of "VBoxManage snapshot list --machinereadable", the
+    snapshots are returned in the order they were listed, parents first
+
+    :param lines: iterable[str]
+    :return: list[dict[str,str]]
+    """
+    snapshots = []
+    current = {}
+    for line in lines:
+        match = _SNAPSHOT_PARSER.match(line.strip())
+        if not match:
+            continue
+        path = match.group('path')
+        snapshot = current.get(path)
+        if not snapshot:
+            snapshot = current[path] = {}
+            snapshots.append(snapshot)
+        snapshot[match.group('key').lower()] = match.group('value')
+    return snapshots
+
+
+_PROGRESS = re.compile(r'(\d+)%')
+
+
+def _parse_progress(output):
+    """
+    Parse the progress printed by VBoxManage for long operations, which
+    looks like "0%...10%...20%"
+
+    :param output: str
+    :return: list[int]
+    """
+    return [int(percent) for percent in _PROGRESS.findall(output)]
+
+
+class Backend(object):
+    """
+    Base class for VirtualBox backends, every method works on raw data and
+    does not do any caching, this is handled by the module level functions
+
+    :attr name: str The name used in the virtualbox.backend option
+    :attr cacheable: bool Whether results can be stored in the persistent
+                     cache
+    """
+
+    name = None
+    cacheable = True
+
+    def list_vms(self, running=False):
+        raise NotImplementedError()
+
+    def vm_info_all(self):
+        raise NotImplementedError()
+
+    def vm_info(self, name):
+        raise NotImplementedError()
+
+    def guest_properties(self, name, pattern):
+        raise NotImplementedError()
+
+    def guest_property_wait(self, name, patterns, timeout):
+        """
+        Block until a guest property matching one of the given patterns
+        (separated by |) changes, or timeout seconds elapsed
+
+        :param name: str
+        :param patterns: str
+        :param timeout: float
+        :return: bool Whether a property changed
+        """
+        raise NotImplementedError()
+
+    def vm_start(self, name, headless=True):
+        raise NotImplementedError()
+
+    def vm_suspend(self, name):
+        raise NotImplementedError()
+
+    def vm_import(self, ovf, name):
+        raise NotImplementedError()
+
+    def vm_clone(self, name, new_name, snapshot=None, linked=False):
+        raise NotImplementedError()
+
+    def vm_delete(self, name):
+        raise NotImplementedError()
+
+    def vm_poweroff(self, name):
+        raise NotImplementedError()
+
+    def snapshot_take(self, name, snapshot):
+        raise NotImplementedError()
+
+    def snapshot_restore(self, name, snapshot):
+        raise NotImplementedError()
+
+    def snapshot_list(self, name):
+        raise NotImplementedError()
+
+    def snapshot_delete(self, name, snapshot):
+        raise NotImplementedError()
+
+    def list_hdds(self):
+        raise NotImplementedError()
+
+    def hdd_info(self, uuid):
+        raise NotImplementedError()
+
+    def hdd_detach(self, uuid, controller_name, port, device):
+        raise NotImplementedError()
+
+    def hdd_clone(self, uuid, new_location, existing=False, progress=None):
+        raise NotImplementedError()
+
+    def hdd_compact(self, uuid, progress=None):
+        raise NotImplementedError()
+
+    def hdd_close(self, uuid, delete=False):
+        raise NotImplementedError()
+
+    def version(self):
+        raise NotImplementedError()
+
+
+class VBoxManageBackend(Backend):
+    """
+    Default backend, forks a VBoxManage process for every operation
+    """
+
+    name = 'vboxmanage'
+
+    def list_vms(self, running=False):
+        try:
+            list = running and 'runningvms' or 'vms'
+            return _parse_list(VBoxManage('list', list, _iter=True))
+        except CommandNotFound:
+            return {}
+
+    def vm_info_all(self):
+        try:
+            return _parse_list_long(VBoxManage('list', '-l', 'vms',
+                                               _iter=True))
+        except CommandNotFound:
+            return {}
+
+    def vm_info(self, name):
+        try:
+            return _parse_vm_info(VBoxManage('showvminfo', name,
+                                             '--machinereadable',
+                                             _iter=True))
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            # something else happened, just let it go
+            raise
+
+    def guest_properties(self, name, pattern):
+        try:
+            return _parse_guest_properties(
+                VBoxManage('guestproperty', 'enumerate', name,
+                           '--patterns', pattern, _iter=True))
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            # something else happened, just let it go
+            raise
+
+    def guest_property_wait(self, name, patterns, timeout):
+        try:
+            VBoxManage('guestproperty', 'wait', name, patterns,
+                       '--timeout', int(timeout * 1000), '--fail-on-timeout')
+            return True
+        except ErrorReturnCode as e:
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            # VBoxManage exits with an error when the wait timed out
+            return False
+
+    def vm_start(self, name, headless=True):
+        try:
+            VBoxManage('startvm', name, '--type',
+                       headless and 'headless' or 'gui')
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            if 'VBOX_E_INVALID_OBJECT_STATE' in e.stderr:
+                raise InvalidState(e.stderr.split('\n')[0][17:])
+            # something else happened, just let it go
+            raise
+
+    def vm_suspend(self, name):
+        try:
+            VBoxManage('controlvm', name, 'savestate')
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            if 'Machine in invalid state' in e.stderr:
+                raise InvalidState(e.stderr[17:])
+            # something else happened, just let it go
+            raise
+
+    def vm_import(self, ovf, name):
+        VBoxManage('import', ovf, '--vsys', '0', '--vmname', name)
+
+    def vm_clone(self, name, new_name, snapshot=None, linked=False):
+        args = ['clonevm', name, '--name', new_name, '--register']
+        if snapshot:
+            args += ['--snapshot', snapshot]
+        if linked:
+            # keep the MAC of the NAT interface as it is the one the
+            # basebox has been configured with
+            args += ['--options', 'link,keepnatmacs']
+        try:
+            VBoxManage(*args)
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            # something else happened, just let it go
+            raise
+
+    def vm_delete(self, name):
+        try:
+            VBoxManage('unregistervm', name, '--delete')
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            if 'VBOX_E_INVALID_OBJECT_STATE' in e.stderr:
+                raise InvalidState(e.stderr.split('\n')[0][17:])
+            # something else happened, just let it go
+            raise
+
+    def vm_poweroff(self, name):
+        try:
+            VBoxManage('controlvm', name, 'poweroff')
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            if 'Machine in invalid state' in e.stderr or \
+                    'is not currently running' in e.stderr:
+                raise InvalidState(e.stderr.split('\n')[0][17:])
+            # something else happened, just let it go
+            raise
+
+    def _snapshot(self, name, *args):
+        try:
+            return VBoxManage('snapshot', name, *args)
+        except ErrorReturnCode_1 as e:
+            # if the VM or the snapshot was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            if 'VBOX_E_INVALID_VM_STATE' in e.stderr or \
+                    'VBOX_E_INVALID_OBJECT_STATE' in e.stderr:
+                raise InvalidState(e.stderr.split('\n')[0][17:])
+            # something else happened, just let it go
+            raise
+
+    def snapshot_take(self, name, snapshot):
+        self._snapshot(name, 'take', snapshot)
+
+    def snapshot_restore(self, name, snapshot):
+        self._snapshot(name, 'restore', snapshot)
+
+    def snapshot_list(self, name):
+        try:
+            return _parse_snapshots(VBoxManage('snapshot', name, 'list',
+                                               '--machinereadable',
+                                               _iter=True))
+        except ErrorReturnCode_1 as e:
+            if 'does not have any snapshots' in e.stdout + e.stderr:
+                return []
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise VMNotFound(name)
+            # something else happened, just let it go
+            raise
+
+    def snapshot_delete(self, name, snapshot):
+        self._snapshot(name, 'delete', snapshot)
+
+    def list_hdds(self):
+        return _parse_hdds(VBoxManage('list', 'hdds', _iter=True))
+
+    def hdd_info(self, uuid):
+        try:
+            return _parse_hdd_info(VBoxManage('showhdinfo', uuid,
+                                              _iter=True))
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise HDDNotFound(uuid)
+            # something else happened, just let it go
+            raise
+
+    def hdd_detach(self, uuid, controller_name, port, device):
+        try:
+            VBoxManage('storageattach', uuid, '--storagectl',
+                       controller_name, '--port', port, '--device', device,
+                       '--type', 'hdd', '--medium', 'none')
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise HDDNotFound(uuid)
+            # something else happened, just let it go
+            raise
+
+    def _hdd_progress(self, uuid, progress, *args):
+        """
+        Run a long VBoxManage operation on a disk, calling progress with
+        every percentage it reports
+        """
+        stderr = []
+
+        def _on_err(chunk):
+            reported = len(_parse_progress(''.join(stderr)))
+            stderr.append(chunk)
+            if progress:
+                for percent in _parse_progress(''.join(stderr))[reported:]:
+                    progress(percent)
+
+        try:
+            VBoxManage(*args, _err=_on_err, _err_bufsize=0)
+        except ErrorReturnCode_1:
+            # stderr is not kept by sh when using a callback
+            if 'VBOX_E_OBJECT_NOT_FOUND' in ''.join(stderr):
+                raise HDDNotFound(uuid)
+            # something else happened, just let it go
+            raise
+
+    def hdd_clone(self, uuid, new_location, existing=False, progress=None):
+        args = ['clonehd', uuid, new_location]
+        if existing:
+            args.append('--existing')
+        self._hdd_progress(uuid, progress, *args)
+
+    def hdd_compact(self, uuid, progress=None):
+        self._hdd_progress(uuid, progress, 'modifymedium', 'disk', uuid,
+                           '--compact')
+
+    def hdd_close(self, uuid, delete=False):
+        try:
+            if delete:
+                VBoxManage('closemedium', 'disk', uuid, '--delete')
+            else:
+                VBoxManage('closemedium', 'disk', uuid)
+        except ErrorReturnCode_1 as e:
+            # if the VM was not found
+            if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
+                raise HDDNotFound(uuid)
+            # something else happened, just let it go
+            raise
+
+    def version(self):
+        try:
+            return str(VBoxManage('--version')).rstrip()
+        except CommandNotFound:
+            return None
+
+
+def _load_backend(name):
+    """
+    Instantiate the backend with the given name, "auto" uses the vboxapi
+    backend when the bindings are available and VBoxManage otherwise
+
+    :param name: str
+    :return: Backend
+    """
+    if name in ('auto', 'vboxapi'):
+        try:
+            from .virtualbox_api import VBoxAPIBackend
+            return VBoxAPIBackend()
+        except Exception as e:
+            log = name == 'vboxapi' and logger.warn or logger.debug
+            log('vboxapi backend is not available (%s), falling back '
+                'to VBoxManage', e)
+    elif name == 'fake':
+        from .virtualbox_fake import FakeBackend
+        return FakeBackend()
+    elif name != 'vboxmanage':
+        logger.warn('unknown virtualbox backend "%s", falling back to '
+                    'VBoxManage', name)
+
+    return VBoxManageBackend()
+
+
+def backend():
+    """
+    Return the backend currently in use, see the virtualbox.backend option
+
+    :return: Backend
+    """
+    global _backend
+    if _backend is None:
+        _backend = _load_backend(config.get('virtualbox', 'backend',
+                                            default='auto'))
+        logger.debug('using the %s backend', _backend.name)
+    return _backend
+
+
+def set_backend(new_backend):
+    """
+    Replace the backend in use (eg. by a FakeBackend when testing), this
+    drops every in-memory cache
+
+    :param new_backend: Backend
+    """
+    global _backend
+    _backend = new_backend
+    list_vms.clear()
+    vm_info_all.clear()
+    vm_info.clear()
+    guest_properties.clear()
+    list_hdds.clear()
+    hdd_info.clear()
+
+
+@memoized(ttl=cache_ttl)
+def list_vms(running=False):
+    """
+    Return the list of VM in for the form name => uuid, when the running bool
+    is set to true, only return running VMs
+    :param running: bool
+    :return: dict[str,str]
+    """
+    return backend().list_vms(running)
+
+
+@memoized(ttl=cache_ttl)
+def vm_info_all():
+    """
+    Return the state, state change time, forwarding rules and network
+    configuration of every registered VM in the form name => info, using a
+    single backend call. The info dicts use the same keys as vm_info
+    for those fields.
+
+    Results are kept in the persistent cache for as long as the VirtualBox
+    settings files are not modified. Once the cache_ttl expires, a cheap
+    "list runningvms" call is used to check that the states are still
+    accurate before doing a full refresh.
+
+    :return: dict[str,dict[str,str]]
+    """
+    vms = _cache_get('vms')
+    if vms is not None:
+        if _cache.age('vms') <= cache_ttl():
+            return vms
+
+        running = set([name for name, info in vms.iteritems()
+                       if info.get('VMState') == 'running'])
+        if running == set(list_vms(True)):
+            _cache_set('vms', vms, vms)
+            return vms
+
+    vms = backend().vm_info_all()
+    _cache_set('vms', vms, vms)
+    return vms
+
+
+@memoized
+def list_hdds():
+    """
+    Return the list of HDDs in for the form
+    uuid => {state, type, location, format, cap}
+    :return: dict[str,dict[str,str]]
+    """
+    return backend().list_hdds()
+
+
 @memoized
 def hdd_info(uuid):
-    try:
-        info = {}
-        for line in VBoxManage('showhdinfo', uuid, _iter=True):
-            if not line.strip():
-                continue
-            key, val = line.strip().split(':')
-            val = val.strip()
-            info[key] = val
-        return info
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise HDDNotFound(uuid)
-        # something else happened, just let it go
-        raise
+    return backend().hdd_info(uuid)
 
 
 def hdd_detach(uuid, controller_name, port, device):
-    try:
-        VBoxManage('storageattach', uuid, '--storagectl', controller_name,
-                   '--port', port, '--device', device, '--type', 'hdd',
-                   '--medium', 'none')
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise HDDNotFound(uuid)
-        # something else happened, just let it go
-        raise
-
-
-def hdd_clone(uuid, new_location, existing=False):
-    try:
-        if existing:
-            VBoxManage('clonehd', uuid, new_location, '--existing')
-        else:
-            VBoxManage('clonehd', uuid, new_location)
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise HDDNotFound(uuid)
-        # something else happened, just let it go
-        raise
+    backend().hdd_detach(uuid, controller_name, port, device)
+
+
+def hdd_clone(uuid, new_location, existing=False, progress=None):
+    """
+    Copy a disk to the given location
+
+    :param uuid: str
+    :param new_location: str
+    :param existing: bool Whether to overwrite an existing disk
+    :param progress: callable Called with the percentage done
+    :return: None
+    """
+    backend().hdd_clone(uuid, new_location, existing, progress)
+    list_hdds.clear()
+
+
+def hdd_compact(uuid, progress=None):
+    """
+    Reclaim the blocks of a dynamic disk that only contain zeros, the free
+    space has to be zeroed from within the guest beforehand
+
+    :param uuid: str
+    :param progress: callable Called with the percentage done
+    :return: None
+    """
+    backend().hdd_compact(uuid, progress)
+    hdd_info.invalidate(uuid)
 
 
 def hdd_close(uuid, delete=False):
-    try:
-        if delete:
-            VBoxManage('closemedium', 'disk', uuid, '--delete')
-        else:
-            VBoxManage('closemedium', 'disk', uuid)
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise HDDNotFound(uuid)
-        # something else happened, just let it go
-        raise
+    backend().hdd_close(uuid, delete)
+    list_hdds.clear()
+    hdd_info.invalidate(uuid)
 
 
-@memoized
+@memoized(ttl=cache_ttl)
 def vm_info(name):
     """
     Wrapper around VBoxManage showvminfo
@@ -155,29 +919,68 @@ def vm_info(name):
     :param name: str
     :return: dict[str,str]
     """
-    try:
-        INFO_PARSER = re.compile(
-            r'^("(?P<quoted_key>[^"]+)"|(?P<key>[^=]+))=(?P<value>.*)$')
-        info = {}
-        for line in VBoxManage('showvminfo', name, '--machinereadable',
-                               _iter=True):
-            matches = re.match(INFO_PARSER, line)
-            if matches:
-                key = matches.group('key') or matches.group('quoted_key')
-                value = matches.group('value')
-
-                if key and value:
-                    info[key] = value
+    info = _cache_get('info:%s' % name, ttl=cache_ttl())
+    if info is not None:
         return info
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise VMNotFound(name)
-        # something else happened, just let it go
-        raise
+
+    info = backend().vm_info(name)
+    _cache_set('info:%s' % name, info, {name: info})
+    return info
+
+
+@memoized(ttl=cache_ttl)
+def guest_properties(name, pattern='*'):
+    """
+    Return every guest property of a VM matching the given pattern in
+    a single backend call, results are kept in the persistent cache for
+    cache_ttl seconds
+
+    :param name: str
+    :param pattern: str
+    :return: dict[str,str]
+    """
+    key = 'guest:%s:%s' % (name, pattern)
+    props = _cache_get(key, ttl=cache_ttl())
+    if props is not None:
+        return props
+
+    props = backend().guest_properties(name, pattern)
+    vms = vm_info_all()
+    _cache_set(key, props, name in vms and {name: vms[name]} or {})
+    return props
+
+
+def guest_network(name):
+    """
+    Return a table of the network interfaces reported by the guest, built
+    from a single guestproperty enumeration. Interfaces that only have
+    some of their properties set (eg. the IP forced by the Vagrantfile
+    before the guest additions are up) are listed as well.
+
+    :param name: str
+    :return: list[dict[str,str]]
+    """
+    props = guest_properties(name, GUEST_NET_PATTERN)
+
+    interfaces = {}
+    for prop, value in props.iteritems():
+        match = _GUEST_NET_PROPERTY.match(prop)
+        if not match or match.group('key') not in _GUEST_NET_MAPPINGS:
+            continue
+        interface = interfaces.setdefault(int(match.group('id')), {})
+        interface[_GUEST_NET_MAPPINGS[match.group('key')]] = value
+
+    count = int(props.get('/VirtualBox/GuestInfo/Net/Count', 0))
+    if interfaces:
+        count = max(count, max(interfaces.keys()) + 1)
+
+    return [
+        dict([(key, interfaces.get(i, {}).get(key))
+              for key in _GUEST_NET_MAPPINGS.values()])
+        for i in range(count)
+    ]
 
 
-@memoized
 def vm_network(name):
     """
     Return IP, Mac, Netmask, Broadcast and Status about every interfaces
@@ -185,36 +988,11 @@ def vm_network(name):
     :param name: str
     :return: list[dict[str,str]]
     """
-    try:
-        networks = []
-        count = int(str(VBoxManage('guestproperty', 'get',
-                        name, '/VirtualBox/GuestInfo/Net/Count'))[7:])
-
-        mappings = {
-            'ip': '/VirtualBox/GuestInfo/Net/%d/V4/IP',
-            'mac': '/VirtualBox/GuestInfo/Net/%d/MAC',
-            'netmask': '/VirtualBox/GuestInfo/Net/%d/V4/Netmask',
-            'status': '/VirtualBox/GuestInfo/Net/%d/Status',
-            'broadcast': '/VirtualBox/GuestInfo/Net/%d/V4/Broadcast'
-        }
-
-        for i in range(count):
-            network = {}
-            for map, property in mappings.iteritems():
-                prop = VBoxManage('guestproperty', 'get', name, property % i)
-                network[map] = str(prop)[7:].strip()
-            networks.append(network)
-
-        return networks
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise VMNotFound(name)
-        # something else happened, just let it go
-        raise
+    count = int(guest_properties(name, GUEST_NET_PATTERN).get(
+        '/VirtualBox/GuestInfo/Net/Count', 0))
+    return guest_network(name)[:count]
 
 
-@memoized
 def vm_ip(name, id):
     """
     Return a running VMs IP for the given VM name and interface id,
@@ -223,19 +1001,48 @@ def vm_ip(name, id):
     :param id: int
     :return: None|str
     """
-    try:
-        prop = '/VirtualBox/GuestInfo/Net/%d/V4/IP' % (id)
-        value = str(VBoxManage('guestproperty', 'get',
-                    name, prop))
-        if value == 'No value set!':
+    interfaces = guest_network(name)
+    if id >= len(interfaces):
+        return None
+    return interfaces[id]['ip']
+
+
+# longest wait for a guest property change before reading them again
+GUEST_WAIT_SLICE = 2
+
+
+def wait_guest_network(name, id=1, timeout=120):
+    """
+    Block until the given interface of a VM is up and has an IP, as
+    reported by the guest additions. Instead of polling, VirtualBox is
+    asked to notify us of any change of the interface's properties. The
+    wait is done in short slices after which the properties are read
+    again, as a change made between a read and the start of a wait would
+    not wake it up.
+
+    :param name: str
+    :param id: int
+    :param timeout: float Maximum time to wait in seconds
+    :return: str|None The IP of the interface or None on timeout
+    """
+    prefix = '/VirtualBox/GuestInfo/Net/%d/' % id
+    patterns = '|'.join([prefix + 'V4/IP', prefix + 'Status'])
+    deadline = time.time() + timeout
+
+    while True:
+        # bypass the cache, we are waiting for the properties to change
+        props = backend().guest_properties(name, prefix + '*')
+        if props.get(prefix + 'Status') == 'Up' and \
+                props.get(prefix + 'V4/IP'):
+            invalidate_vm(name)
+            return props[prefix + 'V4/IP']
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
             return None
-        return value[7:].strip()
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise VMNotFound(name)
-        # something else happened, just let it go
-        raise
+
+        backend().guest_property_wait(name, patterns,
+                                      min(remaining, GUEST_WAIT_SLICE))
 
 
 def vm_start(name, headless=True):
@@ -245,16 +1052,8 @@ def vm_start(name, headless=True):
     :param headless: bool
     :return: None
     """
-    try:
-        VBoxManage('startvm', name, '--type', headless and 'headless' or 'gui')
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise VMNotFound(name)
-        if 'VBOX_E_INVALID_OBJECT_STATE' in e.stderr:
-            raise InvalidState(e.stderr.split('\n')[0][17:])
-        # something else happened, just let it go
-        raise
+    backend().vm_start(name, headless)
+    invalidate_vm(name)
 
 
 def vm_suspend(name):
@@ -264,20 +1063,131 @@ def vm_suspend(name):
     :param name: str
     :return: None
     """
-    try:
-        VBoxManage('controlvm', name, 'savestate')
-    except ErrorReturnCode_1 as e:
-        # if the VM was not found
-        if 'VBOX_E_OBJECT_NOT_FOUND' in e.stderr:
-            raise VMNotFound(name)
-        if 'Machine in invalid state' in e.stderr:
-            raise InvalidState(e.stderr[17:])
-        # something else happened, just let it go
-        raise
+    backend().vm_suspend(name)
+    invalidate_vm(name)
+
+
+def vm_import(ovf, name):
+    """
+    Import an OVF appliance as a new VM with the given name
+
+    :param ovf: str Path to the .ovf file
+    :param name: str
+    :return: str The UUID of the new VM
+    """
+    backend().vm_import(ovf, name)
+    invalidate_vm(name)
+    return list_vms()[name]
+
+
+def vm_clone(name, new_name, snapshot=None, linked=False):
+    """
+    Clone a VM, linked clones share the disks of the given snapshot with
+    the original VM and only store the blocks they modify
+
+    :param name: str
+    :param new_name: str
+    :param snapshot: str Required for linked clones
+    :param linked: bool
+    :return: str The UUID of the new VM
+    """
+    if linked and not snapshot:
+        raise ValueError('linked clones require a snapshot')
+
+    backend().vm_clone(name, new_name, snapshot, linked)
+    invalidate_vm(new_name)
+    return list_vms()[new_name]
+
+
+def vm_delete(name):
+    """
+    Unregister a VM and delete its files, raises an InvalidState exception
+    if the VM cannot be deleted (eg. it still has linked clones)
+
+    :param name: str
+    :return: None
+    """
+    backend().vm_delete(name)
+    invalidate_vm(name)
+
+
+def vm_poweroff(name):
+    """
+    Immediately stop a running VM, like pulling its power cord
+
+    :param name: str
+    :return: None
+    """
+    backend().vm_poweroff(name)
+    invalidate_vm(name)
+
+
+def snapshot_take(name, snapshot):
+    """
+    Take a snapshot of the given VM
+
+    :param name: str
+    :param snapshot: str The name of the snapshot
+    :return: None
+    """
+    backend().snapshot_take(name, snapshot)
+    invalidate_vm(name)
+
+
+def snapshot_restore(name, snapshot):
+    """
+    Restore a snapshot, the VM must not be running
+
+    :param name: str
+    :param snapshot: str The name or UUID of the snapshot
+    :return: None
+    """
+    backend().snapshot_restore(name, snapshot)
+    invalidate_vm(name)
+
+
+def snapshot_list(name):
+    """
+    Return the snapshots of a VM, parents first
+
+    :param name: str
+    :return: list[dict[str,str]] With name and uuid keys
+    """
+    return backend().snapshot_list(name)
+
+
+def snapshot_delete(name, snapshot):
+    """
+    Delete a snapshot, its changes are merged in its children
+
+    :param name: str
+    :param snapshot: str The name or UUID of the snapshot
+    :return: None
+    """
+    backend().snapshot_delete(name, snapshot)
+    invalidate_vm(name)
+
+
+def snapshot_retention():
+    """
+    How many snapshots taken by AerisCloud are kept for each box, 0
+    disables automatic snapshots
+
+    :return: int
+    """
+    return int(config.get('virtualbox', 'snapshot_retention', default=3))
+
+
+def clone_mode():
+    """
+    How new boxes are created, either "full" to let vagrant import the
+    basebox for every box, or "linked" to create boxes as linked clones of
+    a master VM shared by every box using the same basebox
+
+    :return: str
+    """
+    return config.get('virtualbox', 'clone_mode', default='full')
 
 
 def version():
-    try:
-        return str(VBoxManage('--version')).rstrip()
-    except CommandNotFound:
-        return None
+    return backend().version()
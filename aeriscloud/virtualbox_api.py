@@ -0,0 +1,180 @@
+"""
+VirtualBox backend using the in-process API bindings shipped with the
+VirtualBox SDK (vboxapi), avoiding a VBoxManage fork for the most common
+operations. Everything that is not implemented here falls back to the
+VBoxManage backend.
+"""
+
+from __future__ import absolute_import
+
+from datetime import datetime
+
+from .log import get_logger
+from .virtualbox import VBoxManageBackend, VMNotFound, InvalidState
+
+logger = get_logger('virtualbox.api')
+
+# API state names that do not match the showvminfo --machinereadable ones
+_STATES = {
+    'PoweredOff': 'poweroff',
+    'Stuck': 'gurumeditation',
+}
+
+# maximum number of network adapters on a PIIX3 chipset
+_MAX_ADAPTERS = 8
+
+
+class VBoxAPIBackend(VBoxManageBackend):
+    """
+    Backend using the vboxapi bindings, raises an ImportError when
+    instantiated if they are not available
+    """
+
+    name = 'vboxapi'
+
+    def __init__(self):
+        from vboxapi import VirtualBoxManager
+
+        self._manager = VirtualBoxManager(None, None)
+        self._vbox = getattr(self._manager, 'vbox', None) or \
+            self._manager.getVirtualBox()
+        self._const = self._manager.constants
+        self._states = dict([
+            (value, key) for key, value in
+            self._const.all_values('MachineState').iteritems()
+        ])
+
+    def _machines(self):
+        return [machine for machine in
+                self._manager.getArray(self._vbox, 'machines')
+                if machine.accessible]
+
+    def _machine(self, name):
+        try:
+            return self._vbox.findMachine(name)
+        except Exception:
+            raise VMNotFound(name)
+
+    def _session(self):
+        try:
+            return self._manager.getSessionObject()
+        except TypeError:
+            # older bindings require the virtualbox object
+            return self._manager.getSessionObject(self._vbox)
+
+    def _wait(self, progress):
+        progress.waitForCompletion(-1)
+        if progress.resultCode != 0:
+            raise InvalidState(progress.errorInfo.text)
+
+    def _state(self, machine):
+        state = self._states.get(machine.state, 'unknown')
+        return _STATES.get(state, state.lower())
+
+    def _info(self, machine):
+        """
+        Build a dict using the same keys as showvminfo --machinereadable for
+        the fields returned by vm_info_all
+        """
+        change_time = machine.lastStateChange
+        info = {
+            'name': machine.name,
+            'UUID': machine.id,
+            'CfgFile': machine.settingsFilePath,
+            'memory': str(machine.memorySize),
+            'cpus': str(machine.CPUCount),
+            'VMState': self._state(machine),
+            'VMStateChangeTime': '%s.%03d000000' % (
+                datetime.utcfromtimestamp(change_time // 1000).isoformat(),
+                change_time % 1000)
+        }
+
+        attachments = {
+            self._const.NetworkAttachmentType_NAT: 'nat',
+            self._const.NetworkAttachmentType_HostOnly: 'hostonly',
+            self._const.NetworkAttachmentType_Bridged: 'bridged',
+        }
+
+        forwards = 0
+        for slot in range(_MAX_ADAPTERS):
+            nic_id = slot + 1
+            adapter = machine.getNetworkAdapter(slot)
+            if not adapter.enabled:
+                info['nic%d' % nic_id] = 'none'
+                continue
+
+            info['macaddress%d' % nic_id] = adapter.MACAddress
+            info['nic%d' % nic_id] = attachments.get(
+                adapter.attachmentType, 'null')
+
+            if info['nic%d' % nic_id] == 'hostonly':
+                info['hostonlyadapter%d' % nic_id] = \
+                    adapter.hostOnlyInterface
+            elif info['nic%d' % nic_id] == 'bridged':
+                info['bridgeadapter%d' % nic_id] = adapter.bridgedInterface
+            elif info['nic%d' % nic_id] == 'nat':
+                # arrays are only reachable through the manager
+                for redirect in self._manager.getArray(adapter.NATEngine,
+                                                       'redirects'):
+                    # name,protocol,host ip,host port,guest ip,guest port
+                    rule = redirect.split(',')
+                    rule[1] = rule[1] == '1' and 'tcp' or 'udp'
+                    info['Forwarding(%d)' % forwards] = ','.join(rule)
+                    forwards += 1
+
+        return info
+
+    def list_vms(self, running=False):
+        return dict([
+            (machine.name, machine.id)
+            for machine in self._machines()
+            if not running or self._state(machine) == 'running'
+        ])
+
+    def vm_info_all(self):
+        return dict([
+            (machine.name, self._info(machine))
+            for machine in self._machines()
+        ])
+
+    def guest_properties(self, name, pattern):
+        machine = self._machine(name)
+        names, values, _, _ = machine.enumerateGuestProperties(pattern)
+        return dict(zip(names, values))
+
+    def vm_start(self, name, headless=True):
+        machine = self._machine(name)
+        session = self._session()
+        vm_type = headless and 'headless' or 'gui'
+
+        try:
+            progress = machine.launchVMProcess(session, vm_type, [])
+        except Exception:
+            # VirtualBox < 6.1 takes the environment as a string
+            progress = machine.launchVMProcess(session, vm_type, '')
+
+        try:
+            self._wait(progress)
+        finally:
+            session.unlockMachine()
+
+    def vm_suspend(self, name):
+        machine = self._machine(name)
+        if self._state(machine) not in ('running', 'paused'):
+            raise InvalidState('Machine in invalid state %s' %
+                               self._state(machine))
+
+        session = self._session()
+        machine.lockMachine(session, self._const.LockType_Shared)
+        try:
+            try:
+                progress = session.machine.saveState()
+            except AttributeError:
+                # VirtualBox < 6.0 has saveState on the console
+                progress = session.console.saveState()
+            self._wait(progress)
+        finally:
+            session.unlockMachine()
+
+    def version(self):
+        return self._vbox.version
@@ -0,0 +1,190 @@
+"""
+In-memory VirtualBox backend, allows testing code depending on VirtualBox on
+machines where it is not installed. Enable it with:
+
+  aeris config virtualbox.backend fake
+
+or by calling virtualbox.set_backend(FakeBackend()) in tests.
+"""
+
+import time
+import uuid as uuidlib
+
+from fnmatch import fnmatch
+
+from .virtualbox import Backend, VMNotFound, HDDNotFound, InvalidState
+
+
+class FakeBackend(Backend):
+    """
+    Keeps VMs, guest properties and disks in memory
+    """
+
+    name = 'fake'
+    cacheable = False
+
+    def __init__(self):
+        self.vms = {}
+        self.hdds = {}
+
+    def add_vm(self, name, state='poweroff', forwards=None,
+               guest_properties=None, **extra):
+        """
+        Register a fake VM
+
+        :param name: str
+        :param state: str A showvminfo --machinereadable state
+        :param forwards: list[str] NAT rules in the "name,protocol,host ip,
+                         host port,guest ip,guest port" format
+        :param guest_properties: dict[str,str]
+        :return: dict[str,str] The info of the VM
+        """
+        info = {
+            'name': name,
+            'UUID': str(uuidlib.uuid4()),
+            'VMState': state,
+            'VMStateChangeTime': '2015-01-01T00:00:00.000000000',
+            'nic1': 'nat',
+            'nic2': 'hostonly',
+        }
+        info.update(extra)
+        for idx, forward in enumerate(forwards or []):
+            info['Forwarding(%d)' % idx] = forward
+
+        self.vms[name] = {
+            'info': info,
+            'guest_properties': dict(guest_properties or {}),
+            'snapshots': [],
+            'parent': None
+        }
+        return info
+
+    def add_hdd(self, location, **extra):
+        hdd_uuid = str(uuidlib.uuid4())
+        self.hdds[hdd_uuid] = dict(extra, Location=location)
+        return hdd_uuid
+
+    def _vm(self, name):
+        if name not in self.vms:
+            raise VMNotFound(name)
+        return self.vms[name]
+
+    def _hdd(self, uuid):
+        if uuid not in self.hdds:
+            raise HDDNotFound(uuid)
+        return self.hdds[uuid]
+
+    def _set_state(self, name, state):
+        self._vm(name)['info']['VMState'] = state
+
+    def list_vms(self, running=False):
+        return dict([
+            (name, vm['info']['UUID'])
+            for name, vm in self.vms.iteritems()
+            if not running or vm['info']['VMState'] == 'running'
+        ])
+
+    def vm_info_all(self):
+        return dict([(name, dict(vm['info']))
+                     for name, vm in self.vms.iteritems()])
+
+    def vm_info(self, name):
+        return dict(self._vm(name)['info'])
+
+    def guest_properties(self, name, pattern):
+        return dict([
+            (prop, value)
+            for prop, value in self._vm(name)['guest_properties'].iteritems()
+            if fnmatch(prop, pattern)
+        ])
+
+    def guest_property_wait(self, name, patterns, timeout):
+        # properties never change on their own on a fake VM
+        self._vm(name)
+        time.sleep(timeout)
+        return False
+
+    def vm_start(self, name, headless=True):
+        if self._vm(name)['info']['VMState'] == 'running':
+            raise InvalidState('The machine is already running')
+        self._set_state(name, 'running')
+
+    def vm_suspend(self, name):
+        if self._vm(name)['info']['VMState'] != 'running':
+            raise InvalidState('Machine in invalid state')
+        self._set_state(name, 'saved')
+
+    def vm_import(self, ovf, name):
+        if name in self.vms:
+            raise InvalidState('Machine %s already exists' % name)
+        self.add_vm(name)
+
+    def vm_clone(self, name, new_name, snapshot=None, linked=False):
+        vm = self._vm(name)
+        if snapshot and snapshot not in vm['snapshots']:
+            raise InvalidState('Snapshot %s not found' % snapshot)
+        self.add_vm(new_name)
+        if linked:
+            self.vms[new_name]['parent'] = name
+
+    def vm_delete(self, name):
+        self._vm(name)
+        if [vm for vm in self.vms.values() if vm['parent'] == name]:
+            raise InvalidState('Cannot unregister the machine %s while it '
+                               'has linked clones' % name)
+        del self.vms[name]
+
+    def vm_poweroff(self, name):
+        if self._vm(name)['info']['VMState'] not in ('running', 'paused'):
+            raise InvalidState('Machine in invalid state')
+        self._set_state(name, 'poweroff')
+
+    def _snapshot(self, name, snapshot):
+        vm = self._vm(name)
+        if snapshot not in vm['snapshots']:
+            raise VMNotFound(snapshot)
+        return vm
+
+    def snapshot_take(self, name, snapshot):
+        self._vm(name)['snapshots'].append(snapshot)
+
+    def snapshot_restore(self, name, snapshot):
+        vm = self._snapshot(name, snapshot)
+        if vm['info']['VMState'] in ('running', 'paused'):
+            raise InvalidState('Machine in invalid state')
+        self._set_state(name, 'saved')
+
+    def snapshot_list(self, name):
+        return [{'name': snapshot, 'uuid': snapshot}
+                for snapshot in self._vm(name)['snapshots']]
+
+    def snapshot_delete(self, name, snapshot):
+        self._snapshot(name, snapshot)['snapshots'].remove(snapshot)
+
+    def list_hdds(self):
+        return dict([(uuid, dict(hdd)) for uuid, hdd in self.hdds.iteritems()])
+
+    def hdd_info(self, uuid):
+        return dict(self._hdd(uuid))
+
+    def hdd_detach(self, uuid, controller_name, port, device):
+        self._hdd(uuid)
+
+    def hdd_clone(self, uuid, new_location, existing=False, progress=None):
+        hdd = self._hdd(uuid)
+        if not existing:
+            self.add_hdd(new_location, Format=hdd.get('Format', 'VDI'))
+        if progress:
+            progress(100)
+
+    def hdd_compact(self, uuid, progress=None):
+        self._hdd(uuid)
+        if progress:
+            progress(100)
+
+    def hdd_close(self, uuid, delete=False):
+        self._hdd(uuid)
+        del self.hdds[uuid]
+
+    def version(self):
+        return '5.0.0_fake'
@@ -0,0 +1,309 @@
+"""
+Read static VM information (name, memory, network adapters, port forwards,
+disks) straight from the VirtualBox XML settings files, without requiring
+VirtualBox to be running nor forking VBoxManage.
+
+Runtime information such as the state of a VM or its guest properties is
+not stored in those files and still has to go through the virtualbox module.
+"""
+
+import os
+
+try:
+    from xml.etree import cElementTree as ElementTree
+except ImportError:
+    from xml.etree import ElementTree
+
+from .cache import file_mtime
+from .log import get_logger
+from .virtualbox import global_settings_file
+
+logger = get_logger('virtualbox.xml')
+
+# parsed files, keyed by path and stored with the mtime they were read at
+_parsed = {}
+
+_NAT_PROTOCOLS = {
+    '0': 'udp',
+    '1': 'tcp',
+}
+
+
+def _tag(elem):
+    """
+    Strip the namespace from the tag of the given element
+
+    :param elem: xml.etree.ElementTree.Element
+    :return: str
+    """
+    if '}' in elem.tag:
+        return elem.tag.split('}', 1)[1]
+    return elem.tag
+
+
+def _uuid(value):
+    return (value or '').strip('{}')
+
+
+def _cached(path, parser):
+    """
+    Parse the given file using the provided function, reusing the result
+    of the previous parsing if the file did not change since then
+
+    :param path: str
+    :param parser: callable
+    :return: any|None
+    """
+    mtime = file_mtime(path)
+    if mtime is None:
+        return None
+
+    entry = _parsed.get(path)
+    if entry and entry[0] == mtime:
+        return entry[1]
+
+    try:
+        value = parser(path)
+    except (IOError, SyntaxError) as e:
+        # ParseError is a subclass of SyntaxError
+        logger.warn('could not parse %s: %s', path, e)
+        return None
+
+    _parsed[path] = (mtime, value)
+    return value
+
+
+def _parse_registry(path):
+    """
+    Return the settings file of every VM registered in VirtualBox.xml,
+    indexed by uuid
+
+    :param path: str
+    :return: dict[str,str]
+    """
+    base_dir = os.path.dirname(path)
+    registry = {}
+    for _, elem in ElementTree.iterparse(path):
+        tag = _tag(elem)
+        if tag == 'MachineEntry':
+            registry[_uuid(elem.get('uuid'))] = os.path.join(
+                base_dir, elem.get('src'))
+        elif tag == 'MachineRegistry':
+            # the machine registry is all we are interested in
+            break
+        elem.clear()
+    return registry
+
+
+def _on_machine(ctx, elem, parent):
+    ctx['machine']['name'] = elem.get('name')
+    ctx['machine']['uuid'] = _uuid(elem.get('uuid'))
+
+
+def _on_hard_disk(ctx, elem, parent):
+    if 'MediaRegistry' not in ctx['stack']:
+        return
+    location = elem.get('location')
+    if location and not os.path.isabs(location):
+        location = os.path.join(ctx['base_dir'], location)
+    ctx['machine']['hdds'][_uuid(elem.get('uuid'))] = {
+        'location': location,
+        'format': elem.get('format'),
+        'type': elem.get('type', 'Normal'),
+    }
+
+
+def _on_memory(ctx, elem, parent):
+    if parent == 'Hardware':
+        ctx['machine']['memory'] = int(elem.get('RAMSize'))
+
+
+def _on_cpu(ctx, elem, parent):
+    if parent == 'Hardware':
+        ctx['machine']['cpus'] = int(elem.get('count', 1))
+
+
+def _on_adapter(ctx, elem, parent):
+    if parent != 'Network':
+        return
+    # VBoxManage counts NICs from 1, VirtualBox slots from 0
+    ctx['adapter'] = {
+        'id': int(elem.get('slot')) + 1,
+        'enabled': elem.get('enabled') == 'true',
+        'mac': elem.get('MACAddress'),
+        'type': 'null',
+        'interface': None,
+    }
+    ctx['machine']['nics'][ctx['adapter']['id']] = ctx['adapter']
+
+
+def _on_interface(nic_type, named):
+    def _handler(ctx, elem, parent):
+        if parent == 'Adapter':
+            ctx['adapter']['type'] = nic_type
+            if named:
+                ctx['adapter']['interface'] = elem.get('name')
+    return _handler
+
+
+def _on_forwarding(ctx, elem, parent):
+    if parent == 'NAT':
+        ctx['machine']['forwards'][elem.get('name')] = {
+            'protocol': _NAT_PROTOCOLS.get(elem.get('proto'), 'tcp'),
+            'host_ip': elem.get('hostip', ''),
+            'host_port': elem.get('hostport'),
+            'guest_ip': elem.get('guestip', ''),
+            'guest_port': elem.get('guestport'),
+        }
+
+
+def _on_storage_controller(ctx, elem, parent):
+    ctx['controller'] = elem.get('name')
+
+
+def _on_attached_device(ctx, elem, parent):
+    if elem.get('type') != 'HardDisk':
+        return
+    ctx['attached'] = {
+        'controller': ctx['controller'],
+        'port': int(elem.get('port', 0)),
+        'device': int(elem.get('device', 0)),
+        'uuid': None,
+        'location': None,
+    }
+    ctx['machine']['disks'].append(ctx['attached'])
+
+
+def _on_image(ctx, elem, parent):
+    if parent == 'AttachedDevice' and ctx['attached']:
+        ctx['attached']['uuid'] = _uuid(elem.get('uuid'))
+
+
+# handlers of the elements of a .vbox file, called when they start with
+# the parsing context, the element and the tag of its parent
+_MACHINE_HANDLERS = {
+    'Machine': _on_machine,
+    'HardDisk': _on_hard_disk,
+    'Memory': _on_memory,
+    'CPU': _on_cpu,
+    'Adapter': _on_adapter,
+    'NAT': _on_interface('nat', False),
+    'HostOnlyInterface': _on_interface('hostonly', True),
+    'BridgedInterface': _on_interface('bridged', True),
+    'Forwarding': _on_forwarding,
+    'StorageController': _on_storage_controller,
+    'AttachedDevice': _on_attached_device,
+    'Image': _on_image,
+}
+
+
+def _parse_machine(path):
+    """
+    Parse a .vbox file, the settings stored in snapshots are ignored as they
+    do not reflect the current state of the VM
+
+    :param path: str
+    :return: dict[str,any]
+    """
+    machine = {
+        'name': None,
+        'uuid': None,
+        'settings_file': path,
+        'memory': None,
+        'cpus': 1,
+        'nics': {},
+        'forwards': {},
+        'disks': [],
+        'hdds': {},
+    }
+    ctx = {
+        'machine': machine,
+        'base_dir': os.path.dirname(path),
+        # stack of the elements we are currently in
+        'stack': [],
+        'adapter': None,
+        'controller': None,
+        'attached': None,
+    }
+    stack = ctx['stack']
+    snapshots = 0
+
+    for event, elem in ElementTree.iterparse(path, events=('start', 'end')):
+        tag = _tag(elem)
+
+        if event == 'end':
+            stack.pop()
+            if tag == 'Snapshot':
+                snapshots -= 1
+            elif tag == 'AttachedDevice':
+                ctx['attached'] = None
+            # the media registry is needed in full to resolve parent disks
+            if not snapshots and 'MediaRegistry' not in stack:
+                elem.clear()
+            continue
+
+        parent = stack and stack[-1] or None
+        stack.append(tag)
+
+        if tag == 'Snapshot':
+            snapshots += 1
+        if not snapshots and tag in _MACHINE_HANDLERS:
+            _MACHINE_HANDLERS[tag](ctx, elem, parent)
+
+    # return the adapters ordered by id
+    machine['nics'] = [nic for _, nic in sorted(machine['nics'].items())]
+
+    for disk in machine['disks']:
+        if disk['uuid'] in machine['hdds']:
+            disk['location'] = machine['hdds'][disk['uuid']]['location']
+
+    return machine
+
+
+def registered_vms():
+    """
+    Return the path to the settings file of every VM known to VirtualBox,
+    indexed by uuid
+
+    :return: dict[str,str]
+    """
+    return _cached(global_settings_file(), _parse_registry) or {}
+
+
+def settings_file(uuid):
+    """
+    Return the path to the .vbox file of the VM with the given uuid
+
+    :param uuid: str
+    :return: str|None
+    """
+    return registered_vms().get(_uuid(uuid.strip()))
+
+
+def machine_settings(path):
+    """
+    Return the static settings stored in the given .vbox file
+
+    :param path: str
+    :return: dict[str,any]|None
+    """
+    return _cached(path, _parse_machine)
+
+
+def box_settings(box):
+    """
+    Return the static settings of the VM backing a box, the VM is found
+    using the vagrant machine index so this works even if VirtualBox is
+    not running
+
+    :param box: box.Box
+    :return: dict[str,any]|None
+    """
+    uuid = box.uuid()
+    if not uuid:
+        return None
+
+    path = settings_file(uuid)
+    if not path:
+        return None
+    return machine_settings(path)
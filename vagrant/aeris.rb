@@ -176,6 +176,8 @@ module AerisCloud
 
       doSync = true
       ssh_cmd = "ssh -l vagrant -i #{private_key}"
+      ssh_transport = "-o Compression=#{AerisCloud::Environment::SSH_COMPRESSION}"
+      ssh_transport += " -c #{AerisCloud::Environment::SSH_CIPHER}" unless AerisCloud::Environment::SSH_CIPHER.nil?
 
       if system "#{ssh_cmd} #{ip} '[ -d /data ]'" && $? == 0
         data_dir = "/data/#{@project.name}"
@@ -185,7 +187,7 @@ module AerisCloud
 
         system "#{ssh_cmd} #{box.ip} 'sudo mkdir -p #{data_dir} && sudo chown vagrant.vagrant #{data_dir}'"
         system "rsync --archive --hard-links --one-file-system --delete #{box.rsync_ignores} --compress-level=0 "\
-            "--omit-dir-times -e '#{ssh_cmd} -T -c arcfour -o Compression=no -x' ./ #{box.ip}:#{data_dir}/"
+            "--omit-dir-times -e '#{ssh_cmd} -T #{ssh_transport} -x' ./ #{box.ip}:#{data_dir}/"
         system "#{ssh_cmd} #{box.ip} 'mkdir -p #{project_dir} && sudo mount -o bind #{data_dir} #{project_dir}'"
       else
         @logger.info "/data disk not mounted and formatted yet. Skipping sync for now."
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+"""
+AerisCloud command agent, started in the box by the shell provisioner.
+
+Runs commands sent by aeris over a persistent TCP connection on the
+host-only interface, saving the ssh process startup, handshake and PTY
+allocation on every command. Only uses the standard library as it runs
+with the system python of the box.
+
+Every message is a frame made of a one byte type, the payload length as a
+4 bytes big endian integer and the payload:
+
+client -> agent
+  A  the authentication token, must be the first frame
+  X  a JSON object with the command to run in a login shell
+  K  a signal number to send to the running command
+
+agent -> client
+  A  an empty frame once the client is authenticated
+  O  a chunk of stdout
+  R  a chunk of stderr
+  C  the exit code of the command, once every output was sent
+  F  an error message, the connection is then closed
+"""
+
+import json
+import optparse
+import os
+import signal
+import socket
+import struct
+import subprocess
+import threading
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+HEADER = struct.Struct('!cI')
+DEVNULL = open(os.devnull, 'rb')
+
+
+def recv_exactly(sock, size):
+    data = []
+    while size:
+        chunk = sock.recv(size)
+        if not chunk:
+            raise EOFError()
+        data.append(chunk)
+        size -= len(chunk)
+    return b''.join(data)
+
+
+def recv_frame(sock):
+    kind, size = HEADER.unpack(recv_exactly(sock, HEADER.size))
+    return kind.decode(), recv_exactly(sock, size)
+
+
+def constant_time_equals(a, b):
+    # hmac.compare_digest is missing from the python 2.7.5 of CentOS 7
+    if len(a) != len(b):
+        return False
+    result = 0
+    for x, y in zip(bytearray(a), bytearray(b)):
+        result |= x ^ y
+    return result == 0
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.lock = threading.Lock()
+        self.process = None
+
+    def send(self, kind, payload=b''):
+        with self.lock:
+            self.request.sendall(HEADER.pack(kind.encode(), len(payload)) +
+                                 payload)
+
+    def pump(self, pipe, kind):
+        for chunk in iter(lambda: os.read(pipe.fileno(), 65536), b''):
+            self.send(kind, chunk)
+
+    def run(self, request):
+        self.process = subprocess.Popen(
+            ['bash', '-lc', request['cmd']],
+            cwd=os.path.expanduser('~'), stdin=DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=os.setsid)
+
+        pumps = [threading.Thread(target=self.pump, args=(pipe, kind))
+                 for pipe, kind in [(self.process.stdout, 'O'),
+                                    (self.process.stderr, 'R')]]
+        for pump in pumps:
+            pump.daemon = True
+            pump.start()
+
+        def _wait():
+            code = self.process.wait()
+            for pump in pumps:
+                pump.join()
+            # killed by a signal, mimic the shell exit code
+            if code < 0:
+                code = 128 - code
+            self.process = None
+            self.send('C', str(code).encode())
+
+        waiter = threading.Thread(target=_wait)
+        waiter.daemon = True
+        waiter.start()
+
+    def kill(self, signum):
+        process = self.process
+        if process:
+            try:
+                os.killpg(process.pid, signum)
+            except OSError:
+                pass
+
+    def handle(self):
+        try:
+            kind, token = recv_frame(self.request)
+            if kind != 'A' or \
+                    not constant_time_equals(token, self.server.token):
+                self.send('F', b'invalid token')
+                return
+            self.send('A')
+
+            while True:
+                kind, payload = recv_frame(self.request)
+                if kind == 'X':
+                    if self.process:
+                        self.send('F', b'a command is already running')
+                        return
+                    self.run(json.loads(payload.decode('utf-8')))
+                elif kind == 'K':
+                    self.kill(int(payload))
+                else:
+                    self.send('F', b'unknown frame type')
+                    return
+        except (EOFError, socket.error):
+            pass
+        finally:
+            # the client went away, do not leave its command running
+            self.kill(signal.SIGTERM)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--host', default='0.0.0.0')
+    parser.add_option('--port', type='int', default=7900)
+    parser.add_option('--token-file',
+                      default=os.path.expanduser('~/.aeriscloud-agent.token'))
+    options, _ = parser.parse_args()
+
+    with open(options.token_file, 'rb') as fd:
+        token = fd.read().strip()
+
+    server = Server((options.host, options.port), Handler)
+    server.token = token
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,14 @@ module AerisCloud
     ANSIBLE_TAGS = ENV['tags']
     ANSIBLE_SKIP_TAGS = ENV['skip_tags']
 
+    # SSH transport, see aeris sync --benchmark
+    SSH_CIPHER = ENV['AERISCLOUD_SSH_CIPHER']
+    SSH_COMPRESSION = ENV['AERISCLOUD_SSH_COMPRESSION'] || "no"
+
+    # Command agent, only installed when a token is given
+    AGENT_TOKEN = ENV['AERISCLOUD_AGENT_TOKEN']
+    AGENT_PORT = ENV['AERISCLOUD_AGENT_PORT'] || "7900"
+
     # NFS options
     NFS_MOUNT_OPTIONS =  [
       'fsc', 'vers=3', 'tcp', 'nosuid', 'nodev', 'noatime', 'nodiratime', 'nolock', 'async',